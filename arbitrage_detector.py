@@ -6,68 +6,363 @@ opportunities among them.
 
 import config
 import logging
+import math
+import time
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from cycle_detector import CycleDetector, Market
+from instruments import (convert_amounts, currency_unit, exchange_of,
+                         instrument_of, split_instrument)
+from itertools import accumulate, islice
+from metrics import metrics
+from operator import attrgetter, itemgetter, mul, neg
+from order_book import OrderBook
+
+# Maps an exchange name to the config entry of its commission rate.  Other
+# markets (eg, in tests) have no commission.
+_COMMISSION_RATE_NAMES = {
+    'Bitstamp': 'bitstamp_rate',
+    'BTC-E': 'btce_rate',
+    'CampBX': 'compbx_rate',
+    'MtGox': 'mtgox_rate',
+}
+
+def commission_rate(market):
+  """ Returns the commission rate of a market (see config.py).
+  """
+  return getattr(config, _COMMISSION_RATE_NAMES.get(exchange_of(market), ''),
+                 0.0)
+
+_OPPORTUNITY_FIELDS = ('buy_market', 'sell_market', 'buys', 'sells',
+                       'min_buy_price', 'max_buy_price', 'weighted_buy_price',
+                       'min_sell_price', 'max_sell_price',
+                       'weighted_sell_price', 'amount', 'pay', 'paid')
+_opportunity_values = attrgetter(*_OPPORTUNITY_FIELDS)
 
 class ArbitrageOpportunity(object):
+  """ An immutable arbitrage opportunity, which can be hashed (eg, to tell
+      the same opportunity in consecutive rounds, see
+      opportunity_tracker.py).  All the price data is in cents, and amount
+      data in satoshis.  The buys and sells are tuples of (price, amount)
+      tuples.
+  """
+  __slots__ = _OPPORTUNITY_FIELDS + ('_hash',)
+
   def __init__(self, buy_market, sell_market, buys, sells,
                min_buy_price, max_buy_price, weighted_buy_price,
                min_sell_price, max_sell_price, weighted_sell_price,
                amount, pay, paid):
-    # All the price data is in cents, and amount data in satoshis.
-    self.buy_market = buy_market
-    self.sell_market = sell_market
-    self.buys = buys
-    self.sells = sells
-    self.min_buy_price = min_buy_price
-    self.max_buy_price = max_buy_price
-    self.weighted_buy_price = weighted_buy_price
-    self.min_sell_price = min_sell_price
-    self.max_sell_price = max_sell_price
-    self.weighted_sell_price = weighted_sell_price
-    self.amount = amount
-    self.pay = pay
-    self.paid = paid
+    values = (buy_market, sell_market, tuple(map(tuple, buys)),
+              tuple(map(tuple, sells)), min_buy_price, max_buy_price,
+              weighted_buy_price, min_sell_price, max_sell_price,
+              weighted_sell_price, amount, pay, paid)
+    for name, value in zip(_OPPORTUNITY_FIELDS, values):
+      object.__setattr__(self, name, value)
+    object.__setattr__(self, '_hash', hash(values))
+
+  def __setattr__(self, name, value):
+    raise AttributeError('ArbitrageOpportunity is immutable')
+
+  def __delattr__(self, name):
+    raise AttributeError('ArbitrageOpportunity is immutable')
+
+  def __reduce__(self):
+    return (self.__class__, _opportunity_values(self))
+
+  def __hash__(self):
+    return self._hash
 
   def __eq__(self, other):
     if isinstance(other, self.__class__):
-      return self.__dict__ == other.__dict__
+      return (self._hash == other._hash and
+              _opportunity_values(self) == _opportunity_values(other))
     return False
 
   def __ne__(self, other):
     return not self.__eq__(other)
 
   def __str__(self):
-    return '%s' % self.__dict__
+    return '%s' % dict(zip(_OPPORTUNITY_FIELDS, _opportunity_values(self)))
+
+def _negated_price(level):
+  return -level[0]
+
+class _Side(object):
+  """ A columnar view of one side of an order book (asks or bids).
+
+  The prices and amounts are kept in contiguous arrays, together with the
+  cumulative volumes of the top levels, so that the matched volume of a pair
+  can be found by binary search instead of walking the levels one by one.
+  The volumes are only accumulated over the levels that cross the other
+  side of a pair (see crossing()), which are usually few.
+  """
+  __slots__ = ('prices', 'amounts', 'ascending', 'truncated', 'volumes')
+
+  def __init__(self, prices, amounts, ascending, truncated=False):
+    """ 'truncated' tells that the side was cut to a depth budget (see
+        OrderBook.asks_truncated).
+    """
+    self.prices = prices
+    self.amounts = amounts
+    self.ascending = ascending
+    self.truncated = truncated
+    # The volumes of the first k levels, for k = 0..n, where n only grows
+    # as far as needed (see accumulate()).
+    self.volumes = array('q', [0])
+
+  @classmethod
+  def from_list(cls, price_amount_list, ascending):
+    return cls(array('q', [price for price, _ in price_amount_list]),
+               array('q', [amount for _, amount in price_amount_list]),
+               ascending)
+
+  def crossing(self, price):
+    """ Returns the number of top levels that cross a price of the other
+        side, ie, asks below a bid or bids above an ask.
+    """
+    if self.ascending:
+      return bisect_left(self.prices, price)
+    return bisect_left(self.prices, -price, key=neg)
+
+  def accumulate(self, count):
+    """ Extends the cumulative volumes over the first 'count' levels.
+    """
+    n = len(self.volumes) - 1
+    if count > n:
+      # The initial value is already there.
+      self.volumes.extend(islice(accumulate(self.amounts[n:count],
+                                            initial=self.volumes[-1]), 1, None))
+
+  def level(self, volume):
+    """ Returns the index of the level where the given volume falls in.
+    """
+    return bisect_right(self.volumes, volume) - 1
+
+  def take(self, volume):
+    """ Returns the consolidated (price, amount) list of the top levels
+        covering a volume, and the total value of the volume.
+    """
+    k = bisect_left(self.volumes, volume)
+    prices = self.prices[:k]
+    # All the levels are taken whole, but the last one.
+    amounts = self.amounts[:k].tolist()
+    amounts[-1] = volume - self.volumes[k - 1]
+    levels = []
+    last_price = None
+    for price, amount in zip(prices, amounts):
+      if price == last_price:
+        levels[-1] = (price, levels[-1][1] + amount)
+      else:
+        levels.append((price, amount))
+        last_price = price
+    return levels, sum(map(mul, prices, amounts))
+
+def _last_true(volumes, count, predicate):
+  """ Returns the last of the first 'count' volumes satisfying the
+      predicate, or None.  The predicate must be monotonically decreasing.
+  """
+  lo, hi = 0, count
+  while lo < hi:
+    mid = (lo + hi) // 2
+    if predicate(volumes[mid]):
+      lo = mid + 1
+    else:
+      hi = mid
+  if lo == 0:
+    return None
+  return volumes[lo - 1]
 
 class ArbitrageDetector(object):
   def __init__(self, fixed_marginal_profit_rate=None):
     self.fixed_marginal_profit_rate = fixed_marginal_profit_rate
+    # Maps (buy market, fingerprint, sell market, fingerprint, marginal
+    # profit rate) to the opportunity (or None) of the pair, in LRU order,
+    # so only the pairs with a changed order book are processed again.
+    self.pair_cache = OrderedDict()
+    # Maps id(order_book) to the (order book, fingerprint) of the last
+    # round, so an order book that is the same object as in the last round
+    # is not fingerprinted again.
+    self.fingerprints = dict()
+    # Maps a market name to its (cash value, bitcoin value) in dollars.
+    self.balances = dict()
+    # Maps a market name to its index in the threshold matrix, where
+    # thresholds[i][j] is the marginal profit rate required for buying in
+    # market i and selling in market j.
+    self.market_index = dict()
+    self.thresholds = []
+    self.min_threshold = None
 
-  def process(self, order_books):
+  def process(self, order_books, now=None):
     """
     Args:
       order_books: A list of (market_name, order_book) tuples.  Each order book
                    should have been converted and validated (ie, the prices are
                    in cents and the amounts are in satoshis; asks and bids are
                    properly ordered etc).
+      now: The current time, to tell the age of the order books (see
+           OrderBook.age()); defaults to time.time().
     Returns: A list of arbitrage opportunities.
     """
+    with metrics.span('detect'):
+      return self._process(order_books, now)
+
+  def _process(self, order_books, now):
     if not config.skip_order_books_with_matching_orders:
       order_books = [(item[0], item[1]) for item in order_books
           if not self.has_matching_orders(item[0], item[1])]
+    if now is None:
+      now = time.time()
+    ages = [self._age(order_book, now) for _, order_book in order_books]
+    if config.max_order_book_age_sec is not None:
+      fresh = [i for i in range(len(order_books))
+               if ages[i] <= config.max_order_book_age_sec]
+      if len(fresh) < len(order_books):
+        logging.info('Skipping %d stale order books' %
+                     (len(order_books) - len(fresh)))
+        order_books = [order_books[i] for i in fresh]
+        ages = [ages[i] for i in fresh]
     logging.info('Processing %d order books' % len(order_books))
+    fingerprints = self._update_fingerprints(order_books)
+    new_markets = [name for name in OrderedDict.fromkeys(
+        name for name, _ in order_books) if name not in self.market_index]
+    if new_markets:
+      self._build_thresholds(list(self.market_index.keys()) + new_markets)
+    markets = [self.market_index[name] for name, _ in order_books]
+    # The columns of an order book are built once for all its pairs, and
+    # only if it is in a candidate pair.
+    columns = dict()
     opportunities = []
-    for i in range(len(order_books)):
-      for j in range(len(order_books)):
-        if i == j:
-          continue
-        opportunity = self.process_pair(
+    for i, j in self._candidate_pairs(order_books, self.min_threshold):
+      threshold = self.thresholds[markets[i]][markets[j]]
+      # Stale order books need a larger margin.  The age is bucketed, so
+      # the key of an unchanged pair does not change every round.
+      stale_sec = 0.0
+      if config.stale_profit_rate_per_sec:
+        bucket_sec = config.stale_age_bucket_sec
+        stale_sec = math.ceil(max(ages[i], ages[j]) / bucket_sec) * bucket_sec
+      marginal_profit_rate = (
+          threshold + config.stale_profit_rate_per_sec * stale_sec)
+      key = (order_books[i][0], fingerprints[i], order_books[j][0],
+             fingerprints[j], threshold, config.stale_profit_rate_per_sec,
+             stale_sec)
+      if key in self.pair_cache:
+        self.pair_cache.move_to_end(key)
+        opportunity = self.pair_cache[key]
+        metrics.count('detection_cache_hits')
+      else:
+        for k in (i, j):
+          if k not in columns:
+            columns[k] = self._columns(order_books[k][1])
+        opportunity = self._process_columns(
             order_books[i][0], order_books[j][0],
-            order_books[i][1]['asks'], order_books[j][1]['bids'])
-        if opportunity is not None:
-          logging.debug('Found opportunity: %s' % opportunity)
-          opportunities.append(opportunity)
+            columns[i][0], columns[j][1], marginal_profit_rate)
+        self.pair_cache[key] = opportunity
+        if len(self.pair_cache) > config.detection_cache_size:
+          self.pair_cache.popitem(last=False)
+        metrics.count('detection_cache_misses')
+      if opportunity is not None:
+        logging.debug('Found opportunity: %s' % opportunity)
+        opportunities.append(opportunity)
     return opportunities
 
+  def _update_fingerprints(self, order_books):
+    """ Returns the fingerprints of the order books, and keeps them for the
+        next round.
+    """
+    fingerprints = dict()
+    result = []
+    for _, order_book in order_books:
+      cached = self.fingerprints.get(id(order_book), None)
+      if cached is not None and cached[0] is order_book:
+        fingerprint = cached[1]
+      else:
+        fingerprint = self._fingerprint(order_book)
+      fingerprints[id(order_book)] = (order_book, fingerprint)
+      result.append(fingerprint)
+    self.fingerprints = fingerprints
+    return result
+
+  def _fingerprint(self, order_book):
+    """ Returns a fingerprint of the content of an order book, equal for
+        equal order books (with a 64-bit checksum for the rest).
+    """
+    if isinstance(order_book, OrderBook):
+      columns = [memoryview(column).cast('B') for column in (
+          order_book.ask_prices, order_book.ask_amounts,
+          order_book.bid_prices, order_book.bid_amounts)]
+    else:
+      columns = [array('q', [value for level in order_book[key]
+                             for value in level]).tobytes()
+                 for key in ('asks', 'bids')]
+    crc, adler = 0, 1
+    for column in columns:
+      crc = zlib.crc32(column, crc)
+      adler = zlib.adler32(column, adler)
+    return (len(order_book['asks']), len(order_book['bids']), crc, adler)
+
+  def _candidate_pairs(self, order_books, marginal_profit_rate):
+    """ Returns the sorted (i, j) index pairs of the order books that can
+        make an opportunity from buying in i and selling in j.
+
+    An opportunity needs the best bid of j to beat the best ask of i by the
+    marginal profit rate.  With the best asks in ascending order and the best
+    bids in descending order, the candidate sellers of a buyer are a prefix
+    of the bids, and the candidate buyers are a prefix of the asks, so a
+    round without opportunities only costs the sorting.
+    """
+    best_asks, best_bids = [], []
+    for k, (_, order_book) in enumerate(order_books):
+      asks, bids = order_book['asks'], order_book['bids']
+      if len(asks) > 0:
+        best_asks.append((asks[0][0], k))
+      if len(bids) > 0:
+        best_bids.append((-bids[0][0], k))
+    best_asks.sort()
+    best_bids.sort()
+    pairs = []
+    for ask, i in best_asks:
+      num_sellers = 0
+      for bid, j in best_bids:
+        # The same profit rate as for the first level in _process_columns().
+        if (-bid - ask) / ask <= marginal_profit_rate:
+          break
+        num_sellers += 1
+        if i != j:
+          pairs.append((i, j))
+      if num_sellers == 0:
+        # No higher ask can beat the best bid either.
+        break
+    pairs.sort()
+    return pairs
+
+  def process_cycles(self, order_books, inventory=None):
+    """ Detects multi-leg arbitrage cycles through the markets (see
+        cycle_detector.py), with the order books in the same format as for
+        process(), for any instruments.  'inventory' is the set of
+        (exchange name, currency) holdings available, eg, ('Bitstamp',
+        'BTC'), or None for all.
+        Returns a list of cycle_detector.CycleOpportunities.
+    """
+    marginal_profit_rate = self.fixed_marginal_profit_rate
+    if marginal_profit_rate is None:
+      marginal_profit_rate = config.marginal_profit_rate_normal
+    markets = []
+    for name, order_book in order_books:
+      base, quote = split_instrument(instrument_of(name))
+      # A node of the cycle graph holds a currency in its smallest unit,
+      # whether it is traded as a base or a quote currency (eg, EUR in
+      # EUR/USD and BTC/EUR), so the amounts are converted from 1e-8.
+      base_unit = currency_unit(base)
+      if base_unit != currency_unit('BTC'):
+        order_book = convert_amounts(order_book, base_unit)
+      markets.append(Market(exchange_of(name), base, quote, order_book,
+                            self._commission_rate(name), base_unit))
+    with metrics.span('detect_cycles'):
+      return CycleDetector(marginal_profit_rate, config.max_cycles).process(
+          markets, inventory)
+
   def has_matching_orders(self, market_name, order_book):
     """ Detects whether an order book contains matching orders
         (ie, asking price <= bidding price).
@@ -88,46 +383,150 @@ class ArbitrageDetector(object):
         ('asks') and selling high in the other ('bids'), or None if there is
         no such opportunity.
     """
+    i, j = self._market_index(buy_market), self._market_index(sell_market)
     if len(asks) == 0 or len(bids) == 0:
       return None
+    # Only the levels that cross are converted to columns.
+    num_asks = bisect_left(asks, bids[0][0], key=itemgetter(0))
+    num_bids = bisect_left(bids, -asks[0][0], key=_negated_price)
+    return self._process_columns(
+        buy_market, sell_market,
+        _Side.from_list(asks[:num_asks], ascending=True),
+        _Side.from_list(bids[:num_bids], ascending=False),
+        self.thresholds[i][j])
+
+  def update_balances(self, balances):
+    """ Updates the balances of markets, as a dict mapping a market name to
+        its (cash value, bitcoin value) in dollars, and refreshes the
+        thresholds.
+    """
+    self.balances.update(balances)
+    self._build_thresholds(list(self.market_index.keys()) +
+                           [name for name in balances
+                            if name not in self.market_index])
+
+  def _market_index(self, market):
+    """ Returns the index of a market in the threshold matrix, adding the
+        market if it is new.
+    """
+    index = self.market_index.get(market, None)
+    if index is None:
+      self._build_thresholds(list(self.market_index.keys()) + [market])
+      index = self.market_index[market]
+    return index
+
+  def _build_thresholds(self, markets):
+    """ Builds the threshold matrix of the markets.
+
+    The profit rate of buying in A and selling in B is approximated by
+    (sell - buy) / buy - (cr(A) + cr(B)), where cr(X) is the commission rate
+    of market X (see config.py), so the threshold on (sell - buy) / buy is
+    the marginal profit rate plus both commission rates.  The marginal
+    profit rate is the higher of the buying rate of A and the selling rate
+    of B, by their balances.
+    """
+    self.market_index = dict((market, i) for i, market in enumerate(markets))
+    if self.fixed_marginal_profit_rate is not None:
+      # Override for testing.
+      self.thresholds = [[self.fixed_marginal_profit_rate] * len(markets)
+                         for _ in markets]
+    else:
+      rates = [self._marginal_profit_rates(market) for market in markets]
+      commissions = [self._commission_rate(market) for market in markets]
+      self.thresholds = [[max(rates[i][0], rates[j][1]) + commissions[i] +
+                          commissions[j] for j in range(len(markets))]
+                         for i in range(len(markets))]
+    self.min_threshold = min(
+        [threshold for row in self.thresholds for threshold in row] or [0.0])
+
+  def _commission_rate(self, market):
+    return commission_rate(market)
+
+  def _marginal_profit_rates(self, market):
+    """ Returns the (buying, selling) marginal profit rates of a market by
+        its cash/bitcoin ratio.
+    """
+    normal = config.marginal_profit_rate_normal
+    cash, bitcoin = self.balances.get(market, (0, 0))
+    if max(cash, bitcoin) <= 0 or (min(cash, bitcoin) / max(cash, bitcoin) >
+                                   config.asset_ratio_low):
+      return normal, normal
+    if cash < bitcoin:
+      # Short on cash: buy less eagerly and sell more eagerly.
+      return config.marginal_profit_rate_high, config.marginal_profit_rate_low
+    return config.marginal_profit_rate_low, config.marginal_profit_rate_high
+
+  def _age(self, order_book, now):
+    """ Returns the age of an order book in seconds, 0 if unknown.
+    """
+    age = None
+    if isinstance(order_book, OrderBook):
+      age = order_book.age(now)
+    return age if age is not None else 0.0
+
+  def _columns(self, order_book):
+    """ Returns the (asks, bids) columns of an order book.
+    """
+    if isinstance(order_book, OrderBook):
+      return (_Side(order_book.ask_prices, order_book.ask_amounts,
+                    ascending=True, truncated=order_book.asks_truncated),
+              _Side(order_book.bid_prices, order_book.bid_amounts,
+                    ascending=False, truncated=order_book.bids_truncated))
+    return (_Side.from_list(order_book['asks'], ascending=True),
+            _Side.from_list(order_book['bids'], ascending=False))
+
+  def _process_columns(self, buy_market, sell_market, asks, bids,
+                       marginal_profit_rate):
+    if len(asks.prices) == 0 or len(bids.prices) == 0:
+      return None
     # Limit the asks and bids of interest to the top entries.  Specifically,
     # we do not care about asks above the first (highest) bid or bids below
     # the first (lowest) ask.
-    # TODO: This is a bit awkward; maybe should use lists everywhere.
-    good_asks = [list(ask) for ask in asks if ask[0] < bids[0][0]]
-    good_bids = [list(bid) for bid in bids if bid[0] > asks[0][0]]
-    if len(good_asks) == 0 or len(good_bids) == 0:
+    num_asks = asks.crossing(bids.prices[0])
+    num_bids = bids.crossing(asks.prices[0])
+    if num_asks == 0 or num_bids == 0:
       return None
-    # Walk down both lists and increase the trading volume as long as the
-    # marginal profit rate is satisfied.
-    marginal_profit_rate = config.marginal_profit_rate_normal
-    # Override for testing.
-    if self.fixed_marginal_profit_rate is not None:
-      marginal_profit_rate = self.fixed_marginal_profit_rate
-    i, j = 0, 0
-    buys, sells = [], []
-    while True:
-      if i >= len(good_asks) or j >= len(good_bids):
-        break
-      profit_rate = (good_bids[j][0] - good_asks[i][0]) / good_asks[i][0]
-      if profit_rate <= marginal_profit_rate:
-        break
-      if good_asks[i][1] < good_bids[j][1]:
-        buys.append((good_asks[i][0], good_asks[i][1]))
-        sells.append((good_bids[j][0], good_asks[i][1]))
-        good_bids[j][1] -= good_asks[i][1]
-        i += 1
-      elif good_asks[i][1] > good_bids[j][1]:
-        buys.append((good_asks[i][0], good_bids[j][1]))
-        sells.append((good_bids[j][0], good_bids[j][1]))
-        good_asks[i][1] -= good_bids[j][1]
-        j += 1
-      else:
-        buys.append((good_asks[i][0], good_asks[i][1]))
-        sells.append((good_bids[j][0], good_bids[j][1]))
-        i += 1
-        j += 1
-    return self._process_buys_sells(buy_market, sell_market, buys, sells)
+    asks.accumulate(num_asks)
+    bids.accumulate(num_bids)
+    # Conceptually, we walk down both lists and increase the trading volume
+    # as long as the marginal profit rate is satisfied.  The walk consists of
+    # segments, each starting where an ask or a bid level starts, and the
+    # profit rate of a segment decreases monotonically along the walk, so
+    # the last profitable segment can be found by binary search on the
+    # cumulative volumes of either side.
+    limit = min(asks.volumes[num_asks], bids.volumes[num_bids])
+
+    def profitable(volume):
+      if volume >= limit:
+        return False
+      ask_price = asks.prices[asks.level(volume)]
+      bid_price = bids.prices[bids.level(volume)]
+      return (bid_price - ask_price) / ask_price > marginal_profit_rate
+
+    ask_start = _last_true(asks.volumes, num_asks, profitable)
+    bid_start = _last_true(bids.volumes, num_bids, profitable)
+    if ask_start is None or bid_start is None:
+      return None
+    start = max(ask_start, bid_start)
+    amount = min(asks.volumes[asks.level(start) + 1],
+                 bids.volumes[bids.level(start) + 1])
+    # Only an order book cut to a depth budget may have had deeper levels
+    # to take.
+    if ((asks.truncated and num_asks == len(asks.prices) and
+         amount == asks.volumes[num_asks]) or
+        (bids.truncated and num_bids == len(bids.prices) and
+         amount == bids.volumes[num_bids])):
+      logging.warning('Opportunity from %s to %s consumes a whole side of an'
+                      ' order book, consider raising config.depth_budget' %
+                      (buy_market, sell_market))
+    buys, pay = asks.take(amount)
+    sells, paid = bids.take(amount)
+    divider = 100000000.0
+    return ArbitrageOpportunity(
+        buy_market, sell_market, buys, sells,
+        buys[0][0], buys[-1][0], self._round(pay/float(amount)),
+        sells[-1][0], sells[0][0], self._round(paid/float(amount)),
+        amount, self._round(pay/divider), self._round(paid/divider))
 
   def _process_buys_sells(self, buy_market, sell_market, buys, sells):
     assert len(buys) == len(sells)
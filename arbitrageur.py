@@ -1,52 +1,135 @@
 #!/usr/bin/python3
 
 import argparse
+import asyncio
 import config
 import logging
 from arbitrage_detector import ArbitrageDetector
+from book_archive import BookArchiveWriter
+from instruments import DEFAULT_INSTRUMENT, group_by_instrument, instrument_of
 from market_watcher import MarketWatcher
+from metrics import metrics, start_exporters
+from opportunity_sink import JournalSink, LogSink
+from opportunity_tracker import DISAPPEARED, OpportunityTracker
 from os import environ
-from time import sleep, tzset
+from recorder import Recorder, ReplayMarketWatcher
+from time import sleep, time, tzset
 
 class Arbitrageur(object):
-  def __init__(self):
-    self.market_watcher = MarketWatcher()
+  def __init__(self, market_watcher=None):
+    if market_watcher is None:
+      market_watcher = MarketWatcher()
+    self.market_watcher = market_watcher
     self.arbitrage_detector = ArbitrageDetector()
+    # Maps an instrument to its detector, so that the caches of the
+    # detectors (see ArbitrageDetector.pair_cache) are kept per instrument.
+    self.arbitrage_detectors = {DEFAULT_INSTRUMENT: self.arbitrage_detector}
+    # The sinks of the opportunities found (see opportunity_sink.py).
+    self.opportunity_sinks = [LogSink()]
+    self.opportunity_tracker = OpportunityTracker()
 
   def run(self):
     while True:
       order_books = self.market_watcher.get_order_books()
-      logging.info('Received %d order books' % len(order_books))
-      opportunities = self.arbitrage_detector.process(order_books)
-      logging.info('Detected %d opportunities' % len(opportunities))
-      for opportunity in opportunities:
-        self._log_opportunity(opportunity)
+      self._process_order_books(order_books)
       sleep(config.sleep_between_rounds_sec)
 
-  def _log_opportunity(self, opportunity):
-    buy_market = opportunity.buy_market
-    sell_market = opportunity.sell_market
-    buy_price = opportunity.weighted_buy_price / 100.0
-    sell_price = opportunity.weighted_sell_price / 100.0
-    amount = opportunity.amount / 100000000.0
-    pay = opportunity.pay / 100.0
-    paid = opportunity.paid / 100.0
-    profit = paid - pay
-    rate = 0.0
-    # Sometimes the trading amount is so small (eg, 10 satoshis) that
-    # the pay is rounded down to 0 cents.
-    if pay > 0:
-      rate = profit * 100 / pay
-    marginal_rate = ((opportunity.min_sell_price - opportunity.max_buy_price) *
-                     100.0) / opportunity.max_buy_price
-    logging.info('Opportunity: buy=%.2f sell=%.2f from=%s to=%s amount=%.8f'
-                 ' pay=%.2f paid=%.2f profit=%.2f rate=%.2f%% mrate=%.2f%%'
-                 % (buy_price, sell_price, buy_market, sell_market, amount,
-                    pay, paid, profit, rate, marginal_rate))
+  def run_replay(self):
+    """ Runs through all the rounds of a ReplayMarketWatcher without
+        sleeping, and returns the number of rounds.
+    """
+    rounds = 0
+    while True:
+      order_books = self.market_watcher.get_order_books()
+      if order_books is None:
+        return rounds
+      self._process_order_books(order_books)
+      rounds += 1
+
+  def run_async(self):
+    """ Runs the detector whenever an order book changes, instead of in
+        fixed rounds.
+    """
+    asyncio.run(self._run_async())
+
+  async def _run_async(self):
+    async for order_books in self.market_watcher.watch_order_books():
+      self._process_order_books(order_books)
+
+  def _process_order_books(self, order_books):
+    logging.info('Received %d order books' % len(order_books))
+    # Only the order books of the same instrument are comparable.  The
+    # groups are processed in turn, as the detection is CPU-bound.
+    opportunities = []
+    groups = group_by_instrument(order_books)
+    for instrument in sorted(groups.keys()):
+      if instrument not in self.arbitrage_detectors:
+        self.arbitrage_detectors[instrument] = ArbitrageDetector()
+      # A pair of converted order books (see group_by_instrument()) is
+      # already processed in its own instrument.
+      opportunities.extend(
+          opportunity for opportunity in
+          self.arbitrage_detectors[instrument].process(groups[instrument])
+          if instrument in (instrument_of(opportunity.buy_market),
+                            instrument_of(opportunity.sell_market)))
+    logging.info('Detected %d opportunities' % len(opportunities))
+    now = time()
+    if config.track_opportunities:
+      opportunities = self._track_opportunities(opportunities, now)
+    for opportunity in opportunities:
+      for sink in self.opportunity_sinks:
+        sink.add(opportunity, now)
+    if config.detect_cycles:
+      for cycle in self.arbitrage_detector.process_cycles(order_books):
+        logging.info('Cycle: currency=%s amount=%d profit=%d rate=%.2f%%'
+                     ' legs=%s' % (cycle.currency, cycle.amount,
+                                   cycle.profit, cycle.rate * 100,
+                                   cycle.legs))
+
+  def _track_opportunities(self, opportunities, now):
+    """ Returns the opportunities that appeared or changed since the last
+        round, and logs the ones that disappeared.
+    """
+    result = []
+    for event in self.opportunity_tracker.update(opportunities, now):
+      if event.kind != DISAPPEARED:
+        result.append(event.opportunity)
+        continue
+      logging.info('Opportunity gone: from=%s to=%s after %d rounds'
+                   ' (%.1f seconds)' % (event.opportunity.buy_market,
+                                        event.opportunity.sell_market,
+                                        event.rounds, now - event.first_seen))
+    return result
 
 def main():
   parser = argparse.ArgumentParser()
   parser.add_argument('--verbose', action='store_true')
+  parser.add_argument('--async', dest='use_async', action='store_true',
+                      help='Poll each exchange on its own schedule and run'
+                           ' the detector whenever an order book changes.')
+  parser.add_argument('--record',
+                      help='Append the raw content from the exchanges to'
+                           ' this recording file.')
+  parser.add_argument('--archive',
+                      help='Append the converted order books of every round'
+                           ' to this archive file.')
+  parser.add_argument('--journal',
+                      help='Append the opportunities to this binary journal'
+                           ' file.')
+  parser.add_argument('--metrics_file',
+                      help='Periodically write the latency metrics to this'
+                           ' json file.')
+  parser.add_argument('--metrics_port', type=int, default=None,
+                      help='Serve the latency metrics as json on this local'
+                           ' port.')
+  parser.add_argument('--processes', action='store_true',
+                      help='Run each exchange watcher in a worker process.')
+  parser.add_argument('--replay',
+                      help='Replay a recording file instead of talking to'
+                           ' the exchanges, and report the throughput.')
+  parser.add_argument('--replay_speed', type=float, default=None,
+                      help='Replay at this multiple of the recorded speed'
+                           ' (default: as fast as possible).')
   args = parser.parse_args()
   environ['TZ'] = 'US/Pacific'
   tzset()
@@ -55,8 +138,46 @@ def main():
     level = logging.DEBUG
   logging.basicConfig(format='[%(levelname)s] %(asctime)s %(message)s',
                       level=level)
-  arbitrageur = Arbitrageur()
-  arbitrageur.run()
+  if args.metrics_file:
+    config.metrics_snapshot_file = args.metrics_file
+  if args.metrics_port is not None:
+    config.metrics_port = args.metrics_port
+  if (config.metrics_enabled or config.metrics_snapshot_file is not None or
+      config.metrics_port is not None):
+    start_exporters()
+  if args.processes:
+    config.watcher_processes = True
+  if args.replay:
+    arbitrageur = Arbitrageur(ReplayMarketWatcher(args.replay,
+                                                  args.replay_speed))
+  else:
+    arbitrageur = Arbitrageur()
+  if args.journal:
+    arbitrageur.opportunity_sinks.append(JournalSink(args.journal))
+  try:
+    if args.replay:
+      start = time()
+      rounds = arbitrageur.run_replay()
+      seconds = time() - start
+      print('Replayed %d rounds in %.3f seconds (%.1f rounds/sec)' %
+            (rounds, seconds, rounds / seconds if seconds > 0 else 0))
+      if config.metrics_snapshot_file is not None:
+        metrics.write_snapshot(config.metrics_snapshot_file)
+      return
+    if args.record:
+      arbitrageur.market_watcher.start_recording(Recorder(args.record))
+    if args.archive:
+      arbitrageur.market_watcher.start_archiving(
+          BookArchiveWriter(args.archive))
+    if args.use_async:
+      arbitrageur.run_async()
+    else:
+      arbitrageur.run()
+  finally:
+    for sink in arbitrageur.opportunity_sinks:
+      sink.close()
+    if not args.replay:
+      arbitrageur.market_watcher.close()
 
 if __name__ == '__main__':
   main()
@@ -0,0 +1,223 @@
+#!/usr/bin/python3
+
+""" A parallel backtest engine over archived order books.
+
+The history in an archive (see book_archive.py) is split into time shards,
+and the arbitrage detector runs over each shard in a separate process, with
+a given set of config parameters (eg, marginal_profit_rate_normal).  The
+per-pair opportunity statistics of the shards are then merged.  With a
+parameter sweep, every combination of parameter values is run over every
+shard, keeping all the cores busy.
+
+Eg:
+    backtest.py --archive books --sweep marginal_profit_rate_normal=0.01,0.02
+"""
+
+import argparse
+import config
+import itertools
+import logging
+import os
+from arbitrage_detector import ArbitrageDetector
+from book_archive import BookArchiveReader
+from concurrent.futures import ProcessPoolExecutor
+from instruments import format_price, pair_instrument, split_instrument
+
+class PairStats(object):
+  """ Statistics of the opportunities of buying in one market and selling in
+      another.  Prices are in cents and amounts in satoshis.
+  """
+  __slots__ = ('count', 'amount', 'pay', 'paid', 'max_profit')
+
+  def __init__(self):
+    self.count = 0
+    self.amount = 0
+    self.pay = 0
+    self.paid = 0
+    self.max_profit = 0
+
+  @property
+  def profit(self):
+    return self.paid - self.pay
+
+  def add(self, opportunity):
+    self.count += 1
+    self.amount += opportunity.amount
+    self.pay += opportunity.pay
+    self.paid += opportunity.paid
+    self.max_profit = max(self.max_profit, opportunity.paid - opportunity.pay)
+
+  def merge(self, other):
+    self.count += other.count
+    self.amount += other.amount
+    self.pay += other.pay
+    self.paid += other.paid
+    self.max_profit = max(self.max_profit, other.max_profit)
+
+class BacktestResult(object):
+  def __init__(self):
+    self.rounds = 0
+    # Maps (buy market, sell market) to PairStats.
+    self.pairs = dict()
+
+  def add(self, opportunity):
+    key = (opportunity.buy_market, opportunity.sell_market)
+    if key not in self.pairs:
+      self.pairs[key] = PairStats()
+    self.pairs[key].add(opportunity)
+
+  def merge(self, other):
+    self.rounds += other.rounds
+    for key, stats in other.pairs.items():
+      if key not in self.pairs:
+        self.pairs[key] = PairStats()
+      self.pairs[key].merge(stats)
+
+def read_rounds(reader, start, end, timestamps=False):
+  """ Yields the rounds of snapshots [start, end) of an archive reader, as
+      lists of (exchange name, order book) tuples.  With 'timestamps', the
+      order books get the timestamps of their snapshots, and the rounds are
+      yielded as (timestamp, order books) tuples instead, where the
+      timestamp is that of the latest snapshot of the round.
+  """
+  order_books = []
+  last_round, timestamp = None, None
+  for i in range(start, end):
+    snapshot = reader.snapshot(i)
+    if order_books and snapshot.round != last_round:
+      yield (timestamp, order_books) if timestamps else order_books
+      order_books = []
+    if timestamps:
+      snapshot.order_book.timestamp = snapshot.timestamp
+    order_books.append((snapshot.exchange_name, snapshot.order_book))
+    last_round, timestamp = snapshot.round, snapshot.timestamp
+  if order_books:
+    yield (timestamp, order_books) if timestamps else order_books
+
+def round_start(reader, i):
+  """ Returns the index of the first snapshot of the round of snapshot i.
+  """
+  round_number = reader.entry(i).round
+  while i > 0 and reader.entry(i - 1).round == round_number:
+    i -= 1
+  return i
+
+def create_shards(reader, num_shards):
+  """ Splits the snapshots of an archive into about 'num_shards' time shards
+      of equal duration, as (start, end) ranges of snapshot indices.  A round
+      is never split across shards.
+  """
+  if len(reader) == 0:
+    return []
+  first = reader.entry(0).timestamp
+  last = reader.entry(len(reader) - 1).timestamp
+  duration = (last - first) / num_shards
+  boundaries = [0]
+  for k in range(1, num_shards):
+    i = max(reader.find(first + k * duration), boundaries[-1])
+    # Move the boundary to the start of the next round.
+    while 0 < i < len(reader) and (reader.entry(i).round ==
+                                   reader.entry(i - 1).round):
+      i += 1
+    if i > boundaries[-1] and i < len(reader):
+      boundaries.append(i)
+  boundaries.append(len(reader))
+  return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _run_rounds(reader, start, end):
+  detector = ArbitrageDetector()
+  result = BacktestResult()
+  for order_books in read_rounds(reader, start, end):
+    result.rounds += 1
+    for opportunity in detector.process(order_books):
+      result.add(opportunity)
+  return result
+
+def run_shard(archive_path, start, end, params):
+  """ Runs the detector over snapshots [start, end) of an archive, with the
+      config parameters overridden by 'params', and returns the
+      BacktestResult.
+  """
+  saved = dict((name, getattr(config, name)) for name in params)
+  for name, value in params.items():
+    setattr(config, name, value)
+  try:
+    reader = BookArchiveReader(archive_path)
+    try:
+      # The snapshots are all released when _run_rounds() returns.
+      return _run_rounds(reader, start, end)
+    finally:
+      reader.close()
+  finally:
+    for name, value in saved.items():
+      setattr(config, name, value)
+
+def _init_worker(level):
+  logging.getLogger().setLevel(level)
+
+def backtest(archive_path, param_sets, num_shards=None, max_workers=None,
+             log_level=logging.WARNING):
+  """ Runs the detector over an archive once for each set of parameters,
+      and returns a list of BacktestResults in the same order.
+  """
+  for params in param_sets:
+    for name in params:
+      if not hasattr(config, name):
+        raise ValueError('Unknown config parameter: %s' % name)
+  if num_shards is None:
+    num_shards = (max_workers or os.cpu_count() or 1) * 4
+  reader = BookArchiveReader(archive_path)
+  shards = create_shards(reader, num_shards)
+  reader.close()
+  with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                           initargs=(log_level,)) as executor:
+    futures = [[executor.submit(run_shard, archive_path, start, end, params)
+                for start, end in shards]
+               for params in param_sets]
+    results = []
+    for shard_futures in futures:
+      result = BacktestResult()
+      for future in shard_futures:
+        result.merge(future.result())
+      results.append(result)
+  return results
+
+def parse_sweep(sweeps):
+  """ Parses ['name=v1,v2', ...] into the list of all the combinations of
+      parameter values, as dicts.
+  """
+  names, values = [], []
+  for sweep in sweeps:
+    name, _, value_list = sweep.partition('=')
+    names.append(name)
+    values.append([float(value) for value in value_list.split(',')])
+  return [dict(zip(names, combination))
+          for combination in itertools.product(*values)]
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--archive', required=True)
+  parser.add_argument('--sweep', action='append', default=[],
+                      help='A config parameter and its values, eg,'
+                           ' marginal_profit_rate_normal=0.01,0.02')
+  parser.add_argument('--shards', type=int, default=None)
+  parser.add_argument('--workers', type=int, default=None)
+  args = parser.parse_args()
+  logging.basicConfig(format='[%(levelname)s] %(asctime)s %(message)s',
+                      level=logging.INFO)
+  param_sets = parse_sweep(args.sweep)
+  results = backtest(args.archive, param_sets, args.shards, args.workers)
+  for params, result in zip(param_sets, results):
+    print('%s: %d rounds' % (params, result.rounds))
+    for key in sorted(result.pairs.keys()):
+      stats = result.pairs[key]
+      instrument = pair_instrument(*key)
+      print('  %s:%s - %d opportunities, amount=%.8f profit=%s'
+            ' max_profit=%s %s' % (key[0], key[1], stats.count,
+                                   stats.amount / 100000000.0,
+                                   format_price(stats.profit, instrument),
+                                   format_price(stats.max_profit, instrument),
+                                   split_instrument(instrument)[1]))
+
+if __name__ == '__main__':
+  main()
@@ -1,14 +1,24 @@
 """ Market watcher for Bitstamp.
 """
 
+from depth_parser import parse_depth
 from exchange_watcher import ExchangeWatcher
+from instruments import DEFAULT_INSTRUMENT
+from order_book import OrderBook
 from utils import create_price_amount_list
 
 class BitstampWatcher(ExchangeWatcher):
-  def __init__(self):
-    super(BitstampWatcher, self).__init__('Bitstamp')
+  # The asks and bids are returned in order.
+  presorted = True
+
+  def __init__(self, instrument=DEFAULT_INSTRUMENT):
+    super(BitstampWatcher, self).__init__('Bitstamp', instrument)
     self.url = 'https://www.bitstamp.net/api/order_book/'
 
+  def _parse_order_book_from_bytes(self, body):
+    return parse_depth(body, depth=self.depth_budget,
+                       presorted=self.presorted)
+
   def _parse_order_book_from_json(self, json_data):
     asks = create_price_amount_list(json_data, 'asks', True)
     if asks is None:
@@ -16,5 +26,5 @@ class BitstampWatcher(ExchangeWatcher):
     bids = create_price_amount_list(json_data, 'bids', False)
     if bids is None:
       return None
-    return {'asks': asks, 'bids': bids}
+    return OrderBook.from_lists(asks, bids, validated=True)
 
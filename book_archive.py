@@ -0,0 +1,215 @@
+""" An append-only, memory-mapped archive of converted order books.
+
+Scanning weeks of raw recordings (see recorder.py) means decompressing and
+parsing every payload again.  The archive stores the converted order books
+instead, so they can be read back without any parsing:
+
+  - The data file holds the four int64 columns of every snapshot (ask
+    prices, ask amounts, bid prices, bid amounts) back to back, in native
+    byte order.
+  - The index file ('<data file>.idx') holds one fixed-size _INDEX record
+    per snapshot: timestamp, round, byte offset in the data file, number of
+    asks, number of bids and exchange name.
+
+Both files are memory-mapped by the reader, so any snapshot can be accessed
+in constant time and its columns are memoryviews into the mapping (no
+copies).  Snapshots are appended in time order, so a time range is found by
+binary search on the index.  To get NumPy arrays, wrap the columns with
+numpy.frombuffer().
+"""
+
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from order_book import OrderBook
+from recorder import read_records
+
+_INDEX = struct.Struct('<dIqII16s')
+_ITEM_SIZE = 8
+
+IndexEntry = namedtuple('IndexEntry', ['timestamp', 'round', 'offset',
+                                       'num_asks', 'num_bids',
+                                       'exchange_name'])
+
+Snapshot = namedtuple('Snapshot', ['timestamp', 'round', 'exchange_name',
+                                   'order_book'])
+
+def _index_path(path):
+  return path + '.idx'
+
+class BookArchiveWriter(object):
+  def __init__(self, path):
+    self.data_fp = open(path, 'ab')
+    self.index_fp = open(_index_path(path), 'ab')
+    self.offset = self.data_fp.tell()
+    self.last_timestamp = None
+    # Drop a partially written index record at the end, and carry on from
+    # the last snapshot of a reopened archive.
+    size = self.index_fp.tell() // _INDEX.size
+    self.index_fp.truncate(size * _INDEX.size)
+    if size > 0:
+      with open(_index_path(path), 'rb') as fp:
+        fp.seek((size - 1) * _INDEX.size)
+        self.last_timestamp = _INDEX.unpack(fp.read(_INDEX.size))[0]
+
+  def append(self, timestamp, round_number, exchange_name, order_book):
+    """ Appends the snapshot of an order book.  The snapshots are kept in
+        time order, even with a clock going backwards.
+    """
+    if self.last_timestamp is not None:
+      timestamp = max(timestamp, self.last_timestamp)
+    name = exchange_name.encode('utf8')
+    if len(name) > 16:
+      raise ValueError('Exchange name too long: %s' % exchange_name)
+    columns = (order_book.ask_prices, order_book.ask_amounts,
+               order_book.bid_prices, order_book.bid_amounts)
+    for column in columns:
+      self.data_fp.write(memoryview(column).cast('B'))
+    self.index_fp.write(_INDEX.pack(
+        timestamp, round_number, self.offset, len(order_book.ask_prices),
+        len(order_book.bid_prices), name))
+    self.offset += sum(len(column) for column in columns) * _ITEM_SIZE
+    self.last_timestamp = timestamp
+
+  def flush(self):
+    # The data goes first, so that the index never points past the data.
+    self.data_fp.flush()
+    self.index_fp.flush()
+
+  def close(self):
+    self.flush()
+    self.data_fp.close()
+    self.index_fp.close()
+
+def _map(path):
+  """ Memory-maps a file read-only, or returns empty bytes for an empty file
+      (which cannot be mapped).
+  """
+  with open(path, 'rb') as fp:
+    if os.fstat(fp.fileno()).st_size == 0:
+      return b''
+    return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+class _Timestamps(object):
+  """ A sequence view of the timestamps in the index, for bisect.
+  """
+  def __init__(self, index, size):
+    self.index = index
+    self.size = size
+
+  def __len__(self):
+    return self.size
+
+  def __getitem__(self, i):
+    return struct.unpack_from('<d', self.index, i * _INDEX.size)[0]
+
+class BookArchiveReader(object):
+  def __init__(self, path):
+    self.data = _map(path)
+    self.index = _map(_index_path(path))
+    # Ignore a partially written index record at the end.
+    self.size = len(self.index) // _INDEX.size
+    self.timestamps = _Timestamps(self.index, self.size)
+    self.columns = memoryview(self.data)
+
+  def __len__(self):
+    return self.size
+
+  def entry(self, i):
+    """ Returns the IndexEntry of the i-th snapshot.
+    """
+    if not 0 <= i < self.size:
+      raise IndexError(i)
+    entry = _INDEX.unpack_from(self.index, i * _INDEX.size)
+    return IndexEntry(*(entry[:5] +
+                        (entry[5].rstrip(b'\0').decode('utf8'),)))
+
+  def snapshot(self, i):
+    """ Returns the i-th Snapshot, whose order book columns are memoryviews
+        into the archive.
+    """
+    entry = self.entry(i)
+    columns = []
+    offset = entry.offset
+    for size in (entry.num_asks, entry.num_asks, entry.num_bids,
+                 entry.num_bids):
+      end = offset + size * _ITEM_SIZE
+      columns.append(self.columns[offset:end].cast('q'))
+      offset = end
+    return Snapshot(entry.timestamp, entry.round, entry.exchange_name,
+                    OrderBook(*columns))
+
+  def find(self, timestamp):
+    """ Returns the index of the first snapshot at or after a timestamp.
+    """
+    return bisect_left(self.timestamps, timestamp)
+
+  def exchange_index(self):
+    """ Returns a dict mapping an exchange name to the (timestamps, snapshot
+        indices) of its snapshots, as arrays in time order, so that the
+        snapshots of one exchange can be found by time with bisect.
+    """
+    columns = dict()
+    entries = _INDEX.iter_unpack(
+        memoryview(self.index)[:self.size * _INDEX.size])
+    for i, entry in enumerate(entries):
+      name = entry[5]
+      if name not in columns:
+        columns[name] = (array('d'), array('q'))
+      columns[name][0].append(entry[0])
+      columns[name][1].append(i)
+    return dict((name.rstrip(b'\0').decode('utf8'), value)
+                for name, value in columns.items())
+
+  def snapshots(self, start_time=None, end_time=None):
+    """ Yields the snapshots with start_time <= timestamp < end_time.
+    """
+    start = 0 if start_time is None else self.find(start_time)
+    end = self.size if end_time is None else self.find(end_time)
+    for i in range(start, end):
+      yield self.snapshot(i)
+
+  def close(self):
+    """ Closes the mappings.  All the snapshots returned by this reader must
+        have been released.
+    """
+    self.columns.release()
+    for mapping in (self.data, self.index):
+      if isinstance(mapping, mmap.mmap):
+        mapping.close()
+
+def archive_recording(recording_path, archive_path, exchange_watchers):
+  """ Converts a recording (see recorder.py) into an archive, parsing the
+      content with the given exchange watchers.  Returns the number of
+      snapshots archived.  Unchanged content is archived as the last order
+      book of the exchange again, so every round is complete.
+  """
+  watchers = dict((watcher.exchange_name, watcher)
+                  for watcher in exchange_watchers)
+  writer = BookArchiveWriter(archive_path)
+  num_snapshots = 0
+  # Maps an exchange name to its last order book.
+  last_order_books = dict()
+  try:
+    for record in read_records(recording_path):
+      watcher = watchers.get(record.exchange_name, None)
+      if watcher is None:
+        continue
+      if record.body is None:
+        order_book = last_order_books.get(record.exchange_name, None)
+      else:
+        order_book = watcher.parse_order_book(record.body)
+      if order_book is None:
+        continue
+      last_order_books[record.exchange_name] = order_book
+      # Older recordings may have slightly out-of-order timestamps, which
+      # the writer clamps.
+      writer.append(record.timestamp, record.round, record.exchange_name,
+                    order_book)
+      num_snapshots += 1
+  finally:
+    writer.close()
+  return num_snapshots
@@ -1,20 +1,37 @@
 """ Market watcher for BTC-E.
 """
 
+from depth_parser import parse_depth
 from exchange_watcher import ExchangeWatcher
+from instruments import DEFAULT_INSTRUMENT
+from order_book import OrderBook
 from utils import create_price_amount_list
 
 class BTCEWatcher(ExchangeWatcher):
-  def __init__(self):
-    super(BTCEWatcher, self).__init__('BTC-E')
-    self.url = 'https://btc-e.com/api/2/btc_usd/depth'
+  # The asks and bids are returned in order.
+  presorted = True
+  instruments = ('BTC/USD', 'BTC/EUR', 'LTC/USD', 'LTC/EUR', 'LTC/BTC',
+                 'EUR/USD')
+
+  def __init__(self, instrument=DEFAULT_INSTRUMENT):
+    super(BTCEWatcher, self).__init__('BTC-E', instrument)
+    # Eg, 'btc_usd' for BTC/USD.
+    symbol = instrument.lower().replace('/', '_')
+    self.url = 'https://btc-e.com/api/2/%s/depth' % symbol
+
+  def _parse_order_book_from_bytes(self, body):
+    return parse_depth(body, depth=self.depth_budget,
+                       presorted=self.presorted,
+                       price_multiplier=self.price_multiplier)
 
   def _parse_order_book_from_json(self, json_data):
-    asks = create_price_amount_list(json_data, 'asks', True)
+    asks = create_price_amount_list(json_data, 'asks', True,
+                                    self.price_multiplier)
     if asks is None:
       return None
-    bids = create_price_amount_list(json_data, 'bids', False)
+    bids = create_price_amount_list(json_data, 'bids', False,
+                                    self.price_multiplier)
     if bids is None:
       return None
-    return {'asks': asks, 'bids': bids}
+    return OrderBook.from_lists(asks, bids, validated=True)
 
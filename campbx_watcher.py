@@ -1,14 +1,21 @@
 """ Market watcher for CampBX.
 """
 
+from depth_parser import parse_depth
 from exchange_watcher import ExchangeWatcher
+from instruments import DEFAULT_INSTRUMENT
+from order_book import OrderBook
 from utils import create_price_amount_list
 
 class CampBXWatcher(ExchangeWatcher):
-  def __init__(self):
-    super(CampBXWatcher, self).__init__('CampBX')
+  def __init__(self, instrument=DEFAULT_INSTRUMENT):
+    super(CampBXWatcher, self).__init__('CampBX', instrument)
     self.url = 'http://campbx.com/api/xdepth.php'
 
+  def _parse_order_book_from_bytes(self, body):
+    return parse_depth(body, 'Asks', 'Bids', self.depth_budget,
+                       self.presorted)
+
   def _parse_order_book_from_json(self, json_data):
     asks = create_price_amount_list(json_data, 'Asks', True)
     if asks is None:
@@ -16,5 +23,5 @@ class CampBXWatcher(ExchangeWatcher):
     bids = create_price_amount_list(json_data, 'Bids', False)
     if bids is None:
       return None
-    return {'asks': asks, 'bids': bids}
+    return OrderBook.from_lists(asks, bids, validated=True)
 
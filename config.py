@@ -4,11 +4,83 @@
 # The participating exchanges.
 exchanges = ('bitstamp', 'btce', 'campbx', 'mtgox')
 
-# The main thread sleeps for a while between rounds.
-# TODO: Adjust this value by the throttle limit of the exchanges.
+# The main thread sleeps for a while between rounds.  (The asynchronous mode
+# polls each exchange within its rate limit instead, see below.)
 sleep_between_rounds_sec = 20
 # The timeout for the API operations.
 timeout_sec = 20
+# The deadline for collecting the order books of a round, or None to wait
+# for all the exchanges (up to 'timeout_sec').  An exchange that misses the
+# deadline is represented by its last known order book, and its request is
+# left in flight for the following rounds.
+round_deadline_sec = None
+# Run each exchange watcher in a worker process (see process_watcher.py),
+# so that parsing deep order books does not compete with the arbitrage
+# detector for the GIL.
+watcher_processes = False
+# Order books older than this (in seconds) are skipped by the arbitrage
+# detector, or None to never skip them.
+max_order_book_age_sec = 60
+# The marginal profit rate required from a pair of order books is raised by
+# this rate for every second of age of the older one, so that opportunities
+# on stale data need a larger margin (eg, 0.01/100 raises it by 0.2% for
+# an order book of 20 seconds).
+stale_profit_rate_per_sec = 0.0
+# The age is rounded up to a multiple of this many seconds, so that the
+# detection results of an unchanged pair stay cached within a bucket.
+stale_age_bucket_sec = 1.0
+
+# The instruments (currency pairs) watched on each exchange, see
+# instruments.py.  Exchanges not listed here only watch BTC/USD.
+instruments = {
+    'btce': ('BTC/USD', 'BTC/EUR', 'LTC/BTC', 'LTC/USD'),
+    'mtgox': ('BTC/USD', 'BTC/EUR'),
+}
+# The exchange rates of currencies in 'fx_currency', used to compare order
+# books quoted in different currencies (eg, BTC/EUR with BTC/USD).
+fx_currency = 'USD'
+fx_rates = {
+    'EUR': 1.30,
+}
+
+# In the asynchronous mode (arbitrageur.py --async), each exchange is polled
+# on its own schedule, and the arbitrage detector runs as soon as any order
+# book changes.  This maps an exchange to its polling interval; exchanges not
+# listed here are polled every 'sleep_between_rounds_sec'.
+poll_interval_sec = {
+    'bitstamp': 10,
+    'btce': 10,
+    'campbx': 15,
+    'mtgox': 15,
+}
+# The polling interval of an exchange adapts to how often the top of its
+# order book changes, between 'min_poll_interval_sec' (changes on every poll)
+# and its 'poll_interval_sec' (no changes), see poll_scheduler.py.
+min_poll_interval_sec = 2
+# The API rate limit of each exchange, in requests per minute, which is never
+# exceeded by the polling.
+#     https://www.bitstamp.net/api/ (600 requests per 10 minutes)
+rate_limit_per_min = {
+    'bitstamp': 60,
+    'btce': 60,
+    'campbx': 30,
+    'mtgox': 30,
+}
+# After failed requests, an exchange is backed off exponentially up to this.
+max_backoff_sec = 300
+
+# The maximum number of levels kept on each side of the order book of an
+# exchange (None for no limit).  The detector only looks at asks below the
+# best bid and bids above the best ask of another exchange, so the deeper
+# levels are not even converted.  The detection results are the same as
+# long as no arbitrage reaches deeper than the budget; an opportunity that
+# consumes a whole truncated side is logged as a warning.
+depth_budget = {
+    'bitstamp': 200,
+    'btce': 200,
+    'campbx': 200,
+    'mtgox': 200,
+}
 
 # Commissions, as a rate of the trading volume.  Volume discounts are not
 # considered.
@@ -55,8 +127,46 @@ marginal_profit_rate_high = 3.0/100
 #       Ie, mapping an asset ratio to the buying and selling rates.
 asset_ratio_low = 0.25
 
+# The latency of an order, from the detection of an opportunity to its
+# matching on an exchange, used by the execution simulator (see
+# execution_simulator.py): the network latency of the exchange (or
+# 'default_network_latency_sec' if not listed) plus the matching latency.
+network_latency_sec = {
+    'bitstamp': 0.2,
+    'btce': 0.4,
+    'campbx': 0.3,
+    'mtgox': 0.5,
+}
+default_network_latency_sec = 0.3
+matching_latency_sec = 0.1
+
+# Only report an opportunity when it appears or changes, instead of in
+# every round it lasts, and log when it disappears (see
+# opportunity_tracker.py).  tools/gen_curves.py counts the reported
+# opportunities, so its counts are then of changes rather than of rounds.
+track_opportunities = False
+
+# Also look for arbitrage cycles through several markets (see
+# cycle_detector.py), reporting up to 'max_cycles' of them per round.
+detect_cycles = False
+max_cycles = 5
+
+# The number of market pairs whose detection results are cached by the
+# arbitrage detector, so that only the pairs with a changed order book are
+# processed again.
+detection_cache_size = 1024
+
 # Sometimes the order book fetched from an exchange contains matching orders
 # (min ask price <= max bid price).  This may be due to server lags.
 # For safety, turn on this flag to skip such order books in the arbitrage.
 skip_order_books_with_matching_orders = True
 
+# Timing spans and payload sizes of the watcher/detector pipeline (see
+# metrics.py).  When disabled, the instrumentation has negligible overhead.
+metrics_enabled = False
+# If set, a json snapshot of the metrics is written to this file every
+# 'metrics_snapshot_interval_sec'.
+metrics_snapshot_file = None
+metrics_snapshot_interval_sec = 60
+# If set, the json snapshot is served at http://127.0.0.1:<port>/.
+metrics_port = None
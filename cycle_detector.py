@@ -0,0 +1,276 @@
+""" A detector for multi-leg arbitrage cycles.
+
+With inventory held on several exchanges, a trade does not need to be a
+buy-here/sell-there pair: a cycle of trades through several markets (eg,
+buy bitcoins with dollars in A, sell them for euros in B, and sell the euros
+for dollars in C) can be profitable when no pair is.
+
+The markets are turned into a graph, whose nodes are (venue, currency)
+holdings.  Every market has a buying edge (quote -> base) and a selling edge
+(base -> quote), weighted by -log of its top-of-book rate after commission,
+and the holdings of a currency on different venues are connected through a
+hub node with zero weight edges (a trade on one venue is balanced by the
+inventory on another, as in the pair detector).  A profitable cycle is a
+negative cycle in this graph, found by Bellman-Ford, and then sized by
+walking the order books along the cycle.
+
+Each trading edge is also charged half the marginal profit rate, so that a
+two-venue cycle requires the same margin as the pair detector.  Prices are
+in cents of the quote currency per unit of the base currency, and amounts
+are in the smallest unit of their currency (eg, satoshis or cents).
+"""
+
+import logging
+import math
+from bisect import bisect_right
+from collections import namedtuple
+from itertools import accumulate
+
+# A market of a base currency (eg, 'BTC') priced in a quote currency (eg,
+# 'USD') on a venue.  'base_unit' is the number of the smallest units of the
+# base currency in one unit (eg, 100000000 satoshis in a bitcoin), and
+# 'commission' is the commission rate of the venue.
+Market = namedtuple('Market', ['venue', 'base', 'quote', 'order_book',
+                               'commission', 'base_unit'])
+Market.__new__.__defaults__ = (0.0, 100000000)
+
+# A trade of a cycle: 'buy' or 'sell' in the market of a venue.  The amounts
+# are in the smallest units of the currencies going in and out.  Between
+# trades on different venues, the inventory of the next venue is used.
+Leg = namedtuple('Leg', ['venue', 'action', 'currency_in', 'amount_in',
+                         'currency_out', 'amount_out'])
+
+# A profitable cycle, starting and ending in 'currency'.  The amount and the
+# profit are in the smallest unit of the currency, and the rate is the
+# profit rate of the first unit (after commissions).
+CycleOpportunity = namedtuple('CycleOpportunity', ['currency', 'legs',
+                                                   'amount', 'profit', 'rate'])
+
+_BUY, _SELL, _TRANSFER = 'buy', 'sell', None
+
+# Relaxations smaller than this are ignored, against rounding errors.
+_EPSILON = 1e-12
+
+class _Side(object):
+  """ The cumulative volumes (in base units) and costs (in quote units) of
+      one side of an order book.
+  """
+  def __init__(self, levels, base_unit):
+    self.prices = [price for price, _ in levels]
+    self.volumes = list(accumulate((amount for _, amount in levels),
+                                   initial=0))
+    self.costs = list(accumulate((price * amount / base_unit
+                                  for price, amount in levels), initial=0))
+
+  def _level(self, cumulative, value, whole):
+    """ Returns the level of the unit after 'value', or None if the side
+        is not deep enough.  With 'whole', taking the whole side is fine.
+    """
+    level = bisect_right(cumulative, value) - 1
+    if level < len(self.prices):
+      return level
+    if whole and value <= cumulative[-1] * (1 + _EPSILON):
+      return level - 1
+    return None
+
+  def buy(self, cost, base_unit, whole=False):
+    """ Returns the (base amount bought, marginal price) for spending a cost,
+        or None if the side is not deep enough.
+    """
+    level = self._level(self.costs, cost, whole)
+    if level is None:
+      return None
+    price = self.prices[level]
+    return (self.volumes[level] +
+            (cost - self.costs[level]) * base_unit / price, price)
+
+  def sell(self, amount, base_unit, whole=False):
+    """ Returns the (quote amount received, marginal price) for selling an
+        amount, or None if the side is not deep enough.
+    """
+    level = self._level(self.volumes, amount, whole)
+    if level is None:
+      return None
+    price = self.prices[level]
+    return (self.costs[level] +
+            (amount - self.volumes[level]) * price / base_unit, price)
+
+class CycleDetector(object):
+  def __init__(self, marginal_profit_rate, max_cycles=5):
+    self.marginal_profit_rate = marginal_profit_rate
+    self.max_cycles = max_cycles
+
+  def process(self, markets, inventory=None):
+    """
+    Args:
+      markets: A list of Markets, whose order books have been converted and
+               validated.
+      inventory: The set of (venue, currency) holdings that can be used to
+                 balance trades on other venues, or None for all of them.
+    Returns: A list of CycleOpportunities, at most 'max_cycles'.
+    """
+    nodes, edges = self._build_graph(markets, inventory)
+    sides = dict()
+    opportunities = []
+    while len(opportunities) < self.max_cycles:
+      cycle = self._find_negative_cycle(len(nodes), edges)
+      if cycle is None:
+        break
+      opportunity = self._size(cycle, markets, sides)
+      if opportunity is not None:
+        logging.debug('Found cycle: %s' % (opportunity,))
+        opportunities.append(opportunity)
+      # Look for another cycle without the trades of this one.
+      trades = set(id(edge) for edge in cycle if edge[3] != _TRANSFER)
+      edges = [edge for edge in edges if id(edge) not in trades]
+    return opportunities
+
+  def _build_graph(self, markets, inventory):
+    """ Returns the nodes, as a dict mapping (venue, currency) to an index,
+        and the edges, as (from, to, weight, action, market index) tuples.
+    """
+    nodes = dict()
+
+    def node(key):
+      if key not in nodes:
+        nodes[key] = len(nodes)
+      return nodes[key]
+
+    # Charged on every trade, see the module docstring.
+    margin = math.log(1 + self.marginal_profit_rate / 2.0)
+    edges = []
+    holdings = set()
+    for k, market in enumerate(markets):
+      asks, bids = market.order_book['asks'], market.order_book['bids']
+      quote = node((market.venue, market.quote))
+      base = node((market.venue, market.base))
+      holdings.add((market.venue, market.quote))
+      holdings.add((market.venue, market.base))
+      fee = 1 - market.commission
+      if len(asks) > 0:
+        rate = fee * market.base_unit / asks[0][0]
+        edges.append((quote, base, margin - math.log(rate), _BUY, k))
+      if len(bids) > 0:
+        rate = fee * bids[0][0] / market.base_unit
+        edges.append((base, quote, margin - math.log(rate), _SELL, k))
+    for venue, currency in sorted(holdings):
+      if inventory is not None and (venue, currency) not in inventory:
+        continue
+      hub = node((None, currency))
+      holding = nodes[(venue, currency)]
+      edges.append((holding, hub, 0.0, _TRANSFER, None))
+      edges.append((hub, holding, 0.0, _TRANSFER, None))
+    return nodes, edges
+
+  def _find_negative_cycle(self, num_nodes, edges):
+    """ Returns the edges of a negative cycle, in order, or None.
+    """
+    # Starting with all the distances at 0 is the same as adding a source
+    # with an edge to every node.
+    distances = [0.0] * num_nodes
+    predecessors = [None] * num_nodes
+    last_relaxed = None
+    for _ in range(num_nodes):
+      last_relaxed = None
+      for edge in edges:
+        distance = distances[edge[0]] + edge[2]
+        if distance < distances[edge[1]] - _EPSILON:
+          distances[edge[1]] = distance
+          predecessors[edge[1]] = edge
+          last_relaxed = edge[1]
+      if last_relaxed is None:
+        return None
+    # Still relaxing after num_nodes rounds: walking back num_nodes steps
+    # from the last relaxed node lands on a negative cycle.
+    node = last_relaxed
+    for _ in range(num_nodes):
+      node = predecessors[node][0]
+    cycle = []
+    current = node
+    while True:
+      edge = predecessors[current]
+      cycle.append(edge)
+      current = edge[0]
+      if current == node:
+        break
+    cycle.reverse()
+    return cycle
+
+  def _size(self, cycle, markets, sides):
+    """ Sizes a cycle by walking the order books, and returns the
+        CycleOpportunity, or None if it is not profitable.
+    """
+    # Start with the first trade, on the currency going into it.
+    start = next(i for i, edge in enumerate(cycle) if edge[3] != _TRANSFER)
+    cycle = cycle[start:] + cycle[:start]
+    trades = []
+    for edge in cycle:
+      if edge[3] == _TRANSFER:
+        continue
+      market = markets[edge[4]]
+      key = (edge[4], edge[3])
+      if key not in sides:
+        levels = market.order_book['asks' if edge[3] == _BUY else 'bids']
+        sides[key] = _Side(levels, market.base_unit)
+      trades.append((edge[3], market, sides[key]))
+    margin = (1 + self.marginal_profit_rate / 2.0) ** len(trades)
+
+    def walk(amount, whole=False):
+      """ Returns the list of (amount in, amount out) of the trades, and the
+          marginal rate of the cycle (for the unit after 'amount'), or None
+          if an order book runs out.
+      """
+      amounts = []
+      rate = 1.0
+      for action, market, side in trades:
+        fee = 1 - market.commission
+        if action == _BUY:
+          result = side.buy(amount, market.base_unit, whole)
+          if result is None:
+            return None
+          rate *= fee * market.base_unit / result[1]
+        else:
+          result = side.sell(amount, market.base_unit, whole)
+          if result is None:
+            return None
+          rate *= fee * result[1] / market.base_unit
+        amounts.append((amount, result[0] * fee))
+        amount = result[0] * fee
+      return amounts, rate
+
+    def profitable(amount):
+      """ Returns whether the last unit of an amount is profitable.
+      """
+      result = walk(amount - 1)
+      return result is not None and result[1] > margin
+
+    if not profitable(1):
+      return None
+    # The marginal rate only gets worse with the amount, so the largest
+    # profitable amount is found by doubling and then bisecting.
+    low, high = 1, 2
+    while profitable(high):
+      low, high = high, high * 2
+    while high - low > 1:
+      middle = (low + high) // 2
+      if profitable(middle):
+        low = middle
+      else:
+        high = middle
+    result = walk(low, whole=True)
+    if result is None:
+      return None
+    amounts = result[0]
+    first = trades[0]
+    currency = first[1].quote if first[0] == _BUY else first[1].base
+    legs = []
+    for (action, market, _), (amount_in, amount_out) in zip(trades, amounts):
+      currency_in, currency_out = market.quote, market.base
+      if action == _SELL:
+        currency_in, currency_out = currency_out, currency_in
+      legs.append(Leg(market.venue, action, currency_in,
+                      int(round(amount_in)), currency_out,
+                      int(round(amount_out))))
+    return CycleOpportunity(currency, legs, low,
+                            int(math.floor(amounts[-1][1] - low)),
+                            walk(0)[1] - 1)
@@ -1,33 +1,205 @@
 """ Base class for exchange watchers.
 
 An exchange watcher talks to the API service of an exchange to get the most
-up-to-date and valid order book.
+up-to-date and valid order book.  By default, the full depth is downloaded
+for every order book; alternatively, a diff feed can be attached to keep the
+order book up to date incrementally (see incremental_book.py).
 """
 
-from utils import read_json, validate_order_book
+import logging
+import time
+from incremental_book import IncrementalOrderBook, parse_delta
+from instruments import DEFAULT_INSTRUMENT, market_name, price_multiplier
+from metrics import metrics
+from utils import parse_json, read_url, validate_order_book
 
 class ExchangeWatcher(object):
-  def __init__(self, exchange_name):
-    self.exchange_name = exchange_name
+  # Whether the API service returns the asks and bids in order, so that only
+  # the top levels need to be parsed (see depth_parser.parse_side()).
+  presorted = False
+
+  # The instruments supported by the exchange (see instruments.py).
+  instruments = (DEFAULT_INSTRUMENT,)
+
+  def __init__(self, exchange_name, instrument=DEFAULT_INSTRUMENT):
+    if instrument not in self.instruments:
+      raise ValueError('%s does not support %s' % (exchange_name, instrument))
+    self.instrument = instrument
+    # The name of the market, ie, the exchange name and the instrument (see
+    # instruments.market_name()).
+    self.exchange_name = market_name(exchange_name, instrument)
+    # Prices are converted into the smallest unit of the quote currency.
+    self.price_multiplier = price_multiplier(instrument)
+    # The maximum number of levels kept on each side, or None for no limit.
+    self.depth_budget = None
+    # The content and order book from the last successful request.
+    self.last_body = None
+    self.last_order_book = None
+    # The diff feed and the incremental order book, if attached, and the
+    # deltas waiting for a snapshot that covers the deltas before them.
+    self.feed = None
+    self.incremental_book = None
+    self.pending_deltas = []
+    # The recorder of the raw content, if any (see recorder.py).
+    self.recorder = None
+
+  def attach_feed(self, feed):
+    """ Keeps the order book up to date from a diff feed (see
+        incremental_book.DeltaFeed) instead of downloading the full depth
+        every time.  The full depth is only downloaded as a snapshot to start
+        with, or to resync after missing deltas.
+    """
+    self.feed = feed
+    self.incremental_book = IncrementalOrderBook()
+    self.pending_deltas = []
 
   def get_order_book(self):
     """ Gets the up-to-date and valid order book from the exchange, or None if
         there was a problem (eg, the API service was unavailable at the
-        moment or the returned order book was invalid).
+        moment or the returned order book was invalid).  The timestamp of
+        the order book is set to the time it was received.
+    """
+    with metrics.span('get_order_book', self.exchange_name):
+      if self.feed is not None:
+        order_book = self._get_incremental_order_book()
+      else:
+        order_book = self._get_snapshot()
+    if order_book is not None:
+      # An unchanged order book is the same object as last time, and it has
+      # just been confirmed to be current.
+      order_book.timestamp = time.time()
+    return order_book
+
+  def _get_incremental_order_book(self):
+    book = self.incremental_book
+    deltas = self.pending_deltas
+    self.pending_deltas = []
+    for message in self.feed.poll():
+      delta = self._parse_delta(message)
+      if delta is not None:
+        deltas.append(delta)
+    # At most one snapshot is downloaded per poll.
+    resynced = False
+    for i, delta in enumerate(deltas):
+      synced = book.synced
+      if synced and book.apply(delta):
+        continue
+      if not resynced:
+        if synced:
+          logging.warning('Resyncing %s after missing deltas' %
+                          self.exchange_name)
+        if not self._resync():
+          return None
+        resynced = True
+        # The deltas covered by the snapshot are skipped.
+        if book.apply(delta):
+          continue
+      # The snapshot lags the feed (or more deltas were missed since), so
+      # the remaining deltas wait for the snapshot of the next poll.
+      logging.warning('Waiting for a newer snapshot of %s' %
+                      self.exchange_name)
+      self.pending_deltas = deltas[i:]
+      return None
+    if not book.synced and not self._resync():
+      return None
+    return book.get_order_book()
+
+  def _resync(self):
+    """ Resets the incremental order book from a snapshot, and returns
+        whether it was successful.
+    """
+    # The snapshot is not cut to the depth budget, as the deltas may remove
+    # its top levels and expose the deeper ones.
+    depth_budget, self.depth_budget = self.depth_budget, None
+    try:
+      order_book = self._get_snapshot()
+    finally:
+      self.depth_budget = depth_budget
+    if order_book is None:
+      return False
+    json_data = parse_json(self.last_body, self.url)
+    if json_data is None:
+      return False
+    sequence = self._parse_sequence_from_json(json_data)
+    if sequence is None:
+      logging.error('No sequence number in the snapshot of %s' %
+                    self.exchange_name)
+      return False
+    self.incremental_book.reset(order_book, sequence)
+    return True
+
+  def _get_snapshot(self):
+    """ Downloads and returns the full order book, or None if failed.
     """
     # The URL for the API service is exchange-specific and should have been
     # defined by subclasses.
-    json_data = read_json(self.url)
+    with metrics.span('fetch', self.exchange_name):
+      body = read_url(self.url)
+    if body is None:
+      metrics.count('failed_requests', self.exchange_name)
+      return None
+    # read_url() returns the very same object if the content has not been
+    # modified, and then the last order book is still good.
+    if body is self.last_body:
+      metrics.count('unchanged_payloads', self.exchange_name)
+      if self.recorder is not None:
+        self.recorder.record(self.exchange_name, None)
+      return self.last_order_book
+    metrics.count('payloads', self.exchange_name)
+    metrics.count('payload_bytes', self.exchange_name, len(body))
+    if self.recorder is not None:
+      self.recorder.record(self.exchange_name, body)
+    order_book = self.parse_order_book(body)
+    if order_book is None:
+      return None
+    self.last_body = body
+    self.last_order_book = order_book
+    return order_book
+
+  def parse_order_book(self, body):
+    """ Parses a valid order book from the content returned from the API
+        request, or returns None.
+    """
+    with metrics.span('parse', self.exchange_name):
+      order_book = self._parse_order_book_from_bytes(body)
+    if order_book is not None:
+      return order_book
+    # Fall back to the generic json path.
+    with metrics.span('parse_json', self.exchange_name):
+      json_data = parse_json(body, self.url)
     if json_data is None:
       return None
-    order_book = self._parse_order_book_from_json(json_data)
-    if order_book is None or not validate_order_book(order_book):
+    with metrics.span('convert', self.exchange_name):
+      order_book = self._parse_order_book_from_json(json_data)
+    if order_book is None:
       return None
+    # Order books built from validated levels are not checked again.
+    if not getattr(order_book, 'validated', False):
+      with metrics.span('validate', self.exchange_name):
+        if not validate_order_book(order_book):
+          return None
     return order_book
 
+  def _parse_order_book_from_bytes(self, body):
+    """ Exchange-specific method to parse a valid order book directly from
+        the content returned from the API request (see depth_parser.py),
+        or None if the content is not understood.
+    """
+    return None
+
   def _parse_order_book_from_json(self, json_data):
     """ Exchange-specific method to parse the order book from the json
         object returned from the API request.
     """
     pass
 
+  def _parse_sequence_from_json(self, json_data):
+    """ Exchange-specific method to parse the sequence number of the order
+        book, matching the sequence numbers of the diff feed.
+    """
+    return None
+
+  def _parse_delta(self, message):
+    """ Exchange-specific method to parse a delta from a diff feed message.
+    """
+    return parse_delta(message, self.price_multiplier)
@@ -0,0 +1,287 @@
+#!/usr/bin/python3
+
+""" An order execution simulator over archived order books.
+
+The arbitrage detector assumes that its orders fill at the prices of the
+snapshot it saw, but the orders reach the exchanges some time later, when
+the books have moved.  The simulator replays the opportunities found in an
+archive (see book_archive.py) against the books of each exchange at the time
+the orders would arrive there:
+
+  - Both orders of an opportunity are sent at the detection time (the time
+    of its round), and arrive at the exchange after its network latency plus
+    the matching latency (see config.network_latency_sec).
+  - The buy order is a limit order at the highest buying price of the
+    opportunity, and the sell order a limit order at the lowest selling
+    price, both for the amount of the opportunity.  They fill against the
+    latest snapshot of their exchange at their arrival, and may only fill
+    partially.
+  - The realized profit is that of the amount filled on both sides, after
+    the commissions of config.py; the rest of the bought or sold amount is
+    left unmatched (ie, an exposure to be unwound).
+
+The detected and realized profits tell how much the detection latency costs.
+The snapshots of an exchange at a time are found by binary search on the
+per-exchange index of the archive, so long histories are cheap to replay,
+and the rounds are split into time shards run in parallel as in backtest.py.
+Prices are in cents and amounts in satoshis.
+
+Eg:
+    execution_simulator.py --archive books --network_latency 1.0
+"""
+
+import argparse
+import config
+import logging
+import os
+from arbitrage_detector import ArbitrageDetector, commission_rate
+from backtest import _init_worker, create_shards, read_rounds, round_start
+from bisect import bisect_right
+from book_archive import BookArchiveReader
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from instruments import (exchange_of, format_price, pair_instrument,
+                         split_instrument)
+from opportunity_tracker import DISAPPEARED, OpportunityTracker
+
+# The execution of an opportunity detected at a time.  'bought' and 'sold'
+# are the amounts filled, and 'pay' and 'paid' their values.  The profits
+# are after commissions.
+Execution = namedtuple('Execution', ['opportunity', 'detected_at', 'bought',
+                                     'pay', 'sold', 'paid', 'detected_profit',
+                                     'realized_profit'])
+
+def _exchange_key(market):
+  """ Returns the config key of the exchange of a market (eg, 'btce' for
+      'BTC-E LTC/BTC').
+  """
+  return exchange_of(market).lower().replace('-', '')
+
+def _fill(prices, amounts, amount, limit, ascending):
+  """ Fills an order for an amount at a limit price against one side of an
+      order book, and returns the (amount filled, value in the smallest unit
+      of the quote currency).
+  """
+  filled, value = 0, 0
+  for price, available in zip(prices, amounts):
+    if (price > limit) if ascending else (price < limit):
+      break
+    take = min(available, amount - filled)
+    filled += take
+    value += price * take
+    if filled == amount:
+      break
+  return filled, value / 100000000.0
+
+class ExecutionStats(object):
+  """ Statistics of the executions of the opportunities of a pair.
+  """
+  __slots__ = ('count', 'filled', 'partial', 'missed', 'detected_profit',
+               'realized_profit', 'unmatched')
+
+  def __init__(self):
+    self.count = 0
+    # The numbers of executions filled fully, partially and not at all.
+    self.filled = 0
+    self.partial = 0
+    self.missed = 0
+    self.detected_profit = 0.0
+    self.realized_profit = 0.0
+    # The total amount bought or sold without the other side.
+    self.unmatched = 0
+
+  def add(self, execution):
+    amount = execution.opportunity.amount
+    self.count += 1
+    if execution.bought == amount and execution.sold == amount:
+      self.filled += 1
+    elif min(execution.bought, execution.sold) > 0:
+      self.partial += 1
+    else:
+      self.missed += 1
+    self.detected_profit += execution.detected_profit
+    self.realized_profit += execution.realized_profit
+    self.unmatched += abs(execution.bought - execution.sold)
+
+  def merge(self, other):
+    for name in self.__slots__:
+      setattr(self, name, getattr(self, name) + getattr(other, name))
+
+class SimulationResult(object):
+  def __init__(self):
+    self.rounds = 0
+    # Maps (buy market, sell market) to ExecutionStats.
+    self.pairs = dict()
+
+  def add(self, execution):
+    opportunity = execution.opportunity
+    key = (opportunity.buy_market, opportunity.sell_market)
+    if key not in self.pairs:
+      self.pairs[key] = ExecutionStats()
+    self.pairs[key].add(execution)
+
+  def merge(self, other):
+    self.rounds += other.rounds
+    for key, stats in other.pairs.items():
+      if key not in self.pairs:
+        self.pairs[key] = ExecutionStats()
+      self.pairs[key].merge(stats)
+
+class ExecutionSimulator(object):
+  def __init__(self, reader, network_latency_sec=None,
+               matching_latency_sec=None):
+    """ 'network_latency_sec' overrides the network latency of every
+        exchange, and 'matching_latency_sec' the matching latency.
+    """
+    self.reader = reader
+    self.network_latency_sec = network_latency_sec
+    self.matching_latency_sec = matching_latency_sec
+    if matching_latency_sec is None:
+      self.matching_latency_sec = config.matching_latency_sec
+    # Maps an exchange name to the (timestamps, snapshot indices) of its
+    # snapshots.
+    self.exchange_index = reader.exchange_index()
+
+  def latency(self, market):
+    """ Returns the seconds from the detection to the matching of an order
+        on a market.
+    """
+    network_latency = self.network_latency_sec
+    if network_latency is None:
+      network_latency = config.network_latency_sec.get(
+          _exchange_key(market), config.default_network_latency_sec)
+    return network_latency + self.matching_latency_sec
+
+  def order_book_at(self, market, timestamp):
+    """ Returns the latest order book of a market at a time, or None if
+        there is none.
+    """
+    timestamps, indices = self.exchange_index.get(market, ((), ()))
+    i = bisect_right(timestamps, timestamp) - 1
+    if i < 0:
+      return None
+    return self.reader.snapshot(indices[i]).order_book
+
+  def execute(self, opportunity, detected_at):
+    """ Returns the Execution of an opportunity detected at a time.
+    """
+    buy_market, sell_market = opportunity.buy_market, opportunity.sell_market
+    bought, pay, sold, paid = 0, 0.0, 0, 0.0
+    order_book = self.order_book_at(buy_market,
+                                    detected_at + self.latency(buy_market))
+    if order_book is not None:
+      bought, pay = _fill(order_book.ask_prices, order_book.ask_amounts,
+                          opportunity.amount, opportunity.max_buy_price, True)
+    order_book = self.order_book_at(sell_market,
+                                    detected_at + self.latency(sell_market))
+    if order_book is not None:
+      sold, paid = _fill(order_book.bid_prices, order_book.bid_amounts,
+                         opportunity.amount, opportunity.min_sell_price, False)
+    buy_rate = commission_rate(buy_market)
+    sell_rate = commission_rate(sell_market)
+    detected_profit = (opportunity.paid * (1 - sell_rate) -
+                       opportunity.pay * (1 + buy_rate))
+    # Only the amount filled on both sides makes a profit.
+    matched = min(bought, sold)
+    realized_profit = 0.0
+    if matched > 0:
+      realized_profit = (paid * matched / sold * (1 - sell_rate) -
+                         pay * matched / bought * (1 + buy_rate))
+    return Execution(opportunity, detected_at, bought, pay, sold, paid,
+                     detected_profit, realized_profit)
+
+def _simulate_rounds(reader, start, end, network_latency_sec,
+                     matching_latency_sec):
+  simulator = ExecutionSimulator(reader, network_latency_sec,
+                                 matching_latency_sec)
+  detector = ArbitrageDetector()
+  tracker = OpportunityTracker()
+  result = SimulationResult()
+  if config.track_opportunities and start > 0:
+    # The tracker only depends on the opportunities of the last round, so
+    # seeding it with the round before the shard gives the same results
+    # however the archive is sharded.
+    for timestamp, order_books in read_rounds(
+        reader, round_start(reader, start - 1), start, timestamps=True):
+      tracker.update(detector.process(order_books, now=timestamp), timestamp)
+  for timestamp, order_books in read_rounds(reader, start, end,
+                                            timestamps=True):
+    result.rounds += 1
+    opportunities = detector.process(order_books, now=timestamp)
+    if config.track_opportunities:
+      opportunities = [event.opportunity for event in
+                       tracker.update(opportunities, timestamp)
+                       if event.kind != DISAPPEARED]
+    for opportunity in opportunities:
+      result.add(simulator.execute(opportunity, timestamp))
+  return result
+
+def simulate_shard(archive_path, start, end, network_latency_sec=None,
+                   matching_latency_sec=None):
+  """ Runs the detector over snapshots [start, end) of an archive, executes
+      the opportunities, and returns the SimulationResult.  With
+      'config.track_opportunities', an opportunity is only executed when it
+      appears or changes, as the arbitrageur would report it.
+  """
+  reader = BookArchiveReader(archive_path)
+  try:
+    # The snapshots are all released when _simulate_rounds() returns.
+    return _simulate_rounds(reader, start, end, network_latency_sec,
+                            matching_latency_sec)
+  finally:
+    reader.close()
+
+def simulate(archive_path, network_latency_sec=None,
+             matching_latency_sec=None, num_shards=None, max_workers=None,
+             log_level=logging.WARNING):
+  """ Simulates the execution of the opportunities of an archive, and
+      returns the SimulationResult.
+  """
+  if num_shards is None:
+    num_shards = (max_workers or os.cpu_count() or 1) * 4
+  reader = BookArchiveReader(archive_path)
+  shards = create_shards(reader, num_shards)
+  reader.close()
+  result = SimulationResult()
+  with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                           initargs=(log_level,)) as executor:
+    futures = [executor.submit(simulate_shard, archive_path, start, end,
+                               network_latency_sec, matching_latency_sec)
+               for start, end in shards]
+    for future in futures:
+      result.merge(future.result())
+  return result
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--archive', required=True)
+  parser.add_argument('--network_latency', type=float, default=None,
+                      help='The network latency of every exchange in seconds'
+                           ' (default: config.network_latency_sec).')
+  parser.add_argument('--matching_latency', type=float, default=None,
+                      help='The matching latency in seconds (default:'
+                           ' config.matching_latency_sec).')
+  parser.add_argument('--shards', type=int, default=None)
+  parser.add_argument('--workers', type=int, default=None)
+  args = parser.parse_args()
+  logging.basicConfig(format='[%(levelname)s] %(asctime)s %(message)s',
+                      level=logging.INFO)
+  result = simulate(args.archive, args.network_latency,
+                    args.matching_latency, args.shards, args.workers)
+  print('%d rounds' % result.rounds)
+  for key in sorted(result.pairs.keys()):
+    stats = result.pairs[key]
+    instrument = pair_instrument(*key)
+    print('  %s:%s - %d opportunities (%d filled, %d partial, %d missed),'
+          ' detected profit=%s realized profit=%s latency cost=%s %s'
+          ' unmatched=%.8f' % (
+              key[0], key[1], stats.count, stats.filled, stats.partial,
+              stats.missed, format_price(stats.detected_profit, instrument),
+              format_price(stats.realized_profit, instrument),
+              format_price(stats.detected_profit - stats.realized_profit,
+                           instrument),
+              split_instrument(instrument)[1],
+              stats.unmatched / 100000000.0))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,178 @@
+""" A pooled keep-alive HTTP client for the exchange APIs.
+
+Opening a new connection for every request costs a TCP connection and, for
+https, a TLS handshake per exchange per round.  This client keeps idle
+connections around for reuse, negotiates gzip, and remembers the ETag and
+Last-Modified validators of each URL, so an unchanged resource only costs a
+'304 Not Modified' response.
+"""
+
+import config
+import gzip
+import http.client
+import threading
+import zlib
+from metrics import metrics
+from urllib.parse import urljoin, urlsplit
+
+class HTTPError(Exception):
+  """ Raised when the server responds with an unexpected status code.
+  """
+  def __init__(self, url, status, reason):
+    super(HTTPError, self).__init__('HTTP %d %s: %s' % (status, reason, url))
+    self.url = url
+    self.status = status
+
+class HTTPClient(object):
+  # The maximum number of idle connections kept for each host.
+  max_idle_per_host = 2
+  # The maximum number of redirects followed for a request.
+  max_redirects = 3
+
+  def __init__(self, timeout=None):
+    self.timeout = timeout if timeout is not None else config.timeout_sec
+    self.lock = threading.Lock()
+    # Maps (scheme, host, port) to a list of idle connections.
+    self.idle_connections = dict()
+    # Maps a URL to a (etag, last_modified, body) tuple.
+    self.validators = dict()
+    # Statistics, mostly for testing and monitoring.
+    self.connections_opened = 0
+    self.bytes_received = 0
+    self.not_modified = 0
+
+  def get(self, url):
+    """ Fetches a URL and returns its (decompressed) body as bytes.
+
+    If the server reports that the resource has not been modified since the
+    last request, the body of the last request is returned, and it is the
+    very same object, so callers can tell unchanged content by identity.
+    Raises HTTPError, http.client.HTTPException or OSError on failure.
+    """
+    for _ in range(self.max_redirects + 1):
+      status, reason, headers, body = self._request(url)
+      if status in (301, 302, 303, 307, 308):
+        location = headers.get('Location', None)
+        if location is None:
+          raise HTTPError(url, status, 'Redirect without location')
+        url = urljoin(url, location)
+        continue
+      break
+    else:
+      raise HTTPError(url, status, 'Too many redirects')
+    if status == 304:
+      with self.lock:
+        self.not_modified += 1
+        cached = self.validators.get(url, None)
+      if cached is None:
+        raise HTTPError(url, status, 'Not modified but nothing cached')
+      return cached[2]
+    if status != 200:
+      raise HTTPError(url, status, reason)
+    encoding = headers.get('Content-Encoding', '').lower()
+    try:
+      if encoding == 'gzip':
+        body = gzip.decompress(body)
+      elif encoding == 'deflate':
+        body = zlib.decompress(body)
+    except (EOFError, zlib.error) as ex:
+      # A truncated or corrupt body.
+      raise HTTPError(url, status, 'Cannot decompress %s body: %s' %
+                      (encoding, ex))
+    etag = headers.get('ETag', None)
+    last_modified = headers.get('Last-Modified', None)
+    with self.lock:
+      if etag is not None or last_modified is not None:
+        self.validators[url] = (etag, last_modified, body)
+      else:
+        self.validators.pop(url, None)
+    return body
+
+  def close(self):
+    """ Closes all the idle connections.
+    """
+    with self.lock:
+      connections = [connection
+                     for connection_list in self.idle_connections.values()
+                     for connection in connection_list]
+      self.idle_connections = dict()
+    for connection in connections:
+      connection.close()
+
+  def _request(self, url):
+    parts = urlsplit(url)
+    key = (parts.scheme, parts.hostname, parts.port)
+    path = parts.path or '/'
+    if parts.query:
+      path += '?' + parts.query
+    request_headers = {'Accept-Encoding': 'gzip, deflate',
+                       'Connection': 'keep-alive'}
+    with self.lock:
+      cached = self.validators.get(url, None)
+    if cached is not None:
+      if cached[0] is not None:
+        request_headers['If-None-Match'] = cached[0]
+      if cached[1] is not None:
+        request_headers['If-Modified-Since'] = cached[1]
+    connection = self._acquire(key)
+    try:
+      try:
+        response = self._send(connection, path, request_headers)
+      except (http.client.RemoteDisconnected, ConnectionError):
+        # The server may have closed an idle connection in the meantime;
+        # retry once with a fresh connection.
+        connection.close()
+        connection = self._connect(key)
+        response = self._send(connection, path, request_headers)
+      with metrics.span('download', parts.hostname):
+        body = response.read()
+    except Exception:
+      connection.close()
+      raise
+    with self.lock:
+      self.bytes_received += len(body)
+    metrics.count('bytes_received', parts.hostname, len(body))
+    if response.will_close:
+      connection.close()
+    else:
+      self._release(key, connection)
+    return response.status, response.reason, response.headers, body
+
+  def _send(self, connection, path, request_headers):
+    # Up to the response headers, ie, the time to the first byte.
+    with metrics.span('request', connection.host):
+      connection.request('GET', path, headers=request_headers)
+      return connection.getresponse()
+
+  def _acquire(self, key):
+    with self.lock:
+      connection_list = self.idle_connections.get(key, None)
+      if connection_list:
+        return connection_list.pop()
+    return self._connect(key)
+
+  def _release(self, key, connection):
+    with self.lock:
+      connection_list = self.idle_connections.setdefault(key, [])
+      if len(connection_list) < self.max_idle_per_host:
+        connection_list.append(connection)
+        return
+    connection.close()
+
+  def _connect(self, key):
+    scheme, host, port = key
+    if scheme == 'https':
+      connection = http.client.HTTPSConnection(host, port,
+                                               timeout=self.timeout)
+    elif scheme == 'http':
+      connection = http.client.HTTPConnection(host, port,
+                                              timeout=self.timeout)
+    else:
+      raise ValueError('Unsupported URL scheme: %s' % scheme)
+    # Connect now rather than on the first request, so the name lookup, TCP
+    # connect and TLS handshake are timed apart from the request.
+    with metrics.span('connect', host):
+      connection.connect()
+    with self.lock:
+      self.connections_opened += 1
+    return connection
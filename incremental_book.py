@@ -0,0 +1,168 @@
+""" Incremental order book maintenance from diff feeds.
+
+Instead of downloading the full depth every round, an exchange watcher can
+keep a local copy of the order book: a snapshot taken from the depth API,
+plus the add/modify/delete deltas received from a diff feed since then.
+Each delta carries a sequence number; a missing sequence number means that
+some deltas were lost, and the book has to be resynced from a new snapshot.
+"""
+
+import json
+import logging
+from array import array
+from bisect import bisect_left
+from collections import namedtuple
+from operator import neg
+from order_book import OrderBook
+from utils import convert_amount, convert_price
+
+# A change of one price level.  'side' is 'asks' or 'bids', the price is in
+# cents and the amount (the new total amount at the price) in satoshis.  An
+# amount of 0 deletes the level.
+Delta = namedtuple('Delta', ['sequence', 'side', 'price', 'amount'])
+
+def parse_delta(message, price_multiplier=100):
+  """ Parses a delta from a feed message, or returns None if the message is
+      malformed.  Prices are converted by 'price_multiplier' (see
+      utils.convert_price()), as the order books of the instrument.
+
+  The message should be a dict in the format of:
+      {'seq': 1234, 'side': 'asks', 'price': '98.20', 'amount': '1.5'}
+  """
+  try:
+    sequence = int(message['seq'])
+    side = message['side']
+    price = convert_price(message['price'], price_multiplier)
+    amount = convert_amount(message['amount'])
+  except (KeyError, TypeError, ValueError):
+    logging.error('Malformed delta: %s' % message)
+    return None
+  if (side not in ('asks', 'bids') or price is None or price <= 0 or
+      amount is None or amount < 0):
+    logging.error('Invalid delta: %s' % message)
+    return None
+  return Delta(sequence, side, price, amount)
+
+class _Side(object):
+  """ The levels of one side of the book, as columns sorted by price (in
+      ascending order for the asks and descending order for the bids), with
+      one level per price.
+  """
+  __slots__ = ('prices', 'amounts', 'key')
+
+  def __init__(self, levels, ascending):
+    """ 'levels' is an iterable of (price, amount) tuples in any order, where
+        a price may be repeated.
+    """
+    amounts = dict()
+    for price, amount in levels:
+      amounts[price] = amounts.get(price, 0) + amount
+    levels = sorted(amounts.items(), reverse=not ascending)
+    self.prices = array('q', [price for price, _ in levels])
+    self.amounts = array('q', [amount for _, amount in levels])
+    # Bisects the descending bids on their negated prices.
+    self.key = None if ascending else neg
+
+  def update(self, price, amount):
+    """ Sets the amount at a price, deleting the level if it is 0.
+    """
+    target = price if self.key is None else -price
+    i = bisect_left(self.prices, target, key=self.key)
+    if i < len(self.prices) and self.prices[i] == price:
+      if amount == 0:
+        del self.prices[i]
+        del self.amounts[i]
+      else:
+        self.amounts[i] = amount
+    elif amount != 0:
+      self.prices.insert(i, price)
+      self.amounts.insert(i, amount)
+
+class IncrementalOrderBook(object):
+  def __init__(self):
+    self.sides = {'asks': _Side((), True), 'bids': _Side((), False)}
+    # The sequence number of the last applied delta (or of the snapshot),
+    # or None if the book needs a snapshot.
+    self.sequence = None
+    # The order book built from the levels, or None if it is out of date.
+    self.order_book = None
+
+  @property
+  def synced(self):
+    return self.sequence is not None
+
+  def reset(self, order_book, sequence):
+    """ Replaces the content of the book with a valid snapshot, taken at the
+        given sequence number.
+    """
+    self.sides = {'asks': _Side(order_book['asks'], True),
+                  'bids': _Side(order_book['bids'], False)}
+    self.sequence = sequence
+    self.order_book = None
+
+  def apply(self, delta):
+    """ Applies a delta, and returns False if there is a gap in the sequence
+        numbers, in which case the book is no longer synced.
+
+    Deltas that are not newer than the book are ignored.
+    """
+    if not self.synced:
+      return False
+    if delta.sequence <= self.sequence:
+      return True
+    if delta.sequence != self.sequence + 1:
+      logging.warning('Sequence gap: expected %d, got %d' %
+                      (self.sequence + 1, delta.sequence))
+      self.sequence = None
+      return False
+    self.sides[delta.side].update(delta.price, delta.amount)
+    self.sequence = delta.sequence
+    self.order_book = None
+    return True
+
+  def get_order_book(self):
+    """ Returns the current content as an OrderBook, or None if not synced.
+    """
+    if not self.synced:
+      return None
+    if self.order_book is None:
+      # The columns are copied, as the order book must not change.  The
+      # levels are sorted and positive by construction.
+      asks, bids = self.sides['asks'], self.sides['bids']
+      self.order_book = OrderBook(array('q', asks.prices),
+                                  array('q', asks.amounts),
+                                  array('q', bids.prices),
+                                  array('q', bids.amounts), validated=True)
+    return self.order_book
+
+class DeltaFeed(object):
+  """ Base class for diff feeds.
+  """
+  def poll(self):
+    """ Returns the list of messages received since the last poll, without
+        blocking.
+    """
+    return []
+
+class ReplayFeed(DeltaFeed):
+  """ A feed replaying messages from a file with one json message per line.
+  """
+  def __init__(self, path, batch_size=None):
+    """ Each poll returns the next 'batch_size' messages, or all the
+        remaining messages if 'batch_size' is None.
+    """
+    self.fp = open(path, 'r')
+    self.batch_size = batch_size
+
+  def poll(self):
+    messages = []
+    while self.batch_size is None or len(messages) < self.batch_size:
+      line = self.fp.readline()
+      if line == '':
+        break
+      if line.strip():
+        messages.append(json.loads(line))
+    return messages
+
+  def close(self):
+    self.fp.close()
@@ -0,0 +1,132 @@
+""" Instruments (currency pairs, eg, 'BTC/USD') traded on the exchanges.
+
+An exchange watcher watches one instrument of an exchange, and its market
+is named by the exchange name, followed by the instrument unless it is the
+default instrument (eg, 'BTC-E LTC/BTC', but just 'BTC-E' for BTC/USD), so
+existing recordings and archives keep their names.  Prices are in the
+smallest unit of the quote currency (eg, cents, or satoshis for LTC/BTC),
+and amounts in 1e-8 of the base currency.
+"""
+
+import config
+from array import array
+from order_book import OrderBook
+
+DEFAULT_INSTRUMENT = 'BTC/USD'
+
+# The number of the smallest units in one unit of a quote currency.
+_PRICE_MULTIPLIERS = {
+    'BTC': 100000000,
+    'LTC': 100000000,
+}
+
+def split_instrument(instrument):
+  """ Returns the (base currency, quote currency) of an instrument.
+  """
+  base, _, quote = instrument.partition('/')
+  if not base or not quote:
+    raise ValueError('Invalid instrument: %s' % instrument)
+  return base, quote
+
+# The number of the units of an amount in one unit of the base currency.
+_AMOUNT_UNIT = 100000000
+
+def currency_unit(currency):
+  """ Returns the number of the smallest units of a currency in one unit
+      (eg, 100 cents in a dollar).
+  """
+  return _PRICE_MULTIPLIERS.get(currency, 100)
+
+def price_multiplier(instrument):
+  """ Returns the multiplier converting a price of an instrument into the
+      smallest unit of its quote currency (eg, 100 for cents).
+  """
+  return currency_unit(split_instrument(instrument)[1])
+
+def market_name(exchange_name, instrument):
+  if instrument == DEFAULT_INSTRUMENT:
+    return exchange_name
+  return '%s %s' % (exchange_name, instrument)
+
+def exchange_of(market):
+  """ Returns the exchange name of a market name.
+  """
+  return market.split(' ', 1)[0]
+
+def instrument_of(market):
+  """ Returns the instrument of a market name.
+  """
+  parts = market.split(' ', 1)
+  return parts[1] if len(parts) > 1 else DEFAULT_INSTRUMENT
+
+def pair_instrument(buy_market, sell_market):
+  """ Returns the instrument that the prices of an opportunity between two
+      markets are quoted in: their instrument, or the instrument quoted in
+      'config.fx_currency' they were both converted to (see
+      group_by_instrument()).
+  """
+  instrument = instrument_of(buy_market)
+  if instrument == instrument_of(sell_market):
+    return instrument
+  return '%s/%s' % (split_instrument(instrument)[0], config.fx_currency)
+
+def format_price(value, instrument):
+  """ Formats a value in the smallest unit of the quote currency of an
+      instrument (eg, a price or a profit in cents) in units of the currency
+      (eg, '12.34' for 1234 cents).
+  """
+  multiplier = price_multiplier(instrument)
+  return '%.*f' % (len(str(multiplier)) - 1, value / float(multiplier))
+
+def convert_order_book(order_book, rate):
+  """ Converts the prices of an order book into another quote currency, at
+      'rate' units of the other currency per unit.
+  """
+  convert = rate.__mul__
+  return OrderBook(array('q', map(round, map(convert, order_book.ask_prices))),
+                   order_book.ask_amounts,
+                   array('q', map(round, map(convert, order_book.bid_prices))),
+                   order_book.bid_amounts, order_book.timestamp,
+                   asks_truncated=order_book.asks_truncated,
+                   bids_truncated=order_book.bids_truncated)
+
+def convert_amounts(order_book, unit):
+  """ Converts the amounts of an order book from 1e-8 of the base currency
+      to 1/'unit' of it (eg, cents for a fiat base currency).
+  """
+  if not isinstance(order_book, OrderBook):
+    order_book = OrderBook.from_lists(order_book['asks'], order_book['bids'])
+
+  def convert(amount):
+    return amount * unit // _AMOUNT_UNIT
+  return OrderBook(order_book.ask_prices,
+                   array('q', map(convert, order_book.ask_amounts)),
+                   order_book.bid_prices,
+                   array('q', map(convert, order_book.bid_amounts)),
+                   order_book.timestamp,
+                   asks_truncated=order_book.asks_truncated,
+                   bids_truncated=order_book.bids_truncated)
+
+def group_by_instrument(order_books):
+  """ Groups a list of (market name, order book) tuples by instrument, into
+      a dict mapping an instrument to a list of (market name, order book)
+      tuples, which can be compared by the arbitrage detector.
+
+  A market quoted in a currency of 'config.fx_rates' is also converted to
+  the instrument quoted in 'config.fx_currency', so that, eg, BTC/EUR books
+  can be compared with BTC/USD books.
+  """
+  groups = dict()
+  for name, order_book in order_books:
+    instrument = instrument_of(name)
+    groups.setdefault(instrument, []).append((name, order_book))
+    base, quote = split_instrument(instrument)
+    rate = config.fx_rates.get(quote, None)
+    if rate is None or quote == config.fx_currency:
+      continue
+    if price_multiplier(instrument) != price_multiplier(
+        '%s/%s' % (base, config.fx_currency)):
+      continue
+    groups.setdefault('%s/%s' % (base, config.fx_currency), []).append(
+        (name, convert_order_book(order_book, rate)))
+  return groups
@@ -1,34 +1,98 @@
 """ A watcher of the entire market (multiple exchanges).
 """
 
+import asyncio
 import config
 import logging
 from bitstamp_watcher import BitstampWatcher
 from btce_watcher import BTCEWatcher
 from campbx_watcher import CampBXWatcher
 from concurrent.futures import ThreadPoolExecutor, wait
+from instruments import DEFAULT_INSTRUMENT
+from metrics import metrics
 from mtgox_watcher import MtGoxWatcher
+from poll_scheduler import create_poll_schedules
+from process_watcher import ProcessWatcher
+from time import monotonic, time
+
+def exchange_instruments():
+  """ Returns the list of (exchange, instrument) tuples to watch, from the
+      config file.
+  """
+  return [(exchange, instrument) for exchange in config.exchanges
+          for instrument in config.instruments.get(exchange,
+                                                   (DEFAULT_INSTRUMENT,))]
+
+def create_exchange_watcher(exchange, instrument=DEFAULT_INSTRUMENT):
+  """ Creates the watcher of an instrument of an exchange (eg, 'bitstamp')
+      from the config file.
+  """
+  watcher_dict = {
+      'bitstamp': BitstampWatcher,
+      'btce': BTCEWatcher,
+      'campbx': CampBXWatcher,
+      'mtgox': MtGoxWatcher
+  }
+  watcher = watcher_dict[exchange](instrument)
+  watcher.depth_budget = config.depth_budget.get(exchange, None)
+  return watcher
+
+def create_exchange_watchers():
+  """ Creates a list of exchange watchers from the config file, one for
+      each instrument of each exchange.  With 'config.watcher_processes',
+      each of them runs in a worker process (see process_watcher.py).
+  """
+  if config.watcher_processes:
+    return [ProcessWatcher(create_exchange_watcher, exchange, instrument)
+            for exchange, instrument in exchange_instruments()]
+  return [create_exchange_watcher(exchange, instrument)
+          for exchange, instrument in exchange_instruments()]
 
 class MarketWatcher(object):
   def __init__(self):
     """ Init a list of exchange watchers from the config file.
     """
-    watcher_dict = {
-        'bitstamp': BitstampWatcher,
-        'btce': BTCEWatcher,
-        'campbx': CampBXWatcher,
-        'mtgox': MtGoxWatcher
-    }
-    self.exchange_watchers = [watcher_dict[exchange]()
-                              for exchange in config.exchanges]
+    self.exchange_watchers = create_exchange_watchers()
+    self.recorder = None
+    self.archive_writer = None
+    # The polling schedules of the asynchronous mode.
+    self.poll_schedules = create_poll_schedules(
+        [exchange for exchange, _ in exchange_instruments()], monotonic())
     self.thread_pool = ThreadPoolExecutor(
         max_workers=len(self.exchange_watchers))
+    # Maps an exchange name to its request still in flight (a future) in the
+    # deadline mode.
+    self.pending_requests = dict()
+    # Maps an exchange name to its last known order book.
+    self.last_order_books = dict()
+
+  def close(self):
+    """ Stops the worker processes of the exchange watchers, if any.
+    """
+    for watcher in self.exchange_watchers:
+      if isinstance(watcher, ProcessWatcher):
+        watcher.close()
 
   def get_exchange_names(self):
     """ Returns a list of exchange names on this market.
     """
     return [watcher.exchange_name for watcher in self.exchange_watchers]
 
+  def start_recording(self, recorder):
+    """ Records the raw content received by all the exchange watchers
+        (see recorder.Recorder).
+    """
+    self.recorder = recorder
+    for watcher in self.exchange_watchers:
+      watcher.recorder = recorder
+
+  def start_archiving(self, archive_writer):
+    """ Appends every round of order books to an archive (see
+        book_archive.BookArchiveWriter).
+    """
+    self.archive_writer = archive_writer
+    self.archive_round = 0
+
   def get_order_books(self):
     """ Returns a list of order books collected from the exchanges.
 
@@ -36,12 +100,121 @@ class MarketWatcher(object):
     (eg, the API service is unavailable at the moment), its order book will
     be skipped in the result.  The return value is a list of tuples, with
     each tuple containing an exchange name and its order book.
+
+    If 'config.round_deadline_sec' is set, the round does not wait for
+    slower exchanges beyond the deadline; their last known order books are
+    returned instead, and the age of every order book can be told from its
+    timestamp.
     """
-    requests = [(watcher.exchange_name,
-                 self.thread_pool.submit(watcher.get_order_book))
-                for watcher in self.exchange_watchers]
-    logging.info('Waiting on %d requests' % len(requests))
-    wait([request[1] for request in requests])
-    return [(request[0], request[1].result())
-            for request in requests if request[1].result() is not None]
+    with metrics.span('round'):
+      return self._get_order_books()
+
+  def _get_order_books(self):
+    if self.recorder is not None:
+      self.recorder.begin_round()
+    # A request still in flight from an earlier round is not sent again,
+    # but one that has completed since is replaced by a new request.
+    self._collect_requests()
+    for watcher in self.exchange_watchers:
+      if watcher.exchange_name not in self.pending_requests:
+        self.pending_requests[watcher.exchange_name] = (
+            self.thread_pool.submit(watcher.get_order_book))
+    logging.info('Waiting on %d requests' % len(self.pending_requests))
+    # With a deadline, the requests that are not done in time are left in
+    # flight, and the last known order books of their exchanges are used
+    # instead (see OrderBook.age()).
+    wait(list(self.pending_requests.values()),
+         timeout=config.round_deadline_sec)
+    for exchange_name in self._collect_requests():
+      logging.info('Request to %s missed the deadline' % exchange_name)
+      metrics.count('missed_deadlines', exchange_name)
+    order_books = [(name, self.last_order_books[name])
+                   for name in self.get_exchange_names()
+                   if name in self.last_order_books]
+    for exchange_name, order_book in order_books:
+      logging.debug('Order book of %s: %d asks, %d bids, %d bytes' %
+          (exchange_name, len(order_book['asks']), len(order_book['bids']),
+           order_book.memory_size()))
+    self._archive(order_books)
+    return order_books
+
+  def _archive(self, order_books):
+    """ Appends a round of order books to the archive, if any.
+    """
+    if self.archive_writer is None:
+      return
+    self.archive_round += 1
+    timestamp = time()
+    for exchange_name, order_book in order_books:
+      self.archive_writer.append(timestamp, self.archive_round,
+                                 exchange_name, order_book)
+    self.archive_writer.flush()
+
+  def _collect_requests(self):
+    """ Updates the last known order books from the completed requests,
+        and returns the names of the exchanges with requests in flight.
+    """
+    for exchange_name, request in list(self.pending_requests.items()):
+      if not request.done():
+        continue
+      del self.pending_requests[exchange_name]
+      order_book = request.result()
+      if order_book is None:
+        self.last_order_books.pop(exchange_name, None)
+      else:
+        self.last_order_books[exchange_name] = order_book
+    return list(self.pending_requests.keys())
+
+  async def watch_order_books(self):
+    """ Asynchronously yields the order books whenever any of them changes.
+
+    Each exchange is polled on its own adaptive schedule within its rate
+    limit (see poll_scheduler.py), so a slow exchange does not hold back the
+    others.  Every yielded value is a list of (exchange name, order book)
+    tuples in the same format as get_order_books(), holding the most recent
+    order book of each exchange.  An exchange whose last request failed is
+    left out until it recovers.  Every yielded value is archived as a round,
+    as in get_order_books().
+    """
+    loop = asyncio.get_running_loop()
+    changed = asyncio.Event()
+    latest = dict()
+
+    async def poll(watcher, schedule):
+      while True:
+        await asyncio.sleep(schedule.delay(monotonic()))
+        if not schedule.start(monotonic()):
+          continue
+        name = watcher.exchange_name
+        try:
+          order_book = await loop.run_in_executor(self.thread_pool,
+                                                  watcher.get_order_book)
+        except Exception as ex:
+          # The exchange keeps being polled, as after any failed request.
+          logging.error('Failed to get the order book of %s: %s' % (name, ex))
+          order_book = None
+        schedule.update(order_book, monotonic())
+        if order_book is None:
+          if latest.pop(name, None) is not None:
+            changed.set()
+        elif order_book != latest.get(name, None):
+          logging.debug('Order book changed in %s' % name)
+          latest[name] = order_book
+          changed.set()
 
+    tasks = [loop.create_task(poll(watcher, schedule))
+             for watcher, schedule in zip(self.exchange_watchers,
+                                          self.poll_schedules)]
+    try:
+      while True:
+        await changed.wait()
+        changed.clear()
+        order_books = [(name, latest[name])
+                       for name in self.get_exchange_names() if name in latest]
+        self._archive(order_books)
+        yield order_books
+        if self.recorder is not None:
+          self.recorder.begin_round()
+    finally:
+      for task in tasks:
+        task.cancel()
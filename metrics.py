@@ -0,0 +1,209 @@
+""" Latency and size metrics for the watcher/detector pipeline.
+
+The pipeline is instrumented with timing spans, eg:
+
+    with metrics.span('parse', exchange_name):
+      ...
+
+Each span is aggregated into a latency histogram per (name, label), from
+which p50/p99 are reported, and sizes are aggregated into counters.  The
+metrics are exported as a json snapshot, periodically written to a file
+and/or served over HTTP on localhost (see config.metrics_*).
+
+When the metrics are disabled (the default), span() returns a shared no-op
+context manager, so the instrumentation costs a method call per span.
+"""
+
+import config
+import json
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Histogram(object):
+  """ A histogram of positive values (eg, seconds) over logarithmic buckets,
+      with a relative error of about 5% on the percentiles.
+  """
+  __slots__ = ('buckets', 'count', 'sum', 'max')
+
+  # The lower bound of the first bucket, and the growth of the buckets.
+  min_value = 1e-6
+  factor = 1.1
+
+  def __init__(self):
+    # Maps a bucket index to the number of values in the bucket.
+    self.buckets = dict()
+    self.count = 0
+    self.sum = 0.0
+    self.max = 0.0
+
+  def add(self, value):
+    if value <= self.min_value:
+      index = 0
+    else:
+      index = int(math.log(value / self.min_value, self.factor)) + 1
+    self.buckets[index] = self.buckets.get(index, 0) + 1
+    self.count += 1
+    self.sum += value
+    self.max = max(self.max, value)
+
+  def percentile(self, q):
+    """ Returns (the upper bound of the bucket of) the q-th percentile, with
+        q in [0, 100].
+    """
+    if self.count == 0:
+      return 0.0
+    rank = max(1, int(math.ceil(self.count * q / 100.0)))
+    seen = 0
+    for index in sorted(self.buckets.keys()):
+      seen += self.buckets[index]
+      if seen >= rank:
+        return min(self.min_value * self.factor ** index, self.max)
+    return self.max
+
+  def summary(self):
+    return {'count': self.count, 'sum': self.sum, 'max': self.max,
+            'p50': self.percentile(50), 'p99': self.percentile(99)}
+
+class _Span(object):
+  __slots__ = ('metrics', 'name', 'label', 'start')
+
+  def __init__(self, metrics, name, label):
+    self.metrics = metrics
+    self.name = name
+    self.label = label
+
+  def __enter__(self):
+    self.start = time.perf_counter()
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    self.metrics.observe(self.name, self.label,
+                         time.perf_counter() - self.start)
+    return False
+
+class _NullSpan(object):
+  __slots__ = ()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    return False
+
+_NULL_SPAN = _NullSpan()
+
+class Metrics(object):
+  def __init__(self, enabled=False):
+    self.enabled = enabled
+    self.lock = threading.Lock()
+    # Maps (name, label) to a Histogram of seconds.
+    self.histograms = dict()
+    # Maps (name, label) to a number.
+    self.counters = dict()
+    self.http_server = None
+
+  def span(self, name, label=None):
+    """ Returns a context manager timing its body into a histogram.
+    """
+    if not self.enabled:
+      return _NULL_SPAN
+    return _Span(self, name, label)
+
+  def observe(self, name, label, seconds):
+    with self.lock:
+      histogram = self.histograms.get((name, label), None)
+      if histogram is None:
+        histogram = self.histograms[(name, label)] = Histogram()
+      histogram.add(seconds)
+
+  def count(self, name, label=None, value=1):
+    """ Adds a value to a counter (eg, the number of bytes received).
+    """
+    if not self.enabled:
+      return
+    with self.lock:
+      self.counters[(name, label)] = self.counters.get((name, label), 0) + value
+
+  def snapshot(self):
+    """ Returns the metrics as a json-compatible dict:
+            {'histograms': {name: {label: summary}},
+             'counters': {name: {label: value}}}
+    """
+    result = {'time': time.time(), 'histograms': dict(), 'counters': dict()}
+    with self.lock:
+      for (name, label), histogram in self.histograms.items():
+        result['histograms'].setdefault(name, dict())[str(label)] = (
+            histogram.summary())
+      for (name, label), value in self.counters.items():
+        result['counters'].setdefault(name, dict())[str(label)] = value
+    return result
+
+  def write_snapshot(self, path):
+    """ Writes the snapshot to a file, atomically replacing the old one.
+    """
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as fp:
+      json.dump(self.snapshot(), fp, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+  def start_snapshot_writer(self, path, interval_sec):
+    """ Starts a daemon thread writing the snapshot every interval.
+    """
+    def loop():
+      while True:
+        time.sleep(interval_sec)
+        try:
+          self.write_snapshot(path)
+        except OSError as ex:
+          logging.error('Failed to write metrics to %s: %s' % (path, ex))
+    thread = threading.Thread(target=loop, name='metrics-writer')
+    thread.daemon = True
+    thread.start()
+
+  def start_http_server(self, port):
+    """ Serves the snapshot as json at http://127.0.0.1:<port>/ from a daemon
+        thread, and returns the port (useful if 'port' is 0).
+    """
+    metrics = self
+
+    class Handler(BaseHTTPRequestHandler):
+      def do_GET(self):
+        body = json.dumps(metrics.snapshot(), sort_keys=True).encode('utf8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+      def log_message(self, format, *args):
+        pass
+
+    self.http_server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+    thread = threading.Thread(target=self.http_server.serve_forever,
+                              name='metrics-server')
+    thread.daemon = True
+    thread.start()
+    return self.http_server.server_port
+
+  def stop_http_server(self):
+    if self.http_server is not None:
+      self.http_server.shutdown()
+      self.http_server.server_close()
+      self.http_server = None
+
+def start_exporters():
+  """ Enables the metrics and starts the exporters configured in config.
+  """
+  metrics.enabled = True
+  if config.metrics_snapshot_file is not None:
+    metrics.start_snapshot_writer(config.metrics_snapshot_file,
+                                  config.metrics_snapshot_interval_sec)
+  if config.metrics_port is not None:
+    metrics.start_http_server(config.metrics_port)
+
+# The metrics of this process.
+metrics = Metrics(enabled=config.metrics_enabled)
@@ -1,14 +1,31 @@
 """ Market watcher for MtGox.
 """
 
+from depth_parser import load, parse_order_book
 from exchange_watcher import ExchangeWatcher
+from instruments import DEFAULT_INSTRUMENT
 import logging
-from utils import convert_amount, convert_price
+from operator import itemgetter
+from order_book import OrderBook
+from utils import all_converted, convert_amount, convert_price
 
 class MtGoxWatcher(ExchangeWatcher):
-  def __init__(self):
-    super(MtGoxWatcher, self).__init__('MtGox')
-    self.url = 'http://data.mtgox.com/api/2/BTCUSD/money/depth'
+  instruments = ('BTC/USD', 'BTC/EUR', 'BTC/GBP', 'BTC/JPY')
+
+  def __init__(self, instrument=DEFAULT_INSTRUMENT):
+    super(MtGoxWatcher, self).__init__('MtGox', instrument)
+    # Eg, 'BTCUSD' for BTC/USD.
+    symbol = instrument.replace('/', '')
+    self.url = 'http://data.mtgox.com/api/2/%s/money/depth' % symbol
+
+  def _parse_order_book_from_bytes(self, body):
+    json_data = load(body)
+    if not isinstance(json_data, dict) or json_data.get('result') != 'success':
+      return None
+    return parse_order_book(json_data.get('data', None), 'asks', 'bids',
+                            itemgetter('price'), itemgetter('amount'),
+                            self.depth_budget, self.presorted,
+                            self.price_multiplier)
 
   def _parse_order_book_from_json(self, json_data):
     if json_data.get('result', None) != 'success':
@@ -24,7 +41,7 @@ class MtGoxWatcher(ExchangeWatcher):
     bids = self._create_price_amount_list(order_book_data, 'bids', False)
     if bids is None:
       return None
-    return {'asks': asks, 'bids': bids}
+    return OrderBook.from_lists(asks, bids, validated=True)
 
   def _create_price_amount_list(self, order_book_data, key, ascending):
     price_amount_data = order_book_data.get(key, None)
@@ -34,11 +51,14 @@ class MtGoxWatcher(ExchangeWatcher):
       return None
     try:
       price_amount_list = [
-          (convert_price(data['price']), convert_amount(data['amount']))
+          (convert_price(data['price'], self.price_multiplier),
+           convert_amount(data['amount']))
           for data in price_amount_data]
     except KeyError:
       logging.error('KeyError in price-amount data: %s' % price_amount_data)
       return None
+    if not all_converted(price_amount_list):
+      return None
     price_amount_list.sort(key=lambda x: x[0], reverse=not ascending)
     return price_amount_list
 
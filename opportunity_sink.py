@@ -0,0 +1,216 @@
+""" Sinks for the arbitrage opportunities found by the arbitrageur.
+
+The LogSink writes every opportunity as a human-readable log line, and the
+JournalSink appends it to a binary journal, which tools can read back
+without any parsing or loss of precision (eg, tools/gen_curves.py).
+
+A journal is an append-only file of fixed-size _RECORD records: timestamp,
+buy market, sell market, and the min/max/weighted buy and sell prices, the
+amount (in satoshis), and the pay and paid of an opportunity, in
+little-endian byte order.  The prices, pay and paid are in the smallest
+unit of the quote currency of the markets (see
+instruments.pair_instrument()), eg, cents.  The individual levels (buys and
+sells) are not kept.  Records are appended in time order, so a time range
+is found by binary search, and the reader scans the memory-mapped file with
+struct.iter_unpack().
+"""
+
+import logging
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+from instruments import format_price, pair_instrument, split_instrument
+
+_RECORD = struct.Struct('<d24s24s9q')
+
+# Stops the writer thread of a JournalSink.
+_CLOSE = object()
+
+JournalRecord = namedtuple('JournalRecord', [
+    'timestamp', 'buy_market', 'sell_market', 'min_buy_price',
+    'max_buy_price', 'weighted_buy_price', 'min_sell_price',
+    'max_sell_price', 'weighted_sell_price', 'amount', 'pay', 'paid'])
+
+class OpportunitySink(object):
+  """ Base class for the sinks.
+  """
+  def add(self, opportunity, timestamp=None):
+    """ Adds an opportunity found at a time (defaults to now).
+    """
+    pass
+
+  def flush(self):
+    pass
+
+  def close(self):
+    pass
+
+class LogSink(OpportunitySink):
+  def add(self, opportunity, timestamp=None):
+    # The prices are in the smallest unit of the quote currency (eg, cents,
+    # or satoshis for LTC/BTC).
+    instrument = pair_instrument(opportunity.buy_market,
+                                 opportunity.sell_market)
+    amount = opportunity.amount / 100000000.0
+    profit = opportunity.paid - opportunity.pay
+    rate = 0.0
+    # Sometimes the trading amount is so small (eg, 10 satoshis) that
+    # the pay is rounded down to 0 cents.
+    if opportunity.pay > 0:
+      rate = profit * 100.0 / opportunity.pay
+    marginal_rate = ((opportunity.min_sell_price - opportunity.max_buy_price) *
+                     100.0) / opportunity.max_buy_price
+    logging.info('Opportunity: buy=%s sell=%s from=%s to=%s amount=%.8f'
+                 ' pay=%s paid=%s profit=%s rate=%.2f%% mrate=%.2f%%'
+                 ' currency=%s'
+                 % (format_price(opportunity.weighted_buy_price, instrument),
+                    format_price(opportunity.weighted_sell_price, instrument),
+                    opportunity.buy_market, opportunity.sell_market, amount,
+                    format_price(opportunity.pay, instrument),
+                    format_price(opportunity.paid, instrument),
+                    format_price(profit, instrument), rate, marginal_rate,
+                    split_instrument(instrument)[1]))
+
+def _encode_name(name):
+  encoded = name.encode('utf8')
+  if len(encoded) > 24:
+    raise ValueError('Market name too long: %s' % name)
+  return encoded
+
+class JournalSink(OpportunitySink):
+  """ Appends the opportunities to a journal.  The records are packed by
+      add() and written by a background thread, so the detection loop never
+      waits on the disk.
+  """
+  def __init__(self, path):
+    self.fp = open(path, 'ab')
+    # Packed records, and threading.Events to set once the records before
+    # them are flushed, or _CLOSE to stop the writer.
+    self.queue = queue.SimpleQueue()
+    self.last_timestamp = None
+    self.thread = threading.Thread(target=self._write_loop,
+                                   name='journal-writer')
+    self.thread.daemon = True
+    self.thread.start()
+
+  def add(self, opportunity, timestamp=None):
+    if timestamp is None:
+      timestamp = time.time()
+    # The records are in time order, even with a clock going backwards.
+    if self.last_timestamp is not None:
+      timestamp = max(timestamp, self.last_timestamp)
+    self.last_timestamp = timestamp
+    self.queue.put(_RECORD.pack(
+        timestamp, _encode_name(opportunity.buy_market),
+        _encode_name(opportunity.sell_market), opportunity.min_buy_price,
+        opportunity.max_buy_price, opportunity.weighted_buy_price,
+        opportunity.min_sell_price, opportunity.max_sell_price,
+        opportunity.weighted_sell_price, opportunity.amount,
+        opportunity.pay, opportunity.paid))
+
+  def _write_loop(self):
+    while True:
+      items = [self.queue.get()]
+      # Write everything queued so far in one go.
+      while True:
+        try:
+          items.append(self.queue.get_nowait())
+        except queue.Empty:
+          break
+      self.fp.write(b''.join(item for item in items
+                             if isinstance(item, bytes)))
+      events = [item for item in items if isinstance(item, threading.Event)]
+      if events or _CLOSE in items:
+        self.fp.flush()
+      for event in events:
+        event.set()
+      if _CLOSE in items:
+        return
+
+  def flush(self):
+    """ Waits until all the added records are written and flushed.
+    """
+    event = threading.Event()
+    self.queue.put(event)
+    event.wait()
+
+  def close(self):
+    self.queue.put(_CLOSE)
+    self.thread.join()
+    self.fp.close()
+
+class _Timestamps(object):
+  """ A sequence view of the timestamps in a journal, for bisect.
+  """
+  def __init__(self, data, size):
+    self.data = data
+    self.size = size
+
+  def __len__(self):
+    return self.size
+
+  def __getitem__(self, i):
+    return struct.unpack_from('<d', self.data, i * _RECORD.size)[0]
+
+class JournalReader(object):
+  # The size of a record in bytes.
+  record_size = _RECORD.size
+
+  def __init__(self, path):
+    with open(path, 'rb') as fp:
+      if os.fstat(fp.fileno()).st_size == 0:
+        self.data = b''
+      else:
+        self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    # Ignore a partially written record at the end.
+    self.size = len(self.data) // _RECORD.size
+    self.timestamps = _Timestamps(self.data, self.size)
+
+  def __len__(self):
+    return self.size
+
+  def record(self, i):
+    """ Returns the i-th JournalRecord.
+    """
+    if not 0 <= i < self.size:
+      raise IndexError(i)
+    return self._make(_RECORD.unpack_from(self.data, i * _RECORD.size))
+
+  def _make(self, values):
+    return JournalRecord(values[0], values[1].rstrip(b'\0').decode('utf8'),
+                         values[2].rstrip(b'\0').decode('utf8'),
+                         *values[3:])
+
+  def find(self, timestamp):
+    """ Returns the index of the first record at or after a timestamp.
+    """
+    return bisect_left(self.timestamps, timestamp)
+
+  def raw_records(self, start=0, end=None):
+    """ Yields the records [start, end) as tuples of values, in the order of
+        the JournalRecord fields, with the market names as padded bytes.
+        This is the fastest way to scan a journal.
+    """
+    if end is None or end > self.size:
+      end = self.size
+    if start >= end:
+      return
+    yield from _RECORD.iter_unpack(
+        memoryview(self.data)[start * _RECORD.size:end * _RECORD.size])
+
+  def records(self, start_time=None, end_time=None):
+    """ Yields the JournalRecords with start_time <= timestamp < end_time.
+    """
+    start = 0 if start_time is None else self.find(start_time)
+    end = self.size if end_time is None else self.find(end_time)
+    for values in self.raw_records(start, end):
+      yield self._make(values)
+
+  def close(self):
+    if isinstance(self.data, mmap.mmap):
+      self.data.close()
@@ -0,0 +1,59 @@
+""" Tracking of arbitrage opportunities across rounds.
+
+An opportunity usually lasts for several rounds, and the detector finds it
+again in every one of them.  The tracker tells the lifecycle of the
+opportunity of each pair of markets instead: it appears, changes (eg, its
+size or prices), and disappears.  An opportunity equal to the one of the
+last round (which is cheap to tell, see ArbitrageOpportunity.__hash__()) is
+not reported again.
+"""
+
+from collections import namedtuple
+
+APPEARED, CHANGED, DISAPPEARED = 'appeared', 'changed', 'disappeared'
+
+# A change in the opportunity of a pair of markets.  For a disappeared one,
+# 'opportunity' is the last one seen.  'first_seen' is the time it appeared,
+# and 'rounds' the number of rounds it has been seen in.
+OpportunityEvent = namedtuple('OpportunityEvent', [
+    'kind', 'opportunity', 'first_seen', 'rounds'])
+
+class _Tracked(object):
+  __slots__ = ('opportunity', 'first_seen', 'rounds')
+
+  def __init__(self, opportunity, first_seen):
+    self.opportunity = opportunity
+    self.first_seen = first_seen
+    self.rounds = 1
+
+class OpportunityTracker(object):
+  def __init__(self):
+    # Maps (buy market, sell market) to the _Tracked opportunity.
+    self.tracked = dict()
+
+  def update(self, opportunities, now):
+    """ Updates the tracker with the opportunities of a round, found at time
+        'now', and returns the list of OpportunityEvents.  Pairs that had an
+        opportunity in the last round and have none in this one have
+        disappeared.
+    """
+    events = []
+    seen = set()
+    for opportunity in opportunities:
+      key = (opportunity.buy_market, opportunity.sell_market)
+      seen.add(key)
+      tracked = self.tracked.get(key, None)
+      if tracked is None:
+        tracked = self.tracked[key] = _Tracked(opportunity, now)
+        events.append(OpportunityEvent(APPEARED, opportunity, now, 1))
+        continue
+      tracked.rounds += 1
+      if opportunity != tracked.opportunity:
+        tracked.opportunity = opportunity
+        events.append(OpportunityEvent(CHANGED, opportunity,
+                                       tracked.first_seen, tracked.rounds))
+    for key in [key for key in self.tracked if key not in seen]:
+      tracked = self.tracked.pop(key)
+      events.append(OpportunityEvent(DISAPPEARED, tracked.opportunity,
+                                     tracked.first_seen, tracked.rounds))
+    return events
@@ -0,0 +1,149 @@
+""" A compact order book.
+
+Instead of a list of (price, amount) tuples for each side, an order book
+keeps its prices (in cents) and amounts (in satoshis) in int64 arrays, so a
+level costs 16 bytes rather than a tuple and two int objects.  For existing
+callers, an order book still behaves like the dict it replaces:
+order_book['asks'] is a read-only sequence of (price, amount) tuples.
+"""
+
+import sys
+import time
+from array import array
+
+class PriceAmountList(object):
+  """ A read-only sequence view of (price, amount) tuples over two columns.
+  """
+  __slots__ = ('prices', 'amounts')
+
+  def __init__(self, prices, amounts):
+    self.prices = prices
+    self.amounts = amounts
+
+  def __len__(self):
+    return len(self.prices)
+
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return list(zip(self.prices[index], self.amounts[index]))
+    return (self.prices[index], self.amounts[index])
+
+  def __iter__(self):
+    return zip(self.prices, self.amounts)
+
+  def __eq__(self, other):
+    if isinstance(other, PriceAmountList):
+      return self.prices == other.prices and self.amounts == other.amounts
+    try:
+      return len(self) == len(other) and all(
+          tuple(x) == y for x, y in zip(other, self))
+    except TypeError:
+      return False
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __str__(self):
+    return '%s' % list(self)
+
+  __repr__ = __str__
+
+class OrderBook(object):
+  """ An order book with the asks sorted by ascending prices and the bids
+      sorted by descending prices.
+  """
+  __slots__ = ('ask_prices', 'ask_amounts', 'bid_prices', 'bid_amounts',
+               'timestamp', 'validated', 'asks_truncated', 'bids_truncated')
+
+  def __init__(self, ask_prices, ask_amounts, bid_prices, bid_amounts,
+               timestamp=None, validated=False, asks_truncated=False,
+               bids_truncated=False):
+    """ The columns are int64 arrays (or any buffer of int64s).  The
+        timestamp is the time the order book was last known to be current
+        (see ExchangeWatcher.get_order_book()), or None if unknown.
+        'validated' tells that the columns are known to be valid (see
+        utils.validate_order_book()), eg, as they were built by a parser
+        that checks the levels as it converts them, so they are not checked
+        again.  'asks_truncated' and 'bids_truncated' tell that a side was
+        cut to a depth budget (see depth_parser.parse_side()), so the
+        exchange has deeper levels on it.  The columns must not be modified
+        afterwards.
+    """
+    self.ask_prices = ask_prices
+    self.ask_amounts = ask_amounts
+    self.bid_prices = bid_prices
+    self.bid_amounts = bid_amounts
+    self.timestamp = timestamp
+    self.validated = validated
+    self.asks_truncated = asks_truncated
+    self.bids_truncated = bids_truncated
+
+  @classmethod
+  def from_lists(cls, asks, bids, validated=False):
+    """ Creates an order book from lists of (price, amount) tuples.
+    """
+    return cls(array('q', [price for price, _ in asks]),
+               array('q', [amount for _, amount in asks]),
+               array('q', [price for price, _ in bids]),
+               array('q', [amount for _, amount in bids]),
+               validated=validated)
+
+  @property
+  def asks(self):
+    return PriceAmountList(self.ask_prices, self.ask_amounts)
+
+  @property
+  def bids(self):
+    return PriceAmountList(self.bid_prices, self.bid_amounts)
+
+  def age(self, now=None):
+    """ Returns the number of seconds since the order book was last known
+        to be current, or None if unknown.
+    """
+    if self.timestamp is None:
+      return None
+    if now is None:
+      now = time.time()
+    return max(0.0, now - self.timestamp)
+
+  def memory_size(self):
+    """ Returns the number of bytes used by this order book.
+    """
+    return sys.getsizeof(self) + sum(
+        sys.getsizeof(column) for column in (self.ask_prices, self.ask_amounts,
+                                             self.bid_prices, self.bid_amounts))
+
+  # The dict-like interface of the old order book representation.
+  def keys(self):
+    return ['asks', 'bids']
+
+  def __len__(self):
+    return 2
+
+  def __contains__(self, key):
+    return key in ('asks', 'bids')
+
+  def __getitem__(self, key):
+    if key == 'asks':
+      return self.asks
+    if key == 'bids':
+      return self.bids
+    raise KeyError(key)
+
+  def __eq__(self, other):
+    if isinstance(other, OrderBook):
+      return (self.ask_prices == other.ask_prices and
+              self.ask_amounts == other.ask_amounts and
+              self.bid_prices == other.bid_prices and
+              self.bid_amounts == other.bid_amounts)
+    if isinstance(other, dict):
+      return (len(other) == 2 and
+              self.asks == other.get('asks', None) and
+              self.bids == other.get('bids', None))
+    return False
+
+  def __ne__(self, other):
+    return not self.__eq__(other)
+
+  def __str__(self):
+    return '%s' % {'asks': list(self.asks), 'bids': list(self.bids)}
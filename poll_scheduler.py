@@ -0,0 +1,158 @@
+""" An adaptive polling schedule for each exchange.
+
+In the asynchronous mode, each exchange is polled on its own schedule, which
+adapts to get the most fresh data for the API quota:
+
+  - A token bucket enforces the rate limit of the exchange (see
+    'config.rate_limit_per_min'), so the exchange never throttles or bans us,
+    however short the polling interval gets.
+  - The polling interval moves between 'config.min_poll_interval_sec' and the
+    configured interval of the exchange (see 'config.poll_interval_sec') by
+    how often the top of its order book changes: an exchange whose best ask
+    or bid changes on most polls is polled more often, and a quiet one less
+    often.
+  - After a failed request (eg, an error or a timeout), the exchange is
+    backed off exponentially up to 'config.max_backoff_sec', with jitter so
+    retries to a struggling exchange do not line up.
+
+All the times are from a monotonic clock (eg, the event loop time).
+"""
+
+import config
+import random
+
+# Tolerance for the rounding errors in the token count, so that a token is
+# available after exactly delay() seconds.
+_EPSILON = 1e-9
+
+class TokenBucket(object):
+  """ A token bucket holding up to 'capacity' tokens, refilled at 'rate'
+      tokens per second.
+  """
+  def __init__(self, rate, capacity, now):
+    self.rate = rate
+    self.capacity = capacity
+    self.tokens = float(capacity)
+    self.last_time = now
+
+  def _refill(self, now):
+    if now > self.last_time:
+      self.tokens = min(self.capacity,
+                        self.tokens + (now - self.last_time) * self.rate)
+      self.last_time = now
+
+  def delay(self, now):
+    """ Returns the number of seconds until a token is available.
+    """
+    self._refill(now)
+    if self.tokens >= 1 - _EPSILON:
+      return 0.0
+    return (1 - self.tokens) / self.rate
+
+  def take(self, now):
+    """ Takes a token, and returns whether one was available.
+    """
+    self._refill(now)
+    if self.tokens < 1 - _EPSILON:
+      return False
+    self.tokens = max(0.0, self.tokens - 1)
+    return True
+
+def _top_of_book(order_book):
+  if order_book is None:
+    return None
+  asks, bids = order_book['asks'], order_book['bids']
+  return (asks[0] if len(asks) > 0 else None,
+          bids[0] if len(bids) > 0 else None)
+
+class PollSchedule(object):
+  # The weight of the latest poll in the change rate (an exponential moving
+  # average of whether the top of the order book changed).
+  change_weight = 0.2
+  # The backoff after the first failure, doubled for every further one.
+  base_backoff_sec = 2.0
+
+  def __init__(self, min_interval, max_interval, rate_limit_per_min,
+               max_backoff, now, rng=None, bucket=None):
+    """ The token bucket may be shared with the schedules of the other
+        instruments on the same exchange, as they share its rate limit.
+    """
+    self.min_interval = min_interval
+    self.max_interval = max(min_interval, max_interval)
+    self.max_backoff = max_backoff
+    # Bursts of a few requests are allowed, eg, to retry right after a
+    # transient error, as long as the average rate is within the limit.
+    if bucket is None:
+      bucket = TokenBucket(rate_limit_per_min / 60.0, 3, now)
+    self.bucket = bucket
+    self.rng = rng or random.Random()
+    # Start by assuming a busy exchange.
+    self.change_rate = 1.0
+    self.failures = 0
+    self.last_top = None
+    self.next_time = now
+
+  @property
+  def interval(self):
+    """ The polling interval by the change rate.
+    """
+    return (self.max_interval -
+            (self.max_interval - self.min_interval) * self.change_rate)
+
+  def delay(self, now):
+    """ Returns the number of seconds until the next poll.
+    """
+    return max(self.next_time - now, self.bucket.delay(now), 0.0)
+
+  def start(self, now):
+    """ Marks the start of a poll, and returns whether it is allowed by the
+        rate limit (if not, wait for delay() again).
+    """
+    if now < self.next_time - _EPSILON or not self.bucket.take(now):
+      return False
+    self.next_time = now + self.interval
+    return True
+
+  def update(self, order_book, now):
+    """ Updates the schedule with the result of a poll (None if failed), and
+        returns whether the top of the order book changed.
+    """
+    if order_book is None:
+      self.failures += 1
+      backoff = min(self.max_backoff,
+                    self.base_backoff_sec * 2 ** (self.failures - 1))
+      self.next_time = max(self.next_time,
+                           now + backoff * self.rng.uniform(0.5, 1.0))
+      return False
+    self.failures = 0
+    top = _top_of_book(order_book)
+    changed = top != self.last_top
+    self.last_top = top
+    self.change_rate += self.change_weight * (float(changed) -
+                                              self.change_rate)
+    return changed
+
+def create_poll_schedule(exchange, now, bucket=None):
+  """ Creates the poll schedule of an exchange (eg, 'bitstamp') from the
+      config file.
+  """
+  max_interval = config.poll_interval_sec.get(exchange,
+                                              config.sleep_between_rounds_sec)
+  return PollSchedule(min(config.min_poll_interval_sec, max_interval),
+                      max_interval,
+                      config.rate_limit_per_min.get(exchange, 60.0 /
+                                                    max_interval),
+                      config.max_backoff_sec, now, bucket=bucket)
+
+def create_poll_schedules(exchanges, now):
+  """ Creates the poll schedules of a list of exchanges, where the
+      schedules of the same exchange (eg, for different instruments) share
+      its rate limit.
+  """
+  schedules = []
+  buckets = dict()
+  for exchange in exchanges:
+    schedule = create_poll_schedule(exchange, now, buckets.get(exchange, None))
+    buckets[exchange] = schedule.bucket
+    schedules.append(schedule)
+  return schedules
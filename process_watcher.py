@@ -0,0 +1,189 @@
+""" Exchange watchers running in worker processes.
+
+In the default mode, the exchange watchers run in a thread pool: the
+requests overlap fine, but parsing and converting deep order books hold the
+GIL, and compete with each other and with the arbitrage detector.  With
+'config.watcher_processes', each exchange watcher runs in its own worker
+process instead, so the parsing scales with the cores.
+
+A converted order book is handed back through a block of shared memory owned
+by the main process, as its four int64 columns back to back:
+
+    ask prices | ask amounts | bid prices | bid amounts
+
+and only a small tuple with the numbers of levels goes through the pipe, so
+no list of levels is ever pickled.  The main process copies the columns out
+before sending the next request, so one block per watcher is enough; it is
+replaced by a larger one when an order book does not fit.
+"""
+
+import logging
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from metrics import metrics
+from multiprocessing.shared_memory import SharedMemory
+from order_book import OrderBook
+
+# The results of a request, see _fetch().
+_NEW, _UNCHANGED, _GROW = 'new', 'unchanged', 'grow'
+
+# The exchange watcher of a worker process.
+_watcher = None
+# The shared memory block the worker writes into.
+_shared_memory = None
+# The last order book sent to the main process, and the one waiting for a
+# larger block.
+_last_order_book = None
+_pending_order_book = None
+
+def _init_worker(factory, exchange, instrument):
+  global _watcher
+  _watcher = factory(exchange, instrument)
+
+def _attach(name):
+  global _shared_memory
+  if _shared_memory is None or _shared_memory.name != name:
+    if _shared_memory is not None:
+      _shared_memory.close()
+    _shared_memory = SharedMemory(name)
+  return _shared_memory
+
+def _fetch(name, capacity, record):
+  """ Gets the order book of the worker's exchange, and writes it into the
+      shared memory block 'name' of 'capacity' levels.  Returns:
+        - None if there was a problem (see ExchangeWatcher.get_order_book()),
+        - (_UNCHANGED, timestamp) if it is the same as the last one,
+        - (_GROW, levels) if the block is too small, and then the order book
+          is written by _write() into a larger block,
+        - or the result of _write().
+  """
+  global _pending_order_book
+  order_book = _watcher.get_order_book()
+  if order_book is None:
+    return None
+  if order_book is _last_order_book:
+    return (_UNCHANGED, order_book.timestamp)
+  levels = len(order_book.ask_prices) + len(order_book.bid_prices)
+  _pending_order_book = order_book
+  if levels > capacity:
+    return (_GROW, levels)
+  return _write(name, record)
+
+def _write(name, record):
+  """ Writes the pending order book into the shared memory block 'name',
+      and returns (_NEW, number of asks, number of bids, timestamp,
+      (asks truncated, bids truncated), body), where the body is the raw
+      content received if 'record' is set.
+  """
+  global _last_order_book, _pending_order_book
+  order_book = _pending_order_book
+  _pending_order_book = None
+  buffer = _attach(name).buf
+  start = 0
+  for column in (order_book.ask_prices, order_book.ask_amounts,
+                 order_book.bid_prices, order_book.bid_amounts):
+    column = memoryview(column).cast('B')
+    buffer[start:start + len(column)] = column
+    start += len(column)
+  _last_order_book = order_book
+  body = _watcher.last_body if record else None
+  return (_NEW, len(order_book.ask_prices), len(order_book.bid_prices),
+          order_book.timestamp,
+          (order_book.asks_truncated, order_book.bids_truncated), body)
+
+class ProcessWatcher(object):
+  """ Runs an exchange watcher in a worker process, with the interface of
+      an ExchangeWatcher (see the module docstring).
+  """
+  # The initial capacity of the shared memory block, in levels.
+  initial_levels = 4096
+
+  def __init__(self, factory, exchange, instrument):
+    """ 'factory(exchange, instrument)' creates the exchange watcher (eg,
+        market_watcher.create_exchange_watcher), and must be picklable.
+    """
+    # A local watcher for the name; it never sends a request.
+    self.exchange_name = factory(exchange, instrument).exchange_name
+    self.recorder = None
+    self.worker_args = (factory, exchange, instrument)
+    self.executor = None
+    self.shared_memory = None
+    self.capacity = 0
+    self.last_order_book = None
+    self._start_worker()
+    self._allocate(self.initial_levels)
+
+  def _start_worker(self):
+    # Not forked, as the main process runs threads.
+    self.executor = ProcessPoolExecutor(
+        max_workers=1, mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker, initargs=self.worker_args)
+
+  def _allocate(self, levels):
+    if self.shared_memory is not None:
+      self.shared_memory.close()
+      self.shared_memory.unlink()
+    self.shared_memory = SharedMemory(create=True, size=levels * 16)
+    self.capacity = levels
+
+  def get_order_book(self):
+    """ Gets the up-to-date and valid order book from the worker, or None if
+        there was a problem (see ExchangeWatcher.get_order_book()).
+    """
+    with metrics.span('get_order_book', self.exchange_name):
+      try:
+        result = self.executor.submit(_fetch, self.shared_memory.name,
+                                      self.capacity,
+                                      self.recorder is not None).result()
+        if result is not None and result[0] == _GROW:
+          self._allocate(max(result[1], self.capacity * 2))
+          result = self.executor.submit(_write, self.shared_memory.name,
+                                        self.recorder is not None).result()
+      except BrokenProcessPool:
+        logging.error('Worker of %s died, restarting' % self.exchange_name)
+        self._start_worker()
+        return None
+      except Exception as ex:
+        logging.error('Worker of %s failed: %s' % (self.exchange_name, ex))
+        return None
+    if result is None:
+      return None
+    if result[0] == _UNCHANGED:
+      if self.recorder is not None:
+        self.recorder.record(self.exchange_name, None)
+      self.last_order_book.timestamp = result[1]
+      return self.last_order_book
+    _, num_asks, num_bids, timestamp, truncated, body = result
+    if body is not None and self.recorder is not None:
+      self.recorder.record(self.exchange_name, body)
+    with metrics.span('transfer', self.exchange_name):
+      self.last_order_book = self._read(num_asks, num_bids, timestamp,
+                                        truncated)
+    return self.last_order_book
+
+  def _read(self, num_asks, num_bids, timestamp, truncated):
+    """ Copies the order book out of the shared memory block.
+    """
+    buffer = self.shared_memory.buf
+    result = []
+    start = 0
+    for length in (num_asks, num_asks, num_bids, num_bids):
+      column = array('q')
+      column.frombytes(buffer[start:start + length * 8])
+      result.append(column)
+      start += length * 8
+    # The worker's watcher only returns valid order books.
+    return OrderBook(*result, timestamp=timestamp, validated=True,
+                     asks_truncated=truncated[0],
+                     bids_truncated=truncated[1])
+
+  def close(self):
+    """ Stops the worker and frees the shared memory block.
+    """
+    self.executor.shutdown(wait=True, cancel_futures=True)
+    if self.shared_memory is not None:
+      self.shared_memory.close()
+      self.shared_memory.unlink()
+      self.shared_memory = None
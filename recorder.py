@@ -0,0 +1,170 @@
+""" Recording and replaying of the raw content from the exchanges.
+
+A recording is an append-only log of records, each holding the raw content
+returned by the API service of an exchange, with the time it was received
+and the round of the market watcher it belongs to.  Replaying a recording
+feeds the content through the same exchange watchers (for parsing) and
+arbitrage detector as live data, either as fast as possible or at the
+recorded speed, which makes detector changes testable and measurable
+offline.
+
+Each record is a header packed as _HEADER (timestamp, round, length of the
+exchange name, length of the content), followed by the exchange name in
+utf8 and the zlib-compressed content.  A record without content (which
+compressed content never is) marks that the content of the exchange was
+unchanged in the round (eg, the request got a 304), so a replay returns the
+same order books in the same rounds as the live run did.
+"""
+
+import logging
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from market_watcher import create_exchange_watcher, exchange_instruments
+
+_HEADER = struct.Struct('<dIHI')
+
+Record = namedtuple('Record', ['timestamp', 'round', 'exchange_name', 'body'])
+
+class Recorder(object):
+  def __init__(self, path):
+    self.fp = open(path, 'ab')
+    self.lock = threading.Lock()
+    self.round = 0
+
+  def begin_round(self):
+    """ Starts a new round; the following records will belong to it.
+    """
+    with self.lock:
+      self.fp.flush()
+      self.round += 1
+
+  def record(self, exchange_name, body, timestamp=None):
+    """ Appends the content received from an exchange, or None if it is
+        unchanged since the last record of the exchange.
+    """
+    name = exchange_name.encode('utf8')
+    compressed = b'' if body is None else zlib.compress(body)
+    with self.lock:
+      # Taken under the lock, so the timestamps are in order.
+      if timestamp is None:
+        timestamp = time.time()
+      self.fp.write(_HEADER.pack(timestamp, self.round, len(name),
+                                 len(compressed)))
+      self.fp.write(name)
+      self.fp.write(compressed)
+
+  def flush(self):
+    with self.lock:
+      self.fp.flush()
+
+  def close(self):
+    with self.lock:
+      self.fp.close()
+
+def read_records(path):
+  """ Yields the records in a recording, in the order they were written.
+
+  A truncated record at the end (eg, the recorder was killed in the middle
+  of writing) is ignored.
+  """
+  with open(path, 'rb') as fp:
+    while True:
+      header = fp.read(_HEADER.size)
+      if len(header) < _HEADER.size:
+        break
+      timestamp, round_number, name_length, body_length = _HEADER.unpack(
+          header)
+      name = fp.read(name_length)
+      compressed = fp.read(body_length)
+      if len(name) < name_length or len(compressed) < body_length:
+        logging.warning('Truncated record at the end of %s' % path)
+        break
+      # The body of an unchanged marker is None.
+      body = zlib.decompress(compressed) if compressed else None
+      yield Record(timestamp, round_number, name.decode('utf8'), body)
+
+def read_rounds(path):
+  """ Yields the records in a recording grouped by rounds, as lists.  The
+      rounds without any record (eg, all the requests failed) are yielded
+      as empty lists, so a replay has as many rounds as the live run.
+  """
+  records = []
+  last_round = 0
+  for record in read_records(path):
+    if records and record.round != records[-1].round:
+      yield records
+      records = []
+    if not records:
+      # A recording appended to by a new recorder starts again at round 1.
+      for _ in range(last_round + 1, record.round):
+        yield []
+      last_round = record.round
+    records.append(record)
+  if records:
+    yield records
+
+class ReplayMarketWatcher(object):
+  """ A market watcher replaying a recording instead of talking to the
+      exchanges, with the same interface as MarketWatcher.
+  """
+  def __init__(self, path, speed=None):
+    """ 'speed' is relative to the recorded speed (eg, 1.0 replays at the
+        recorded speed), or None to replay as fast as possible.
+    """
+    # The recorded content is parsed locally, even with
+    # 'config.watcher_processes'.
+    watchers = [create_exchange_watcher(exchange, instrument)
+                for exchange, instrument in exchange_instruments()]
+    self.watchers = dict((watcher.exchange_name, watcher)
+                         for watcher in watchers)
+    self.rounds = read_rounds(path)
+    # Maps an exchange name to its last order book, for unchanged content.
+    self.last_order_books = dict()
+    self.speed = speed
+    # The recorded and actual time of the last replayed round.
+    self.last_times = None
+
+  def get_exchange_names(self):
+    return list(self.watchers.keys())
+
+  def get_order_books(self):
+    """ Returns the order books of the next round in the same format as
+        MarketWatcher.get_order_books(), or None if the recording has been
+        fully replayed.
+    """
+    records = next(self.rounds, None)
+    if records is None:
+      return None
+    if records:
+      self._wait(records[0].timestamp)
+    order_books = []
+    for record in records:
+      watcher = self.watchers.get(record.exchange_name, None)
+      if watcher is None:
+        logging.warning('Unknown exchange in the recording: %s' %
+                        record.exchange_name)
+        continue
+      if record.body is None:
+        # The very same object as in the live run.
+        order_book = self.last_order_books.get(record.exchange_name, None)
+      else:
+        order_book = watcher.parse_order_book(record.body)
+      if order_book is not None:
+        self.last_order_books[record.exchange_name] = order_book
+        order_books.append((record.exchange_name, order_book))
+    return order_books
+
+  def _wait(self, recorded_time):
+    if self.speed is None:
+      return
+    now = time.time()
+    if self.last_times is not None:
+      delay = ((recorded_time - self.last_times[0]) / self.speed -
+               (now - self.last_times[1]))
+      if delay > 0:
+        time.sleep(delay)
+        now += delay
+    self.last_times = (recorded_time, now)
@@ -1,5 +1,9 @@
+import config
+import pickle
+import random
 import unittest
 from arbitrage_detector import ArbitrageDetector, ArbitrageOpportunity
+from order_book import OrderBook
 
 def _p(p):
   return int(round(p * 100))
@@ -13,6 +17,47 @@ def _pa(p, a):
 def _pal(p, a):
   return list(_pa(p, a))
 
+def _reference_process_pair(detector, buy_market, sell_market, asks, bids,
+                            marginal_profit_rate):
+  """ The original level-by-level walk, kept as the reference for the
+      columnar implementation.
+  """
+  if len(asks) == 0 or len(bids) == 0:
+    return None
+  good_asks = [list(ask) for ask in asks if ask[0] < bids[0][0]]
+  good_bids = [list(bid) for bid in bids if bid[0] > asks[0][0]]
+  if len(good_asks) == 0 or len(good_bids) == 0:
+    return None
+  i, j = 0, 0
+  buys, sells = [], []
+  while i < len(good_asks) and j < len(good_bids):
+    profit_rate = (good_bids[j][0] - good_asks[i][0]) / good_asks[i][0]
+    if profit_rate <= marginal_profit_rate:
+      break
+    amount = min(good_asks[i][1], good_bids[j][1])
+    buys.append((good_asks[i][0], amount))
+    sells.append((good_bids[j][0], amount))
+    good_asks[i][1] -= amount
+    good_bids[j][1] -= amount
+    if good_asks[i][1] == 0:
+      i += 1
+    if good_bids[j][1] == 0:
+      j += 1
+  return detector._process_buys_sells(buy_market, sell_market, buys, sells)
+
+def _random_levels(rng, center, ascending):
+  levels = []
+  price = center
+  for _ in range(rng.randint(0, 30)):
+    # Repeated prices are allowed in a valid order book.
+    if rng.random() < 0.8:
+      step = rng.randint(1, 300)
+      price = price + step if ascending else price - step
+    if price <= 0:
+      break
+    levels.append((price, rng.choice([1, 10, 1000, rng.randint(1, 10**9)])))
+  return levels
+
 class TestArbitrageDetector(unittest.TestCase):
   def setUp(self):
     self.detector = ArbitrageDetector(fixed_marginal_profit_rate=0)
@@ -108,6 +153,212 @@ class TestArbitrageDetector(unittest.TestCase):
         expected_opportunity,
         detector.process_pair('BuyMarket', 'SellMarket', asks, bids))
 
+  def test_process_pair_parity(self):
+    rng = random.Random(20130508)
+    for _ in range(2000):
+      center = rng.randint(5000, 15000)
+      asks = _random_levels(rng, center - rng.randint(-500, 1000), True)
+      bids = _random_levels(rng, center + rng.randint(-500, 1000), False)
+      rate = rng.choice([-0.01, 0, 0.001, 0.02, 0.05])
+      detector = ArbitrageDetector(fixed_marginal_profit_rate=rate)
+      self.assertEqual(
+          _reference_process_pair(detector, 'Buy', 'Sell', asks, bids, rate),
+          detector.process_pair('Buy', 'Sell', asks, bids))
+
+  def test_process(self):
+    order_books = [
+        ('A', {'asks': [_pa(2, 1), _pa(3, 1)], 'bids': [_pa(1, 1)]}),
+        ('B', {'asks': [_pa(7, 1)], 'bids': [_pa(5, 1), _pa(4, 1)]}),
+        ('C', {'asks': [_pa(4, 1)], 'bids': [_pa(3, 1)]}),
+    ]
+    opportunities = self.detector.process(order_books)
+    self.assertEqual(
+        [('A', 'B'), ('A', 'C'), ('C', 'B')],
+        [(o.buy_market, o.sell_market) for o in opportunities])
+    self.assertEqual(
+        self.detector.process_pair('A', 'B', order_books[0][1]['asks'],
+                                   order_books[1][1]['bids']),
+        opportunities[0])
+    self.assertEqual(opportunities, self.detector.process(
+        [(name, OrderBook.from_lists(order_book['asks'], order_book['bids']))
+         for name, order_book in order_books]))
+
+  def test_process_pruning_parity(self):
+    rng = random.Random(5)
+    for rate in (0, 0.01):
+      detector = ArbitrageDetector(fixed_marginal_profit_rate=rate)
+      for _ in range(200):
+        order_books = []
+        for k in range(rng.randint(0, 8)):
+          center = rng.randint(9000, 11000)
+          asks = _random_levels(rng, center, ascending=True)
+          bids = _random_levels(rng, center - rng.randint(1, 50),
+                                ascending=False)
+          order_books.append(('M%d' % k, OrderBook.from_lists(asks, bids)))
+        expected = []
+        for buy_market, buy_book in order_books:
+          for sell_market, sell_book in order_books:
+            if buy_market != sell_market:
+              opportunity = detector.process_pair(
+                  buy_market, sell_market, buy_book['asks'],
+                  sell_book['bids'])
+              if opportunity is not None:
+                expected.append(opportunity)
+        self.assertEqual(expected, detector.process(order_books))
+
+  def test_process_cache(self):
+    saved = config.detection_cache_size
+    try:
+      config.detection_cache_size = 4
+      order_books = [
+          ('A', OrderBook.from_lists([_pa(100, 1)], [_pa(99, 1)])),
+          ('B', OrderBook.from_lists([_pa(103, 1)], [_pa(102, 1)])),
+          ('C', OrderBook.from_lists([_pa(104, 1)], [_pa(103, 1)])),
+      ]
+      opportunities = self.detector.process(order_books)
+      self.assertEqual(2, len(self.detector.pair_cache))
+      self.assertEqual(opportunities, self.detector.process(order_books))
+      self.assertEqual(2, len(self.detector.pair_cache))
+      # Equal content in a new object hits the cache as well.
+      order_books[0] = ('A', OrderBook.from_lists([_pa(100, 1)],
+                                                  [_pa(99, 1)]))
+      self.assertEqual(opportunities, self.detector.process(order_books))
+      self.assertEqual(2, len(self.detector.pair_cache))
+      # Only the pairs with the changed order book are processed again.
+      order_books[0] = ('A', OrderBook.from_lists([_pa(101, 1)],
+                                                  [_pa(99, 1)]))
+      opportunities = self.detector.process(order_books)
+      self.assertEqual(4, len(self.detector.pair_cache))
+      self.assertEqual(_p(101), opportunities[0].max_buy_price)
+      self.assertEqual(
+          self.detector.process_pair('A', 'B', order_books[0][1]['asks'],
+                                     order_books[1][1]['bids']),
+          opportunities[0])
+      # The least recently used results are evicted.
+      first_fingerprint = list(self.detector.pair_cache.keys())[0][1]
+      order_books[0] = ('A', OrderBook.from_lists([_pa(100.5, 1)],
+                                                  [_pa(99, 1)]))
+      self.detector.process(order_books)
+      self.assertEqual(4, len(self.detector.pair_cache))
+      self.assertNotIn(first_fingerprint,
+                       [key[1] for key in self.detector.pair_cache])
+    finally:
+      config.detection_cache_size = saved
+
+  def test_thresholds(self):
+    detector = ArbitrageDetector()
+    detector.process([('Bitstamp', OrderBook.from_lists([], [])),
+                      ('MtGox', OrderBook.from_lists([], []))])
+    bitstamp = detector.market_index['Bitstamp']
+    mtgox = detector.market_index['MtGox']
+    normal = (config.marginal_profit_rate_normal + config.bitstamp_rate +
+              config.mtgox_rate)
+    self.assertAlmostEqual(normal, detector.thresholds[bitstamp][mtgox])
+    self.assertAlmostEqual(normal, detector.thresholds[mtgox][bitstamp])
+    # Bitstamp is short on cash: buying there needs a higher rate, and
+    # selling there a lower one, unless MtGox is short on bitcoins.
+    detector.update_balances({'Bitstamp': (100, 900)})
+    self.assertAlmostEqual(
+        normal - config.marginal_profit_rate_normal +
+        config.marginal_profit_rate_high,
+        detector.thresholds[bitstamp][mtgox])
+    self.assertAlmostEqual(normal, detector.thresholds[mtgox][bitstamp])
+    detector.update_balances({'MtGox': (900, 100)})
+    self.assertAlmostEqual(
+        normal - config.marginal_profit_rate_normal +
+        config.marginal_profit_rate_low,
+        detector.thresholds[mtgox][bitstamp])
+    detector.update_balances({'Bitstamp': (500, 500), 'MtGox': (400, 600),
+                              'CampBX': (0, 0)})
+    self.assertAlmostEqual(normal, detector.thresholds[bitstamp][mtgox])
+    self.assertAlmostEqual(
+        config.marginal_profit_rate_normal + config.compbx_rate * 2,
+        detector.thresholds[detector.market_index['CampBX']][
+            detector.market_index['CampBX']])
+
+  def test_process_with_commissions(self):
+    detector = ArbitrageDetector()
+    order_books = [
+        ('Bitstamp', OrderBook.from_lists([_pa(100, 1)], [_pa(99, 1)])),
+        ('BTC-E', OrderBook.from_lists([_pa(103, 1)], [_pa(102.6, 1)])),
+    ]
+    # A profit rate of 2.6% is not enough for a marginal profit rate of 2%
+    # and commissions of 0.5% and 0.2%.
+    self.assertEqual([], detector.process(order_books))
+    order_books[1] = ('BTC-E', OrderBook.from_lists([_pa(103, 1)],
+                                                    [_pa(102.8, 1)]))
+    self.assertEqual(1, len(detector.process(order_books)))
+    self.assertIsNotNone(detector.process_pair(
+        'Bitstamp', 'BTC-E', [_pa(100, 1)], [_pa(102.8, 1)]))
+    self.assertIsNone(detector.process_pair(
+        'Bitstamp', 'BTC-E', [_pa(100, 1)], [_pa(102.6, 1)]))
+
+  def test_process_stale(self):
+    saved = (config.max_order_book_age_sec, config.stale_profit_rate_per_sec)
+    try:
+      order_books = [
+          ('A', OrderBook.from_lists([_pa(100, 1)], [_pa(99, 1)])),
+          ('B', OrderBook.from_lists([_pa(103, 1)], [_pa(102, 1)])),
+      ]
+      order_books[0][1].timestamp = 1000.0
+      order_books[1][1].timestamp = 1010.0
+      config.max_order_book_age_sec = None
+      config.stale_profit_rate_per_sec = 0.0
+      self.assertEqual(1, len(self.detector.process(order_books, 1010.0)))
+      # A profit rate of 2% is not enough for a 10 second old order book
+      # at 0.25% per second.
+      config.stale_profit_rate_per_sec = 0.25/100
+      self.assertEqual([], self.detector.process(order_books, 1010.0))
+      self.assertEqual(1, len(self.detector.process(order_books, 1005.0)))
+      config.stale_profit_rate_per_sec = 0.0
+      config.max_order_book_age_sec = 9
+      self.assertEqual([], self.detector.process(order_books, 1010.0))
+      self.assertEqual(1, len(self.detector.process(order_books, 1009.0)))
+    finally:
+      config.max_order_book_age_sec, config.stale_profit_rate_per_sec = saved
+
+  def test_process_stale_cache(self):
+    saved = (config.max_order_book_age_sec, config.stale_profit_rate_per_sec)
+    try:
+      order_books = [
+          ('A', OrderBook.from_lists([_pa(100, 1)], [_pa(99, 1)])),
+          ('B', OrderBook.from_lists([_pa(103, 1)], [_pa(102, 1)])),
+      ]
+      order_books[0][1].timestamp = 1000.0
+      order_books[1][1].timestamp = 1000.0
+      config.max_order_book_age_sec = None
+      config.stale_profit_rate_per_sec = 0.01/100
+      opportunities = self.detector.process(order_books, 1000.2)
+      self.assertEqual(1, len(opportunities))
+      # The age is rounded up to a whole second, so an unchanged pair hits
+      # the cache until the next second.
+      self.assertEqual(opportunities,
+                       self.detector.process(order_books, 1000.7))
+      self.assertEqual(1, len(self.detector.pair_cache))
+      self.assertEqual(1, len(self.detector.process(order_books, 1001.5)))
+      self.assertEqual(2, len(self.detector.pair_cache))
+      # A different stale rate needs another margin, even in the same bucket.
+      config.stale_profit_rate_per_sec = 1.5/100
+      self.assertEqual([], self.detector.process(order_books, 1001.5))
+    finally:
+      config.max_order_book_age_sec, config.stale_profit_rate_per_sec = saved
+
+  def test_opportunity_is_immutable(self):
+    opportunity = ArbitrageOpportunity(
+        'BuyMarket', 'SellMarket', [_pal(2, 1)], [_pal(5, 1)], _p(2), _p(2),
+        _p(2), _p(5), _p(5), _p(5), _a(1), _p(2), _p(5))
+    self.assertEqual(((200, 100000000),), opportunity.buys)
+    self.assertRaises(AttributeError, setattr, opportunity, 'amount', 1)
+    same = ArbitrageOpportunity(
+        'BuyMarket', 'SellMarket', [_pa(2, 1)], [_pa(5, 1)], _p(2), _p(2),
+        _p(2), _p(5), _p(5), _p(5), _a(1), _p(2), _p(5))
+    self.assertEqual(opportunity, same)
+    self.assertEqual(1, len(set([opportunity, same])))
+    self.assertEqual(opportunity, pickle.loads(pickle.dumps(opportunity)))
+    self.assertNotEqual(opportunity, ArbitrageOpportunity(
+        'BuyMarket', 'SellMarket', [_pa(2, 1)], [_pa(5, 1)], _p(2), _p(2),
+        _p(2), _p(5), _p(5), _p(5), _a(1), _p(2), _p(6)))
+
 if __name__ == '__main__':
   unittest.main()
 
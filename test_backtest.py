@@ -0,0 +1,65 @@
+import os
+import shutil
+import tempfile
+import unittest
+from backtest import backtest, create_shards, parse_sweep, run_shard
+from book_archive import BookArchiveReader, BookArchiveWriter
+from order_book import OrderBook
+
+class TestBacktest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'archive')
+    writer = BookArchiveWriter(self.path)
+    for i in range(40):
+      # 'B' bids 1% to 4% above the asks of 'A', depending on the round.
+      spread = 100 + 100 * (i % 4)
+      writer.append(1000.0 + i, i, 'A', OrderBook.from_lists(
+          [(10000, 100000000), (10050, 100000000)], [(9900, 100000000)]))
+      writer.append(1000.0 + i, i, 'B', OrderBook.from_lists(
+          [(10500 + spread, 100000000)],
+          [(10000 + spread, 100000000)]))
+    writer.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_create_shards(self):
+    reader = BookArchiveReader(self.path)
+    shards = create_shards(reader, 7)
+    self.assertEqual(7, len(shards))
+    self.assertEqual(0, shards[0][0])
+    self.assertEqual(len(reader), shards[-1][1])
+    for (_, end), (start, _) in zip(shards[:-1], shards[1:]):
+      self.assertEqual(end, start)
+      # No round is split.
+      self.assertNotEqual(reader.entry(start - 1).round,
+                          reader.entry(start).round)
+
+  def test_parse_sweep(self):
+    self.assertEqual(
+        [{'a': 1.0, 'b': 3.0}, {'a': 1.0, 'b': 4.0},
+         {'a': 2.0, 'b': 3.0}, {'a': 2.0, 'b': 4.0}],
+        parse_sweep(['a=1,2', 'b=3,4']))
+    self.assertEqual([{}], parse_sweep([]))
+
+  def test_backtest(self):
+    param_sets = parse_sweep(['marginal_profit_rate_normal=0.005,0.025'])
+    results = backtest(self.path, param_sets, num_shards=5, max_workers=2)
+    serial = [run_shard(self.path, 0, 80, params) for params in param_sets]
+    for result, expected in zip(results, serial):
+      self.assertEqual(40, result.rounds)
+      stats = result.pairs[('A', 'B')]
+      expected_stats = expected.pairs[('A', 'B')]
+      self.assertEqual(
+          (expected_stats.count, expected_stats.amount, expected_stats.profit,
+           expected_stats.max_profit),
+          (stats.count, stats.amount, stats.profit, stats.max_profit))
+    # Spreads of 1%, 2%, 3% and 4% pass the lower threshold, and only the
+    # spreads of 3% and 4% pass the higher one.
+    self.assertEqual(40, results[0].pairs[('A', 'B')].count)
+    self.assertEqual(20, results[1].pairs[('A', 'B')].count)
+    self.assertRaises(ValueError, backtest, self.path, [{'no_such_rate': 1}])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,89 @@
+import os
+import shutil
+import tempfile
+import unittest
+from book_archive import (BookArchiveReader, BookArchiveWriter,
+                          archive_recording)
+from market_watcher import create_exchange_watchers
+from order_book import OrderBook
+from recorder import Recorder
+
+def _order_book(i):
+  return OrderBook.from_lists([(10000 + i, 100000000), (10100 + i, 5)],
+                              [(9900 - i, 200000000)] * (i % 3))
+
+class TestBookArchive(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'archive')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def _write(self, num_snapshots):
+    writer = BookArchiveWriter(self.path)
+    for i in range(num_snapshots):
+      writer.append(1000.0 + i, i // 2, 'Bitstamp' if i % 2 else 'BTC-E',
+                    _order_book(i))
+    writer.close()
+
+  def test_read(self):
+    self._write(10)
+    reader = BookArchiveReader(self.path)
+    self.assertEqual(10, len(reader))
+    snapshot = reader.snapshot(7)
+    self.assertEqual((1007.0, 3, 'Bitstamp'), snapshot[:3])
+    self.assertEqual(_order_book(7), snapshot.order_book)
+    self.assertIsInstance(snapshot.order_book.ask_prices, memoryview)
+    self.assertEqual(5, reader.find(1004.5))
+    self.assertEqual([1003.0, 1004.0],
+                     [s.timestamp for s in reader.snapshots(1003, 1005)])
+    index = reader.exchange_index()
+    self.assertEqual(['BTC-E', 'Bitstamp'], sorted(index.keys()))
+    self.assertEqual([1001.0, 1003.0, 1005.0, 1007.0, 1009.0],
+                     list(index['Bitstamp'][0]))
+    self.assertEqual([1, 3, 5, 7, 9], list(index['Bitstamp'][1]))
+    self.assertEqual(10, len(list(reader.snapshots())))
+    self.assertRaises(IndexError, reader.snapshot, 10)
+    del snapshot
+
+  def test_append_after_reopen(self):
+    self._write(3)
+    # A partially written index record is dropped.
+    with open(self.path + '.idx', 'ab') as fp:
+      fp.write(b'\x00' * 7)
+    writer = BookArchiveWriter(self.path)
+    # The time order carries on from the snapshots already archived, and a
+    # clock going backwards does not break it.
+    writer.append(500.0, 9, 'MtGox', _order_book(3))
+    writer.append(2000.0, 9, 'MtGox', _order_book(4))
+    writer.append(1999.0, 10, 'MtGox', _order_book(5))
+    writer.close()
+    reader = BookArchiveReader(self.path)
+    self.assertEqual(6, len(reader))
+    self.assertEqual(_order_book(2), reader.snapshot(2).order_book)
+    self.assertEqual(_order_book(4), reader.snapshot(4).order_book)
+    self.assertEqual([1002.0, 2000.0, 2000.0],
+                     [reader.entry(i).timestamp for i in range(3, 6)])
+
+  def test_empty(self):
+    self._write(0)
+    reader = BookArchiveReader(self.path)
+    self.assertEqual(0, len(reader))
+    self.assertEqual([], list(reader.snapshots(0, 10)))
+    reader.close()
+
+  def test_archive_recording(self):
+    recording = os.path.join(self.dir, 'recording')
+    recorder = Recorder(recording)
+    recorder.record('Bitstamp', b'{"asks": [["98", "1"]], "bids": []}', 1.0)
+    recorder.record('Bitstamp', b'{"error": "throttled"}', 2.0)
+    recorder.close()
+    self.assertEqual(1, archive_recording(recording, self.path,
+                                          create_exchange_watchers()))
+    reader = BookArchiveReader(self.path)
+    self.assertEqual(OrderBook.from_lists([(9800, 100000000)], []),
+                     reader.snapshot(0).order_book)
+
+if __name__ == '__main__':
+  unittest.main()
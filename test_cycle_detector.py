@@ -0,0 +1,122 @@
+import random
+import unittest
+from arbitrage_detector import ArbitrageDetector
+from cycle_detector import CycleDetector, Market
+from order_book import OrderBook
+
+def _book(asks, bids):
+  return OrderBook.from_lists(asks, bids)
+
+class _CountingEdges(list):
+  """ Edges counting how many times they are visited.
+  """
+  visits = 0
+
+  def __iter__(self):
+    for edge in super(_CountingEdges, self).__iter__():
+      self.visits += 1
+      yield edge
+
+class _CountingCycleDetector(CycleDetector):
+  def __init__(self, *args):
+    super(_CountingCycleDetector, self).__init__(*args)
+    self.visits = self.num_edges = self.sized = 0
+
+  def _find_negative_cycle(self, num_nodes, edges):
+    edges = _CountingEdges(edges)
+    try:
+      return super(_CountingCycleDetector, self)._find_negative_cycle(
+          num_nodes, edges)
+    finally:
+      self.visits += edges.visits
+      self.num_edges = len(edges)
+
+  def _size(self, cycle, markets, sides):
+    self.sized += 1
+    return super(_CountingCycleDetector, self)._size(cycle, markets, sides)
+
+class TestCycleDetector(unittest.TestCase):
+  def setUp(self):
+    # Bitcoins for 100 dollars in A, bitcoins for 80 euros in B, and euros
+    # for 1.30 dollars in C: 100 dollars -> 1 BTC -> 80 EUR -> 104 dollars,
+    # while no pair of markets trades the same currencies.
+    self.markets = [
+        Market('A', 'BTC', 'USD', _book([(10000, 100000000)],
+                                        [(9900, 100000000)])),
+        Market('B', 'BTC', 'EUR', _book([(8100, 100000000)],
+                                        [(8000, 50000000),
+                                         (7700, 100000000)])),
+        Market('C', 'EUR', 'USD', _book([(131, 100000)], [(130, 100000)]),
+               base_unit=100),
+    ]
+
+  def test_triangular_cycle(self):
+    cycles = CycleDetector(0.01).process(self.markets)
+    self.assertEqual(1, len(cycles))
+    cycle = cycles[0]
+    self.assertEqual(['buy', 'sell', 'sell'],
+                     [leg.action for leg in cycle.legs])
+    self.assertEqual(['A', 'B', 'C'], [leg.venue for leg in cycle.legs])
+    self.assertEqual('USD', cycle.currency)
+    self.assertAlmostEqual(0.04, cycle.rate)
+    # The second bid level of B (77 EUR) only makes 0.1%, below the margin
+    # of 0.5% for each of the three trades.
+    self.assertEqual(5000, cycle.amount)
+    self.assertEqual(200, cycle.profit)
+    self.assertEqual(50000000, cycle.legs[0].amount_out)
+    # With a larger margin, there is no cycle.
+    self.assertEqual([], CycleDetector(0.03).process(self.markets))
+
+  def test_inventory(self):
+    # Without bitcoins in B, the bitcoins bought in A cannot be sold in B.
+    inventory = set([('A', 'USD'), ('A', 'BTC'), ('B', 'EUR'), ('C', 'EUR'),
+                     ('C', 'USD')])
+    self.assertEqual([], CycleDetector(0.01).process(self.markets,
+                                                     inventory))
+
+  def test_pair_cycle(self):
+    detector = ArbitrageDetector(fixed_marginal_profit_rate=0.01)
+    order_books = [
+        ('A', _book([(10000, 100000000), (10200, 100000000)],
+                    [(9900, 100000000)])),
+        ('B', _book([(10500, 100000000)], [(10400, 150000000)])),
+    ]
+    cycles = detector.process_cycles(order_books)
+    self.assertEqual(1, len(cycles))
+    opportunity = detector.process(order_books)[0]
+    self.assertEqual('USD', cycles[0].currency)
+    self.assertEqual(opportunity.amount, cycles[0].legs[0].amount_out)
+    self.assertEqual(opportunity.pay, cycles[0].amount)
+    self.assertEqual(opportunity.paid - opportunity.pay, cycles[0].profit)
+
+  def test_fiat_base_cycle(self):
+    # The markets of setUp() as named markets, with the EUR/USD amounts in
+    # 1e-8 euros as from the watchers.
+    detector = ArbitrageDetector(fixed_marginal_profit_rate=0.01)
+    order_books = [('A', self.markets[0].order_book),
+                   ('B BTC/EUR', self.markets[1].order_book),
+                   ('C EUR/USD', _book([(131, 100000000000)],
+                                       [(130, 100000000000)]))]
+    cycles = detector.process_cycles(order_books)
+    self.assertEqual(1, len(cycles))
+    expected = CycleDetector(0.01).process(self.markets)[0]
+    self.assertEqual(expected.amount, cycles[0].amount)
+    self.assertAlmostEqual(expected.profit, cycles[0].profit)
+
+  def test_no_cycle_work(self):
+    rng = random.Random(3)
+    markets = []
+    for k in range(40):
+      center = 10000 + rng.randint(-20, 20)
+      markets.append(Market('M%d' % k, 'BTC', 'USD', _book(
+          [(center + i + 1, 100000) for i in range(200)],
+          [(center - i - 1, 100000) for i in range(200)]), 0.002))
+    detector = _CountingCycleDetector(0.01)
+    self.assertEqual([], detector.process(markets))
+    # Without a cycle, Bellman-Ford stops after a few passes over the edges
+    # instead of one per node, and no order book is walked.
+    self.assertEqual(0, detector.sized)
+    self.assertLessEqual(detector.visits, 4 * detector.num_edges)
+
+if __name__ == '__main__':
+  unittest.main()
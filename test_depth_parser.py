@@ -0,0 +1,114 @@
+import json
+import random
+import unittest
+from arbitrage_detector import ArbitrageDetector
+from bitstamp_watcher import BitstampWatcher
+from depth_parser import parse_depth
+from mtgox_watcher import MtGoxWatcher
+from order_book import OrderBook
+
+def _payload(rng, center, depth, shuffle):
+  asks = [['%.2f' % (center + 0.01 * rng.randint(0, 3) * i), '1.5']
+          for i in range(depth)]
+  bids = [['%.2f' % (center - 0.01 * rng.randint(0, 3) * i), '2.5']
+          for i in range(depth)]
+  if shuffle:
+    rng.shuffle(asks)
+    rng.shuffle(bids)
+  return json.dumps({'asks': asks, 'bids': bids}).encode('utf8')
+
+class TestDepthParser(unittest.TestCase):
+  def test_parse_depth(self):
+    body = (b'{"timestamp": "1368000000", "bids": [["96.00", "10.0"],'
+            b' ["97.50", "0.5"]], "asks": [[98, 1], [98.2, 1.5, 123]]}')
+    self.assertEqual(
+        OrderBook.from_lists([(9800, 100000000), (9820, 150000000)],
+                             [(9750, 50000000), (9600, 1000000000)]),
+        parse_depth(body))
+    self.assertEqual(OrderBook.from_lists([], []),
+                     parse_depth(b'{"Asks": [ ], "Bids": []}', 'Asks',
+                                 'Bids'))
+
+  def test_parse_depth_invalid(self):
+    self.assertIsNone(parse_depth(b'{"asks": [[98, 1]'))
+    self.assertIsNone(parse_depth(b'{"asks": [[98, 1]]}'))
+    self.assertIsNone(parse_depth(b'{"asks": [[98]], "bids": []}'))
+    self.assertIsNone(parse_depth(b'{"asks": [[98, "$1"]], "bids": []}'))
+    self.assertIsNone(parse_depth(b'{"asks": [[98, 0]], "bids": []}'))
+    self.assertIsNone(parse_depth(b'{"asks": [[98, null]], "bids": []}'))
+    self.assertIsNone(parse_depth(b'[]'))
+
+  def test_watchers_agree_with_json_path(self):
+    bitstamp_body = json.dumps({
+        'asks': [['98.20', '1.5'], ['98.00', '1.0'], ['98.20', '0.5'],
+                 ['98.006', '0.12345678']],
+        'bids': [['96.00', '10.0'], ['97.60', '0.1']]}).encode('utf8')
+    watcher = BitstampWatcher()
+    self.assertEqual(
+        watcher._parse_order_book_from_json(json.loads(bitstamp_body)),
+        watcher._parse_order_book_from_bytes(bitstamp_body))
+    mtgox_body = json.dumps({'result': 'success', 'data': {
+        'asks': [{'price': 98.2, 'amount': 1.5, 'price_int': '9820000',
+                  'amount_int': '150000000'}],
+        'bids': [{'price': '97.6', 'amount': '0.1'}]}}).encode('utf8')
+    watcher = MtGoxWatcher()
+    self.assertEqual(
+        watcher._parse_order_book_from_json(json.loads(mtgox_body)),
+        watcher._parse_order_book_from_bytes(mtgox_body))
+    self.assertIsNone(watcher._parse_order_book_from_bytes(
+        b'{"result": "error", "data": {"asks": [], "bids": []}}'))
+
+  def test_depth_budget(self):
+    rng = random.Random(7)
+    for shuffle in (False, True):
+      for presorted in (False, True):
+        body = _payload(rng, 100, 50, shuffle)
+        full = parse_depth(body)
+        truncated = parse_depth(body, depth=10, presorted=presorted)
+        self.assertEqual(full['asks'][:10], truncated['asks'])
+        self.assertEqual(full['bids'][:10], truncated['bids'])
+        self.assertTrue(truncated.asks_truncated)
+        self.assertTrue(truncated.bids_truncated)
+        self.assertFalse(full.asks_truncated or full.bids_truncated)
+    self.assertEqual(full, parse_depth(body, depth=50, presorted=True))
+    untruncated = parse_depth(body, depth=50)
+    self.assertFalse(untruncated.asks_truncated or untruncated.bids_truncated)
+    # Only the side with more levels than the budget is truncated.
+    one_side = parse_depth(json.dumps({'asks': [['100', '1'], ['101', '1']],
+                                       'bids': [['99', '1']]}).encode('utf8'),
+                           depth=1)
+    self.assertTrue(one_side.asks_truncated)
+    self.assertFalse(one_side.bids_truncated)
+
+  def test_depth_budget_same_detection(self):
+    rng = random.Random(11)
+    detector = ArbitrageDetector(fixed_marginal_profit_rate=0.001)
+    for shuffle in (False, True):
+      bodies = [_payload(rng, 100, 300, shuffle),
+                _payload(rng, 100.2, 300, shuffle)]
+      full = [('A', parse_depth(bodies[0])), ('B', parse_depth(bodies[1]))]
+      truncated = [('A', parse_depth(bodies[0], depth=100)),
+                   ('B', parse_depth(bodies[1], depth=100))]
+      opportunities = detector.process(full)
+      self.assertEqual(1, len(opportunities))
+      self.assertEqual(opportunities, detector.process(truncated))
+
+  def test_whole_side_warning(self):
+    detector = ArbitrageDetector(fixed_marginal_profit_rate=0.001)
+    body = _payload(random.Random(5), 100, 20, False)
+    deep = parse_depth(_payload(random.Random(6), 200, 20, False))
+    # The deep book takes the whole of the other one.
+    with self.assertNoLogs(level='WARNING'):
+      self.assertEqual(1, len(detector.process([('A', parse_depth(body)),
+                                                ('B', deep)])))
+    with self.assertLogs(level='WARNING'):
+      detector.process([('A', parse_depth(body, depth=10)), ('B', deep)])
+    # Only the truncation of the side taken is warned about.
+    order_book = parse_depth(body)
+    order_book.bids_truncated = True
+    with self.assertNoLogs(level='WARNING'):
+      self.assertEqual(1, len(detector.process([('A', order_book),
+                                                ('B', deep)])))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,100 @@
+import config
+import os
+import shutil
+import tempfile
+import unittest
+from arbitrage_detector import ArbitrageDetector
+from book_archive import BookArchiveReader, BookArchiveWriter
+from execution_simulator import (ExecutionSimulator, simulate,
+                                 simulate_shard)
+from order_book import OrderBook
+
+class TestExecutionSimulator(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'archive')
+    writer = BookArchiveWriter(self.path)
+    for i in range(30):
+      # 'B' bids 3% above the asks of 'A' every third round; in the round
+      # after, its bid is only half as deep, and then it is gone.
+      bid = [(10300, 100000000), (10000, 100000000), (9000, 100000000)][i % 3]
+      writer.append(1000.0 + i, i, 'A', OrderBook.from_lists(
+          [(10000, 100000000)], [(9900, 100000000)]))
+      writer.append(1000.0 + i, i, 'B', OrderBook.from_lists(
+          [(11000, 100000000)], [bid] if i % 3 != 1 else
+          [(10300, 50000000), (9800, 100000000)]))
+    writer.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_execute(self):
+    reader = BookArchiveReader(self.path)
+    detector = ArbitrageDetector(fixed_marginal_profit_rate=0.01)
+    order_books = [('A', reader.snapshot(0).order_book),
+                   ('B', reader.snapshot(1).order_book)]
+    opportunity = detector.process(order_books, now=1000.0)[0]
+    self.assertEqual(100000000, opportunity.amount)
+    detected_profit = opportunity.paid - opportunity.pay
+    # Before the books move, the opportunity fills as detected.
+    execution = ExecutionSimulator(reader, 0.3, 0.1).execute(opportunity,
+                                                              1000.0)
+    self.assertEqual((100000000, 100000000), (execution.bought,
+                                              execution.sold))
+    self.assertAlmostEqual(detected_profit, execution.realized_profit)
+    self.assertAlmostEqual(detected_profit, execution.detected_profit)
+    # A second later, only half of the amount can be sold.
+    execution = ExecutionSimulator(reader, 1.0, 0.1).execute(opportunity,
+                                                              1000.0)
+    self.assertEqual((100000000, 50000000), (execution.bought,
+                                             execution.sold))
+    self.assertAlmostEqual(detected_profit / 2, execution.realized_profit)
+    # Two seconds later, nothing can be sold.
+    execution = ExecutionSimulator(reader, 2.0, 0.1).execute(opportunity,
+                                                              1000.0)
+    self.assertEqual(0, execution.sold)
+    self.assertEqual(0.0, execution.realized_profit)
+    # Before the history, nothing fills.
+    execution = ExecutionSimulator(reader, 0.0, 0.0).execute(opportunity,
+                                                              900.0)
+    self.assertEqual((0, 0), (execution.bought, execution.sold))
+
+  def test_simulate(self):
+    result = simulate(self.path, network_latency_sec=1.0,
+                      matching_latency_sec=0.0, num_shards=4, max_workers=2)
+    serial = simulate_shard(self.path, 0, 60, 1.0, 0.0)
+    self.assertEqual(30, result.rounds)
+    stats = result.pairs[('A', 'B')]
+    expected = serial.pairs[('A', 'B')]
+    self.assertEqual(
+        (expected.count, expected.filled, expected.partial, expected.missed),
+        (stats.count, stats.filled, stats.partial, stats.missed))
+    # A second after the full opportunity, only half of it can be sold, and
+    # a second after the half one, nothing.
+    self.assertEqual((20, 0, 10, 10), (stats.count, stats.filled,
+                                       stats.partial, stats.missed))
+    self.assertEqual(10 * 50000000 + 10 * 50000000, stats.unmatched)
+    self.assertAlmostEqual(10 * 300 / 2, stats.realized_profit)
+    self.assertAlmostEqual(10 * 300 + 10 * 300 / 2, stats.detected_profit)
+  def test_simulate_sharding(self):
+    path = os.path.join(self.dir, 'lasting')
+    writer = BookArchiveWriter(path)
+    for i in range(40):
+      writer.append(1000.0 + i, i, 'A', OrderBook.from_lists(
+          [(10000, 100000000)], [(9900, 100000000)]))
+      writer.append(1000.0 + i, i, 'B', OrderBook.from_lists(
+          [(11000, 100000000)], [(10300, 100000000)]))
+    writer.close()
+    saved = config.track_opportunities
+    try:
+      config.track_opportunities = True
+      # An opportunity lasting across the shards is only executed once.
+      for num_shards in (1, 4, 8):
+        result = simulate(path, num_shards=num_shards, max_workers=2)
+        self.assertEqual(40, result.rounds)
+        self.assertEqual(1, result.pairs[('A', 'B')].count)
+    finally:
+      config.track_opportunities = saved
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,121 @@
+import gzip
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from http_client import HTTPClient, HTTPError
+
+_DEPTH = json.dumps({
+    'asks': [['98.00', '1.0'], ['98.20', '1.5']] * 200,
+    'bids': [['96.00', '10.0'], ['95.00', '2.0']] * 200
+}).encode('utf8')
+
+class _StubHandler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  def setup(self):
+    super(_StubHandler, self).setup()
+    with self.server.lock:
+      self.server.connections += 1
+
+  def do_GET(self):
+    if self.path == '/missing':
+      self._respond(404, b'')
+      return
+    if self.path in ('/truncated', '/corrupt'):
+      body = gzip.compress(_DEPTH)[:100]
+      encoding = 'gzip'
+      if self.path == '/corrupt':
+        body, encoding = b'not deflated', 'deflate'
+      self._respond(200, body, {'Content-Encoding': encoding})
+      return
+    if self.headers.get('If-None-Match', None) == self.server.etag:
+      self._respond(304, None)
+      return
+    body = self.server.body
+    headers = {'ETag': self.server.etag}
+    if 'gzip' in self.headers.get('Accept-Encoding', ''):
+      body = gzip.compress(body)
+      headers['Content-Encoding'] = 'gzip'
+    self._respond(200, body, headers)
+
+  def _respond(self, status, body, headers=None):
+    self.send_response(status)
+    for key, value in (headers or dict()).items():
+      self.send_header(key, value)
+    if body is not None:
+      self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    if body:
+      with self.server.lock:
+        self.server.bytes_sent += len(body)
+      self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+class TestHTTPClient(unittest.TestCase):
+  def setUp(self):
+    self.server = ThreadingHTTPServer(('127.0.0.1', 0), _StubHandler)
+    self.server.lock = threading.Lock()
+    self.server.connections = 0
+    self.server.bytes_sent = 0
+    self.server.body = _DEPTH
+    self.server.etag = '"v1"'
+    self.thread = threading.Thread(target=self.server.serve_forever)
+    self.thread.daemon = True
+    self.thread.start()
+    self.url = 'http://127.0.0.1:%d/depth' % self.server.server_port
+    self.client = HTTPClient(timeout=5)
+
+  def tearDown(self):
+    self.client.close()
+    self.server.shutdown()
+    self.server.server_close()
+
+  def _round(self):
+    """ Fetches the depth once and returns the (connections, bytes) used.
+    """
+    connections, bytes_sent = self.server.connections, self.server.bytes_sent
+    body = self.client.get(self.url)
+    return (body, self.server.connections - connections,
+            self.server.bytes_sent - bytes_sent)
+
+  def test_keep_alive_and_conditional_requests(self):
+    body, connections, bytes_sent = self._round()
+    self.assertEqual(_DEPTH, body)
+    self.assertEqual(1, connections)
+    # The payload was gzipped on the wire.
+    self.assertLess(bytes_sent, len(_DEPTH) / 10)
+    self.assertEqual(bytes_sent, self.client.bytes_received)
+    # Unchanged content costs neither a new connection nor any payload,
+    # and the same body object is returned.
+    for _ in range(5):
+      cached_body, connections, bytes_sent = self._round()
+      self.assertIs(body, cached_body)
+      self.assertEqual(0, connections)
+      self.assertEqual(0, bytes_sent)
+    self.assertEqual(5, self.client.not_modified)
+    # Changed content is downloaded again over the same connection.
+    self.server.body = _DEPTH.replace(b'98.00', b'97.00')
+    self.server.etag = '"v2"'
+    body, connections, bytes_sent = self._round()
+    self.assertEqual(self.server.body, body)
+    self.assertEqual(0, connections)
+    self.assertGreater(bytes_sent, 0)
+    self.assertEqual(1, self.client.connections_opened)
+
+  def test_error_status(self):
+    with self.assertRaises(HTTPError):
+      self.client.get('http://127.0.0.1:%d/missing' % self.server.server_port)
+    # The connection is still usable afterwards.
+    self.assertEqual(_DEPTH, self.client.get(self.url))
+
+  def test_bad_body(self):
+    for path in ('/truncated', '/corrupt'):
+      with self.assertRaises(HTTPError):
+        self.client.get('http://127.0.0.1:%d%s' % (self.server.server_port,
+                                                   path))
+
+if __name__ == '__main__':
+  unittest.main()
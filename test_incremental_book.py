@@ -0,0 +1,177 @@
+import json
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from exchange_watcher import ExchangeWatcher
+from incremental_book import (Delta, DeltaFeed, IncrementalOrderBook,
+                              ReplayFeed, parse_delta)
+from order_book import OrderBook
+from utils import validate_order_book
+
+class _ReplayWatcher(ExchangeWatcher):
+  """ A watcher whose snapshots come from a list instead of the API.
+  """
+  def __init__(self, snapshots):
+    super(_ReplayWatcher, self).__init__('Replay')
+    self.url = 'replay'
+    self.snapshots = snapshots
+    self.num_snapshots = 0
+    # The depth budgets the snapshots were taken with.
+    self.snapshot_budgets = []
+
+  def _get_snapshot(self):
+    self.snapshot_budgets.append(self.depth_budget)
+    snapshot = self.snapshots[self.num_snapshots]
+    self.num_snapshots += 1
+    self.last_body = json.dumps(snapshot).encode('utf8')
+    return OrderBook.from_lists(snapshot['asks'], snapshot['bids'])
+
+  def _parse_sequence_from_json(self, json_data):
+    return json_data['seq']
+
+class _ListFeed(DeltaFeed):
+  """ A feed returning a list of messages per poll.
+  """
+  def __init__(self, polls):
+    self.polls = polls
+
+  def poll(self):
+    return self.polls.pop(0) if self.polls else []
+
+def _delta(sequence, side, price, amount):
+  return {'seq': sequence, 'side': side, 'price': price, 'amount': amount}
+
+class TestIncrementalBook(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def _write_feed(self, messages):
+    path = os.path.join(self.dir, 'feed.json')
+    with open(path, 'w') as fp:
+      for message in messages:
+        fp.write('%s\n' % json.dumps(message))
+    return path
+
+  def test_parse_delta(self):
+    self.assertEqual(Delta(3, 'asks', 9820, 150000000),
+                     parse_delta(_delta(3, 'asks', '98.20', '1.5')))
+    self.assertIsNone(parse_delta(_delta(3, 'borrows', '98.20', '1.5')))
+    self.assertIsNone(parse_delta(_delta(3, 'asks', '98.20', '-1')))
+    self.assertIsNone(parse_delta({'seq': 3}))
+    # Eg, LTC/BTC prices are in satoshis.
+    self.assertEqual(Delta(3, 'bids', 2500000, 150000000),
+                     parse_delta(_delta(3, 'bids', '0.025', '1.5'),
+                                 100000000))
+
+  def test_apply(self):
+    book = IncrementalOrderBook()
+    self.assertFalse(book.apply(Delta(1, 'asks', 9800, 1)))
+    book.reset({'asks': [(9800, 1), (9800, 2)], 'bids': [(9700, 1)]}, 10)
+    self.assertEqual({'asks': [(9800, 3)], 'bids': [(9700, 1)]},
+                     book.get_order_book())
+    self.assertTrue(book.apply(Delta(11, 'asks', 9900, 5)))
+    self.assertTrue(book.apply(Delta(12, 'bids', 9700, 0)))
+    self.assertTrue(book.apply(Delta(13, 'bids', 9750, 2)))
+    self.assertTrue(book.apply(Delta(12, 'bids', 9600, 2)))
+    self.assertEqual({'asks': [(9800, 3), (9900, 5)], 'bids': [(9750, 2)]},
+                     book.get_order_book())
+    self.assertFalse(book.apply(Delta(15, 'asks', 9900, 0)))
+    self.assertIsNone(book.get_order_book())
+
+  def test_apply_sorted(self):
+    rng = random.Random(5)
+    book = IncrementalOrderBook()
+    book.reset({'asks': [(9800, 1)], 'bids': [(9700, 1)]}, 0)
+    levels = {'asks': {9800: 1}, 'bids': {9700: 1}}
+    for sequence in range(1, 500):
+      side = rng.choice(['asks', 'bids'])
+      price = rng.randint(1, 50) + (9790 if side == 'asks' else 9660)
+      amount = rng.choice([0, rng.randint(1, 10**8)])
+      self.assertTrue(book.apply(Delta(sequence, side, price, amount)))
+      if amount == 0:
+        levels[side].pop(price, None)
+      else:
+        levels[side][price] = amount
+      if sequence % 50 == 0:
+        order_book = book.get_order_book()
+        self.assertEqual(
+            {'asks': sorted(levels['asks'].items()),
+             'bids': sorted(levels['bids'].items(), reverse=True)},
+            order_book)
+        # Valid by construction.
+        self.assertTrue(order_book.validated)
+        self.assertTrue(validate_order_book(OrderBook(
+            order_book.ask_prices, order_book.ask_amounts,
+            order_book.bid_prices, order_book.bid_amounts)))
+
+  def test_replay(self):
+    path = self._write_feed([
+        # Stale deltas, already covered by the first snapshot.
+        _delta(1, 'asks', '98.00', '1'),
+        _delta(2, 'asks', '98.00', '2'),
+        # Applied to the first snapshot.
+        _delta(3, 'asks', '98.10', '1'),
+        _delta(4, 'bids', '97.00', '0'),
+        # Deltas 5 and 6 were lost, so the book is resynced.
+        _delta(7, 'asks', '98.00', '0'),
+        _delta(8, 'bids', '97.50', '1'),
+    ])
+    watcher = _ReplayWatcher([
+        {'seq': 2, 'asks': [(9800, 200000000)], 'bids': [(9700, 100000000)]},
+        {'seq': 7, 'asks': [(9810, 100000000)], 'bids': [(9600, 100000000)]},
+    ])
+    watcher.attach_feed(ReplayFeed(path, batch_size=4))
+    watcher.depth_budget = 1
+    order_book = watcher.get_order_book()
+    self.assertEqual(1, watcher.num_snapshots)
+    self.assertEqual({'asks': [(9800, 200000000), (9810, 100000000)],
+                      'bids': []}, order_book)
+    order_book = watcher.get_order_book()
+    self.assertEqual(2, watcher.num_snapshots)
+    self.assertEqual({'asks': [(9810, 100000000)],
+                      'bids': [(9750, 100000000), (9600, 100000000)]},
+                     order_book)
+    self.assertTrue(validate_order_book(order_book))
+    # Nothing new in the feed.
+    self.assertIs(order_book, watcher.get_order_book())
+    self.assertEqual(2, watcher.num_snapshots)
+    # The snapshots are never cut to the depth budget.
+    self.assertEqual([None, None], watcher.snapshot_budgets)
+    self.assertEqual(1, watcher.depth_budget)
+    watcher.feed.close()
+
+  def test_snapshot_behind_feed(self):
+    # Deltas 3 and 4 are lost, and the second snapshot only covers delta 3.
+    deltas = [_delta(sequence, 'asks', '%d.00' % (100 + sequence), '1')
+              for sequence in range(5, 55)]
+    watcher = _ReplayWatcher([
+        {'seq': 2, 'asks': [(9800, 100000000)], 'bids': []},
+        {'seq': 3, 'asks': [(9800, 100000000)], 'bids': []},
+        {'seq': 30, 'asks': [(13000, 100000000)], 'bids': []},
+    ])
+    watcher.attach_feed(_ListFeed([[], deltas,
+                                   [_delta(55, 'bids', '97.00', '1')]]))
+    self.assertIsNotNone(watcher.get_order_book())
+    self.assertEqual(1, watcher.num_snapshots)
+    # One snapshot per poll, and the deltas wait for a newer one.
+    self.assertIsNone(watcher.get_order_book())
+    self.assertEqual(2, watcher.num_snapshots)
+    # The deltas covered by the next snapshot are skipped, and the newer
+    # ones replayed.
+    order_book = watcher.get_order_book()
+    self.assertEqual(3, watcher.num_snapshots)
+    self.assertEqual(
+        {'asks': [(13000, 100000000)] +
+                 [((100 + sequence) * 100, 100000000)
+                  for sequence in range(31, 55)],
+         'bids': [(9700, 100000000)]},
+        order_book)
+    self.assertEqual(55, watcher.incremental_book.sequence)
+
+if __name__ == '__main__':
+  unittest.main()
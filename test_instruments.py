@@ -0,0 +1,99 @@
+import config
+import unittest
+from arbitrage_detector import ArbitrageDetector
+from arbitrageur import Arbitrageur
+from btce_watcher import BTCEWatcher
+from instruments import (exchange_of, format_price, group_by_instrument,
+                         instrument_of, market_name, pair_instrument,
+                         price_multiplier)
+from mtgox_watcher import MtGoxWatcher
+from opportunity_sink import OpportunitySink
+from order_book import OrderBook
+
+class _ListSink(OpportunitySink):
+  def __init__(self):
+    self.opportunities = []
+
+  def add(self, opportunity, timestamp=None):
+    self.opportunities.append(opportunity)
+
+class TestInstruments(unittest.TestCase):
+  def test_market_names(self):
+    self.assertEqual('BTC-E', market_name('BTC-E', 'BTC/USD'))
+    self.assertEqual('BTC-E LTC/BTC', market_name('BTC-E', 'LTC/BTC'))
+    self.assertEqual('BTC-E', exchange_of('BTC-E LTC/BTC'))
+    self.assertEqual('LTC/BTC', instrument_of('BTC-E LTC/BTC'))
+    self.assertEqual('BTC/USD', instrument_of('MtGox'))
+    self.assertEqual(100, price_multiplier('BTC/EUR'))
+    self.assertEqual(100000000, price_multiplier('LTC/BTC'))
+    self.assertRaises(ValueError, price_multiplier, 'BTC')
+
+  def test_pair_instrument(self):
+    self.assertEqual('LTC/BTC', pair_instrument('BTC-E LTC/BTC',
+                                                'Cryptsy LTC/BTC'))
+    # Converted to the fx currency.
+    self.assertEqual('BTC/%s' % config.fx_currency,
+                     pair_instrument('BTC-E', 'MtGox BTC/EUR'))
+    self.assertEqual('12.34', format_price(1234, 'BTC/USD'))
+    self.assertEqual('-0.50', format_price(-50, 'BTC/USD'))
+    self.assertEqual('0.02500000', format_price(2500000, 'LTC/BTC'))
+
+  def test_watchers(self):
+    watcher = BTCEWatcher('LTC/BTC')
+    self.assertEqual('BTC-E LTC/BTC', watcher.exchange_name)
+    self.assertEqual('https://btc-e.com/api/2/ltc_btc/depth', watcher.url)
+    # Prices of LTC/BTC are in satoshis.
+    self.assertEqual(
+        OrderBook.from_lists([(2500000, 100000000)], [(2400000, 200000000)]),
+        watcher._parse_order_book_from_bytes(
+            b'{"asks": [[0.025, 1]], "bids": [[0.024, 2]]}'))
+    self.assertEqual('http://data.mtgox.com/api/2/BTCEUR/money/depth',
+                     MtGoxWatcher('BTC/EUR').url)
+    self.assertRaises(ValueError, MtGoxWatcher, 'LTC/BTC')
+
+  def test_group_by_instrument(self):
+    saved = config.fx_currency, config.fx_rates
+    config.fx_currency, config.fx_rates = 'USD', {'EUR': 1.5}
+    try:
+      usd = OrderBook.from_lists([(10000, 100000000)], [(9900, 100000000)])
+      eur = OrderBook.from_lists([(6000, 100000000)], [(5900, 100000000)])
+      ltc = OrderBook.from_lists([(2500000, 100000000)], [])
+      groups = group_by_instrument([('Bitstamp', usd), ('MtGox BTC/EUR', eur),
+                                    ('BTC-E LTC/BTC', ltc)])
+      self.assertEqual(['BTC/EUR', 'BTC/USD', 'LTC/BTC'], sorted(groups))
+      self.assertEqual([('MtGox BTC/EUR', eur)], groups['BTC/EUR'])
+      self.assertEqual([('BTC-E LTC/BTC', ltc)], groups['LTC/BTC'])
+      self.assertEqual(
+          [('Bitstamp', usd),
+           ('MtGox BTC/EUR',
+            OrderBook.from_lists([(9000, 100000000)], [(8850, 100000000)]))],
+          groups['BTC/USD'])
+      # The converted BTC/EUR book is cheaper than the BTC/USD one.
+      opportunities = ArbitrageDetector(0.0).process(groups['BTC/USD'])
+      self.assertEqual(1, len(opportunities))
+      self.assertEqual(('MtGox BTC/EUR', 'Bitstamp'),
+                       (opportunities[0].buy_market,
+                        opportunities[0].sell_market))
+    finally:
+      config.fx_currency, config.fx_rates = saved
+  def test_converted_pairs_reported_once(self):
+    saved = config.fx_currency, config.fx_rates
+    config.fx_currency, config.fx_rates = 'USD', {'EUR': 1.5}
+    try:
+      arbitrageur = Arbitrageur(market_watcher=object())
+      sink = _ListSink()
+      arbitrageur.opportunity_sinks = [sink]
+      cheap = OrderBook.from_lists([(6000, 100000000)], [(5900, 100000000)])
+      dear = OrderBook.from_lists([(8000, 100000000)], [(7900, 100000000)])
+      # Both books are also converted to BTC/USD, where the same
+      # opportunity is found again.
+      arbitrageur._process_order_books([('A BTC/EUR', cheap),
+                                        ('B BTC/EUR', dear)])
+      self.assertEqual([('A BTC/EUR', 'B BTC/EUR')],
+                       [(opportunity.buy_market, opportunity.sell_market)
+                        for opportunity in sink.opportunities])
+    finally:
+      config.fx_currency, config.fx_rates = saved
+
+if __name__ == '__main__':
+  unittest.main()
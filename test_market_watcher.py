@@ -0,0 +1,122 @@
+import asyncio
+import config
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from book_archive import BookArchiveReader, BookArchiveWriter
+from market_watcher import MarketWatcher
+from order_book import OrderBook
+from poll_scheduler import PollSchedule
+
+class _FakeWatcher(object):
+  def __init__(self, exchange_name, ask):
+    self.exchange_name = exchange_name
+    self.ask = ask
+    self.release = threading.Event()
+    self.release.set()
+    self.calls = 0
+
+  def get_order_book(self):
+    self.calls += 1
+    self.release.wait()
+    order_book = OrderBook.from_lists([(self.ask, 1)], [(self.ask - 1, 1)])
+    order_book.timestamp = time.time()
+    return order_book
+
+class TestMarketWatcher(unittest.TestCase):
+  def setUp(self):
+    self.saved = config.round_deadline_sec
+    self.market_watcher = MarketWatcher()
+    self.fast = _FakeWatcher('Fast', 100)
+    self.slow = _FakeWatcher('Slow', 200)
+    self.market_watcher.exchange_watchers = [self.fast, self.slow]
+
+  def tearDown(self):
+    config.round_deadline_sec = self.saved
+    self.slow.release.set()
+
+  def test_without_deadline(self):
+    config.round_deadline_sec = None
+    order_books = self.market_watcher.get_order_books()
+    self.assertEqual(['Fast', 'Slow'], [name for name, _ in order_books])
+
+  def test_deadline(self):
+    config.round_deadline_sec = None
+    self.market_watcher.get_order_books()
+    last_slow_book = self.market_watcher.last_order_books['Slow']
+    # The slow exchange hangs; the round returns its last known order book
+    # at the deadline.
+    config.round_deadline_sec = 0.05
+    self.slow.release.clear()
+    order_books = self.market_watcher.get_order_books()
+    # The round did not wait for the hanging request.
+    self.assertFalse(self.market_watcher.pending_requests['Slow'].done())
+    self.assertEqual(['Fast', 'Slow'], [name for name, _ in order_books])
+    self.assertIs(last_slow_book, order_books[1][1])
+    self.assertGreater(order_books[1][1].age(), order_books[0][1].age())
+    # The request in flight is not sent again.
+    self.market_watcher.get_order_books()
+    self.assertEqual(2, self.slow.calls)
+    self.assertEqual(3, self.fast.calls)
+    # Once the request is done, its order book is picked up.
+    self.slow.release.set()
+    self.market_watcher.pending_requests['Slow'].result()
+    order_books = self.market_watcher.get_order_books()
+    self.assertIsNot(last_slow_book, order_books[1][1])
+    self.assertEqual(3, self.slow.calls)
+
+  def test_watch_order_books_survives_exceptions(self):
+    failing = _FakeWatcher('Failing', 300)
+    get_order_book = failing.get_order_book
+
+    def fail_once():
+      if failing.calls == 0:
+        failing.calls += 1
+        raise ValueError('could not convert string to float')
+      return get_order_book()
+
+    failing.get_order_book = fail_once
+    self.market_watcher.exchange_watchers = [failing]
+    schedule = PollSchedule(0.01, 0.01, 6000, 0.01, time.monotonic())
+    schedule.base_backoff_sec = 0.01
+    self.market_watcher.poll_schedules = [schedule]
+
+    async def first_round():
+      async for order_books in self.market_watcher.watch_order_books():
+        return order_books
+
+    # The exception is a failed poll, and the exchange is polled again.
+    order_books = asyncio.run(asyncio.wait_for(first_round(), 5.0))
+    self.assertEqual(['Failing'], [name for name, _ in order_books])
+    self.assertEqual(2, failing.calls)
+
+  def test_watch_order_books_archives(self):
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, 'archive')
+      writer = BookArchiveWriter(path)
+      self.market_watcher.start_archiving(writer)
+      self.market_watcher.exchange_watchers = [self.fast]
+      self.market_watcher.poll_schedules = [
+          PollSchedule(0.01, 0.01, 6000, 0.01, time.monotonic())]
+
+      async def first_round():
+        async for order_books in self.market_watcher.watch_order_books():
+          return order_books
+
+      order_books = asyncio.run(asyncio.wait_for(first_round(), 5.0))
+      writer.close()
+      reader = BookArchiveReader(path)
+      self.assertEqual(1, len(reader))
+      entry = reader.entry(0)
+      self.assertEqual((1, 'Fast'), (entry.round, entry.exchange_name))
+      self.assertEqual(order_books[0][1], reader.snapshot(0).order_book)
+      reader.close()
+    finally:
+      shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  unittest.main()
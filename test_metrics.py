@@ -0,0 +1,66 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from metrics import Histogram, Metrics
+from urllib.request import urlopen
+
+class TestMetrics(unittest.TestCase):
+  def test_histogram(self):
+    histogram = Histogram()
+    self.assertEqual(0.0, histogram.percentile(50))
+    for i in range(1, 1001):
+      histogram.add(i / 1000.0)
+    self.assertEqual(1000, histogram.count)
+    self.assertAlmostEqual(0.5, histogram.percentile(50), delta=0.05)
+    self.assertAlmostEqual(0.99, histogram.percentile(99), delta=0.1)
+    self.assertEqual(1.0, histogram.percentile(100))
+    histogram.add(0)
+    self.assertEqual(Histogram.min_value, histogram.percentile(0))
+
+  def test_disabled(self):
+    metrics = Metrics()
+    with metrics.span('parse', 'A'):
+      pass
+    metrics.count('payload_bytes', 'A', 100)
+    self.assertEqual({}, metrics.snapshot()['histograms'])
+    self.assertEqual({}, metrics.snapshot()['counters'])
+
+  def test_snapshot(self):
+    metrics = Metrics(enabled=True)
+    for _ in range(3):
+      with metrics.span('parse', 'A'):
+        pass
+    with self.assertRaises(ValueError):
+      with metrics.span('parse', 'B'):
+        raise ValueError()
+    metrics.count('payload_bytes', 'A', 100)
+    metrics.count('payload_bytes', 'A', 50)
+    snapshot = metrics.snapshot()
+    self.assertEqual(3, snapshot['histograms']['parse']['A']['count'])
+    self.assertEqual(1, snapshot['histograms']['parse']['B']['count'])
+    self.assertEqual(150, snapshot['counters']['payload_bytes']['A'])
+    directory = tempfile.mkdtemp()
+    try:
+      path = os.path.join(directory, 'metrics.json')
+      metrics.write_snapshot(path)
+      with open(path) as fp:
+        self.assertEqual(150,
+                         json.load(fp)['counters']['payload_bytes']['A'])
+    finally:
+      shutil.rmtree(directory)
+
+  def test_http_server(self):
+    metrics = Metrics(enabled=True)
+    metrics.count('payloads', 'A')
+    port = metrics.start_http_server(0)
+    try:
+      with urlopen('http://127.0.0.1:%d/' % port) as response:
+        snapshot = json.loads(response.read().decode('utf8'))
+      self.assertEqual(1, snapshot['counters']['payloads']['A'])
+    finally:
+      metrics.stop_http_server()
+
+if __name__ == '__main__':
+  unittest.main()
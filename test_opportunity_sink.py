@@ -0,0 +1,87 @@
+import os
+import shutil
+import tempfile
+import unittest
+from arbitrage_detector import ArbitrageOpportunity
+from opportunity_sink import JournalReader, JournalSink, LogSink
+
+def _opportunity(i):
+  return ArbitrageOpportunity(
+      'BTC-E', 'MtGox BTC/EUR', [(10000 + i, 100000000)],
+      [(10500 + i, 100000000)], 10000 + i, 10000 + i, 10000 + i, 10500 + i,
+      10500 + i, 10500 + i, 100000000 + i, 10000 + i, 10500 + i)
+
+class TestOpportunitySink(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'journal')
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_journal(self):
+    sink = JournalSink(self.path)
+    for i in range(10):
+      sink.add(_opportunity(i), 1000.0 + i)
+    sink.flush()
+    self.assertEqual(10, len(JournalReader(self.path)))
+    # A timestamp going backwards is moved forward.
+    sink.add(_opportunity(10), 900.0)
+    sink.close()
+    reader = JournalReader(self.path)
+    self.assertEqual(11, len(reader))
+    record = reader.record(7)
+    self.assertEqual((1007.0, 'BTC-E', 'MtGox BTC/EUR', 10007, 10007, 10007,
+                      10507, 10507, 10507, 100000007, 10007, 10507), record)
+    self.assertEqual(1009.0, reader.record(10).timestamp)
+    self.assertEqual(5, reader.find(1004.5))
+    self.assertEqual([1003.0, 1004.0],
+                     [r.timestamp for r in reader.records(1003, 1005)])
+    self.assertEqual(11, sum(1 for _ in reader.raw_records()))
+    reader.close()
+
+  def test_journal_partial_record(self):
+    sink = JournalSink(self.path)
+    sink.add(_opportunity(0), 1000.0)
+    sink.close()
+    with open(self.path, 'ab') as fp:
+      fp.write(b'\0' * 10)
+    reader = JournalReader(self.path)
+    self.assertEqual(1, len(reader))
+    self.assertEqual([1000.0], [r.timestamp for r in reader.records()])
+    reader.close()
+
+  def test_empty_journal(self):
+    JournalSink(self.path).close()
+    reader = JournalReader(self.path)
+    self.assertEqual([], list(reader.records()))
+    reader.close()
+
+  def test_long_market_name(self):
+    sink = JournalSink(self.path)
+    opportunity = ArbitrageOpportunity('X' * 25, 'Y', [], [], 1, 1, 1, 1, 1,
+                                       1, 1, 1, 1)
+    self.assertRaises(ValueError, sink.add, opportunity)
+    sink.close()
+
+  def test_log(self):
+    with self.assertLogs(level='INFO') as logs:
+      LogSink().add(_opportunity(0))
+    self.assertIn('Opportunity: buy=100.00 sell=105.00 from=BTC-E'
+                  ' to=MtGox BTC/EUR amount=1.00000000 pay=100.00'
+                  ' paid=105.00 profit=5.00 rate=5.00% mrate=5.00%',
+                  logs.output[0])
+    self.assertIn('currency=USD', logs.output[0])
+    # LTC/BTC prices are in satoshis.
+    with self.assertLogs(level='INFO') as logs:
+      LogSink().add(ArbitrageOpportunity(
+          'BTC-E LTC/BTC', 'Cryptsy LTC/BTC', [(2500000, 100000000)],
+          [(2600000, 100000000)], 2500000, 2500000, 2500000, 2600000,
+          2600000, 2600000, 100000000, 2500000, 2600000))
+    self.assertIn('Opportunity: buy=0.02500000 sell=0.02600000'
+                  ' from=BTC-E LTC/BTC to=Cryptsy LTC/BTC amount=1.00000000'
+                  ' pay=0.02500000 paid=0.02600000 profit=0.00100000'
+                  ' rate=4.00% mrate=4.00% currency=BTC', logs.output[0])
+
+if __name__ == '__main__':
+  unittest.main()
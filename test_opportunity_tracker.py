@@ -0,0 +1,37 @@
+import unittest
+from arbitrage_detector import ArbitrageOpportunity
+from opportunity_tracker import (APPEARED, CHANGED, DISAPPEARED,
+                                 OpportunityTracker)
+
+def _opportunity(buy_market, sell_market, amount):
+  return ArbitrageOpportunity(buy_market, sell_market, [(100, amount)],
+                              [(110, amount)], 100, 100, 100, 110, 110, 110,
+                              amount, amount, amount * 11 // 10)
+
+class TestOpportunityTracker(unittest.TestCase):
+  def _kinds(self, events):
+    return [(event.kind, event.opportunity.buy_market, event.rounds)
+            for event in events]
+
+  def test_lifecycle(self):
+    tracker = OpportunityTracker()
+    self.assertEqual([(APPEARED, 'A', 1), (APPEARED, 'B', 1)], self._kinds(
+        tracker.update([_opportunity('A', 'X', 10), _opportunity('B', 'X', 5)],
+                       100.0)))
+    # The same opportunities are not reported again.
+    self.assertEqual([], tracker.update(
+        [_opportunity('A', 'X', 10), _opportunity('B', 'X', 5)], 101.0))
+    events = tracker.update([_opportunity('A', 'X', 20)], 102.0)
+    self.assertEqual([(CHANGED, 'A', 3), (DISAPPEARED, 'B', 2)],
+                     self._kinds(events))
+    self.assertEqual(20, events[0].opportunity.amount)
+    self.assertEqual(5, events[1].opportunity.amount)
+    self.assertEqual(100.0, events[1].first_seen)
+    events = tracker.update([], 103.0)
+    self.assertEqual([(DISAPPEARED, 'A', 3)], self._kinds(events))
+    self.assertEqual(20, events[0].opportunity.amount)
+    self.assertEqual([(APPEARED, 'A', 1)], self._kinds(
+        tracker.update([_opportunity('A', 'X', 20)], 104.0)))
+
+if __name__ == '__main__':
+  unittest.main()
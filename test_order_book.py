@@ -0,0 +1,58 @@
+import sys
+import unittest
+from order_book import OrderBook
+from utils import validate_order_book
+
+class TestOrderBook(unittest.TestCase):
+  def setUp(self):
+    self.asks = [(9800, 100000000), (9820, 150000000), (9820, 50000000)]
+    self.bids = [(9600, 1000000000), (9500, 10000000)]
+    self.order_book = OrderBook.from_lists(self.asks, self.bids)
+
+  def test_sequence_view(self):
+    self.assertEqual(3, len(self.order_book['asks']))
+    self.assertEqual((9800, 100000000), self.order_book['asks'][0])
+    self.assertEqual((9500, 10000000), self.order_book['bids'][-1])
+    self.assertEqual(self.bids, list(self.order_book['bids']))
+    self.assertEqual(self.asks[1:], self.order_book['asks'][1:])
+    self.assertEqual(self.asks, self.order_book['asks'])
+    self.assertTrue('asks' in self.order_book)
+    self.assertFalse('borrows' in self.order_book)
+    self.assertRaises(KeyError, lambda: self.order_book['borrows'])
+
+  def test_equality(self):
+    self.assertEqual(OrderBook.from_lists(self.asks, self.bids),
+                     self.order_book)
+    self.assertEqual({'asks': self.asks, 'bids': self.bids}, self.order_book)
+    self.assertNotEqual(OrderBook.from_lists(self.asks, []), self.order_book)
+    self.assertNotEqual(None, self.order_book)
+
+  def test_age(self):
+    self.assertIsNone(self.order_book.age())
+    self.order_book.timestamp = 1000.0
+    self.assertEqual(5.0, self.order_book.age(1005.0))
+    self.assertEqual(0.0, self.order_book.age(999.0))
+    # The timestamp does not take part in the equality.
+    self.assertEqual(OrderBook.from_lists(self.asks, self.bids),
+                     self.order_book)
+
+  def test_memory_size(self):
+    levels = [(10000 + i, 100000000) for i in range(1000)]
+    order_book = OrderBook.from_lists(levels, levels[::-1])
+    self.assertLess(order_book.memory_size(), 2000 * 16 + 1024)
+    self.assertLess(order_book.memory_size(),
+                    sys.getsizeof(levels) * 2 + sum(
+                        sys.getsizeof(level) for level in levels) * 2)
+
+  def test_validate(self):
+    self.assertTrue(validate_order_book(self.order_book))
+    self.assertTrue(validate_order_book(OrderBook.from_lists([], [])))
+    self.assertFalse(validate_order_book(
+        OrderBook.from_lists(self.asks[::-1], self.bids)))
+    self.assertFalse(validate_order_book(
+        OrderBook.from_lists(self.asks, self.bids[::-1])))
+    self.assertFalse(validate_order_book(
+        OrderBook.from_lists([(9800, 0)], [])))
+
+if __name__ == '__main__':
+  unittest.main()
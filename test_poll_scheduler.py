@@ -0,0 +1,74 @@
+import random
+import unittest
+from order_book import OrderBook
+from poll_scheduler import PollSchedule, TokenBucket
+
+def _book(ask):
+  return OrderBook.from_lists([(ask, 1)], [(ask - 1, 1)])
+
+class TestPollScheduler(unittest.TestCase):
+  def test_token_bucket(self):
+    bucket = TokenBucket(rate=0.5, capacity=2, now=0.0)
+    self.assertTrue(bucket.take(0.0))
+    self.assertTrue(bucket.take(0.0))
+    self.assertFalse(bucket.take(0.0))
+    self.assertEqual(2.0, bucket.delay(0.0))
+    self.assertEqual(1.0, bucket.delay(1.0))
+    self.assertTrue(bucket.take(2.0))
+    # The bucket never holds more than its capacity.
+    self.assertTrue(bucket.take(100.0))
+    self.assertTrue(bucket.take(100.0))
+    self.assertFalse(bucket.take(100.0))
+
+  def _schedule(self, rate_limit_per_min=600):
+    return PollSchedule(min_interval=2, max_interval=10,
+                        rate_limit_per_min=rate_limit_per_min,
+                        max_backoff=60, now=0.0, rng=random.Random(1))
+
+  def _poll(self, schedule, now, order_book):
+    now += schedule.delay(now)
+    self.assertTrue(schedule.start(now))
+    schedule.update(order_book, now)
+    return now
+
+  def test_adapts_to_changes(self):
+    busy, quiet = self._schedule(), self._schedule()
+    now = 0.0
+    for i in range(50):
+      now = self._poll(busy, now, _book(100 + i))
+    self.assertAlmostEqual(2, busy.delay(now), places=3)
+    now = 0.0
+    for i in range(50):
+      now = self._poll(quiet, now, _book(100))
+    self.assertAlmostEqual(10, quiet.delay(now), places=3)
+    # Changes in the depth below the top do not count.
+    self.assertFalse(quiet.update(
+        OrderBook.from_lists([(100, 1), (101, 1)], [(99, 1)]), now))
+
+  def test_rate_limit(self):
+    # 6 requests per minute, ie, one every 10 seconds after a burst of 3.
+    schedule = self._schedule(rate_limit_per_min=6)
+    now = 0.0
+    times = []
+    for i in range(10):
+      now = self._poll(schedule, now, _book(100 + i))
+      times.append(now)
+    self.assertLessEqual(len([t for t in times if t < 60]), 3 + 6)
+    self.assertFalse(schedule.start(now))
+
+  def test_backoff(self):
+    schedule = self._schedule()
+    now = self._poll(schedule, 0.0, _book(100))
+    delays = []
+    for _ in range(8):
+      now = self._poll(schedule, now, None)
+      delays.append(schedule.delay(now))
+    self.assertLess(delays[0], delays[3])
+    self.assertLessEqual(max(delays), 60)
+    self.assertGreaterEqual(max(delays), 30)
+    now = self._poll(schedule, now, _book(100))
+    self.assertEqual(0, schedule.failures)
+    self.assertLessEqual(schedule.delay(now), 10)
+
+if __name__ == '__main__':
+  unittest.main()
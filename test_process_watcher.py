@@ -0,0 +1,69 @@
+import time
+import unittest
+from order_book import OrderBook
+from process_watcher import ProcessWatcher
+
+def _book(depth):
+  return OrderBook.from_lists([(10000 + i, i + 1) for i in range(depth)],
+                              [(9999 - i, i + 2) for i in range(depth)])
+
+class _FakeWatcher(object):
+  """ Returns a small order book, the same one again, a deep one and then
+      fails.
+  """
+  def __init__(self, exchange_name):
+    self.exchange_name = exchange_name
+    self.calls = 0
+    self.last_body = None
+    self.last_order_book = None
+
+  def get_order_book(self):
+    self.calls += 1
+    if self.calls == 1:
+      self.last_order_book = _book(3)
+    elif self.calls == 3:
+      self.last_order_book = _book(5000)
+    elif self.calls > 3:
+      return None
+    self.last_body = b'body %d' % self.calls
+    self.last_order_book.timestamp = time.time()
+    return self.last_order_book
+
+def _create_fake_watcher(exchange, instrument):
+  return _FakeWatcher('%s %s' % (exchange, instrument))
+
+class _FakeRecorder(object):
+  def __init__(self):
+    self.records = []
+
+  def record(self, exchange_name, body):
+    self.records.append((exchange_name, body))
+
+class TestProcessWatcher(unittest.TestCase):
+  def test_get_order_book(self):
+    watcher = ProcessWatcher(_create_fake_watcher, 'fake', 'BTC/EUR')
+    try:
+      self.assertEqual('fake BTC/EUR', watcher.exchange_name)
+      watcher.recorder = _FakeRecorder()
+      order_book = watcher.get_order_book()
+      self.assertEqual(_book(3), order_book)
+      self.assertTrue(order_book.validated)
+      self.assertLess(order_book.age(), 10)
+      # An unchanged order book is the same object, with a new timestamp.
+      timestamp = order_book.timestamp
+      self.assertIs(order_book, watcher.get_order_book())
+      self.assertGreaterEqual(order_book.timestamp, timestamp)
+      # A deep order book gets a larger shared memory block.
+      self.assertEqual(_book(5000), watcher.get_order_book())
+      self.assertGreaterEqual(watcher.capacity, 10000)
+      self.assertIsNone(watcher.get_order_book())
+      # The unchanged order book is recorded as a marker.
+      self.assertEqual([('fake BTC/EUR', b'body 1'), ('fake BTC/EUR', None),
+                        ('fake BTC/EUR', b'body 3')],
+                       watcher.recorder.records)
+    finally:
+      watcher.close()
+    self.assertIsNone(watcher.shared_memory)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,98 @@
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from arbitrageur import Arbitrageur
+from recorder import Recorder, ReplayMarketWatcher, read_records, read_rounds
+
+def _bitstamp(ask, bid):
+  return json.dumps({'asks': [[str(ask), '1.0']],
+                     'bids': [[str(bid), '2.0']]}).encode('utf8')
+
+def _btce(ask, bid):
+  return json.dumps({'asks': [[ask, 1.0]], 'bids': [[bid, 2.0]]}).encode(
+      'utf8')
+
+class TestRecorder(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.path = os.path.join(self.dir, 'recording')
+    recorder = Recorder(self.path)
+    recorder.begin_round()
+    recorder.record('Bitstamp', _bitstamp(100, 99), 1000.0)
+    recorder.record('BTC-E', _btce(95, 94), 1000.5)
+    recorder.begin_round()
+    recorder.record('BTC-E', _btce(101, 100), 1000.7)
+    recorder.record('Bitstamp', b'{"error": "throttled"}', 1000.8)
+    recorder.close()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def test_read_records(self):
+    records = list(read_records(self.path))
+    self.assertEqual(4, len(records))
+    self.assertEqual((1000.0, 1, 'Bitstamp', _bitstamp(100, 99)),
+                     records[0])
+    self.assertEqual([2, 2], [len(records) for records in read_rounds(
+        self.path)])
+    # A truncated record at the end is ignored.
+    with open(self.path, 'ab') as fp:
+      fp.write(b'\x00' * 7)
+    self.assertEqual(4, len(list(read_records(self.path))))
+
+  def test_replay(self):
+    market_watcher = ReplayMarketWatcher(self.path)
+    order_books = market_watcher.get_order_books()
+    self.assertEqual(['Bitstamp', 'BTC-E'],
+                     [name for name, _ in order_books])
+    self.assertEqual([(9500, 100000000)], order_books[1][1]['asks'])
+    # The invalid content is skipped, as with live data.
+    order_books = market_watcher.get_order_books()
+    self.assertEqual(['BTC-E'], [name for name, _ in order_books])
+    self.assertIsNone(market_watcher.get_order_books())
+
+  def test_replay_unchanged(self):
+    path = os.path.join(self.dir, 'unchanged')
+    recorder = Recorder(path)
+    recorder.begin_round()
+    recorder.record('Bitstamp', _bitstamp(100, 99), 1000.0)
+    recorder.begin_round()
+    recorder.record('Bitstamp', None, 1001.0)
+    # A round where all the requests failed.
+    recorder.begin_round()
+    recorder.begin_round()
+    recorder.record('Bitstamp', None, 1003.0)
+    recorder.close()
+    self.assertIsNone(list(read_records(path))[1].body)
+    self.assertEqual([1, 1, 0, 1], [len(records) for records in read_rounds(
+        path)])
+    market_watcher = ReplayMarketWatcher(path)
+    rounds = []
+    while True:
+      order_books = market_watcher.get_order_books()
+      if order_books is None:
+        break
+      rounds.append(order_books)
+    self.assertEqual(4, len(rounds))
+    self.assertEqual([], rounds[2])
+    # The unchanged content replays as the same order book.
+    self.assertIs(rounds[0][0][1], rounds[1][0][1])
+    self.assertIs(rounds[0][0][1], rounds[3][0][1])
+
+  def test_replay_arbitrageur(self):
+    arbitrageur = Arbitrageur(ReplayMarketWatcher(self.path))
+    self.assertEqual(2, arbitrageur.run_replay())
+
+  def test_replay_recorded_speed(self):
+    market_watcher = ReplayMarketWatcher(self.path, speed=5.0)
+    start = time.time()
+    while market_watcher.get_order_books() is not None:
+      pass
+    # The rounds were recorded 0.7 seconds apart.
+    self.assertGreaterEqual(time.time() - start, 0.7 / 5.0)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,9 @@
 import unittest
-from utils import convert_amount, convert_price, read_json, validate_order_book
+from array import array
+from bitstamp_watcher import BitstampWatcher
+from order_book import OrderBook
+from utils import (convert_amount, convert_price, create_price_amount_list,
+                   read_json, validate_order_book)
 
 def _pa(p, a):
   return (int(p * 100), int(a * 100000000))
@@ -73,6 +77,34 @@ class TestUtils(unittest.TestCase):
     self.assertFalse(validate_order_book({
         'asks': [(98.0, 100000000)], 'bids': []}))
 
+  def test_validate_order_book_marks_validated(self):
+    order_book = OrderBook.from_lists([_pa(98.0, 1.0)], [_pa(97.5, 0.5)])
+    self.assertFalse(order_book.validated)
+    self.assertTrue(validate_order_book(order_book))
+    self.assertTrue(order_book.validated)
+    invalid = OrderBook(array('q', [9800]), array('q', [0]), array('q'),
+                        array('q'))
+    self.assertFalse(validate_order_book(invalid))
+    self.assertFalse(invalid.validated)
+    # A validated order book is trusted.
+    invalid.validated = True
+    self.assertTrue(validate_order_book(invalid))
+
+  def test_create_price_amount_list_rejects_non_positive(self):
+    self.assertEqual([_pa(98.0, 1.0), _pa(98.2, 1.5)],
+                     create_price_amount_list(
+                         {'asks': [['98.2', '1.5'], ['98.0', '1.0']]},
+                         'asks', True))
+    self.assertIsNone(create_price_amount_list(
+        {'asks': [['98.2', '1.5'], ['98.0', '0']]}, 'asks', True))
+
+  def test_parsed_order_books_are_validated(self):
+    watcher = BitstampWatcher()
+    body = b'{"asks": [["98.0", "1.0"]], "bids": [["97.5", "0.5"]]}'
+    self.assertTrue(watcher._parse_order_book_from_bytes(body).validated)
+    self.assertTrue(watcher._parse_order_book_from_json(
+        {'asks': [['98.0', '1.0']], 'bids': [['97.5', '0.5']]}).validated)
+
 if __name__ == '__main__':
   unittest.main()
 
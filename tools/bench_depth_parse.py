@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+""" Compares the generic json path with the single-pass depth parser, and
+the separate validation pass with the validated fast path.
+
+Recorded payloads (eg, saved responses of the Bitstamp depth API) can be
+passed with --payload; otherwise a synthetic payload is generated.
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from benchmark import generate_payload
+from depth_parser import parse_depth
+from order_book import OrderBook
+from utils import create_price_amount_list, validate_order_book
+
+def json_path(body):
+  json_data = json.loads(body.decode('utf8'))
+  order_book = {'asks': create_price_amount_list(json_data, 'asks', True),
+                'bids': create_price_amount_list(json_data, 'bids', False)}
+  assert validate_order_book(order_book)
+  return order_book
+
+def single_pass_path(body):
+  order_book = parse_depth(body)
+  assert order_book is not None
+  return order_book
+
+def _time(function, number):
+  return min(timeit.repeat(function, number=number, repeat=3)) / number
+
+def benchmark(name, body, number):
+  print('%s: %d bytes' % (name, len(body)))
+  assert single_pass_path(body) == json_path(body)
+  results = []
+  for function in (json_path, single_pass_path):
+    seconds = _time(lambda: function(body), number)
+    results.append(seconds)
+    print('  %-15s %9.3f ms' % (function.__name__, seconds * 1000))
+  print('  speedup         %9.2fx' % (results[0] / results[1]))
+
+def benchmark_validation(body, number):
+  """ Times validate_order_book() on the order book of a payload: as
+      external lists, as unmarked columns and as a validated order book.
+  """
+  order_book = json_path(body)
+  columns = parse_depth(body)
+  unmarked = OrderBook(columns.ask_prices, columns.ask_amounts,
+                       columns.bid_prices, columns.bid_amounts)
+
+  def validate_unmarked():
+    unmarked.validated = False
+    assert validate_order_book(unmarked)
+
+  print('  validation:')
+  for name, function in (
+      ('lists', lambda: validate_order_book(order_book)),
+      ('columns', validate_unmarked),
+      ('validated', lambda: validate_order_book(columns))):
+    print('  %-15s %9.3f ms' % (name, _time(function, number) * 1000))
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--payload', action='append', default=[],
+                      help='A recorded payload in the [[price, amount]]'
+                           ' format.')
+  parser.add_argument('--depth', type=int, default=5000)
+  parser.add_argument('--number', type=int, default=20)
+  args = parser.parse_args()
+  if args.payload:
+    payloads = []
+    for path in args.payload:
+      with open(path, 'rb') as fp:
+        payloads.append((path, fp.read()))
+  else:
+    payloads = [('synthetic depth %d' % args.depth,
+                 generate_payload(args.depth))]
+  for name, body in payloads:
+    benchmark(name, body, args.number)
+    benchmark_validation(body, args.number)
+
+if __name__ == '__main__':
+  main()
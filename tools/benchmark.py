@@ -0,0 +1,434 @@
+#!/usr/bin/python3
+
+""" A benchmark suite for the parsing and detection hot paths.
+
+Times create_price_amount_list(), validate_order_book(),
+ArbitrageDetector.process_pair(), process() and _process_buys_sells() on
+synthetic order books and on payloads in the format of each exchange, and
+reports the operations per second, the memory allocated by one operation
+(the tracemalloc peak), and how both scale with the depth of the order
+books and the number of venues.
+
+The synthetic books are generated from a fixed seed, so runs are
+reproducible.  Each venue quotes around the same price, and with
+probability --crossing a venue is shifted up so that its top bids (about
+--overlap of them) beat the asks of the others.
+
+The payloads are parsed by the watcher of their exchange, on their own and
+together as the venues of a round.  By default they are the fixtures in
+tools/fixtures, one per exchange format (they can be regenerated with
+--write_fixtures); recorded responses can be passed instead with
+--payload exchange=path, eg --payload bitstamp=order_book.json.
+
+The results can be saved with --save and compared with a saved baseline
+with --baseline: a benchmark is flagged as a regression when it is slower
+(or allocates more) than the baseline by more than --tolerance, and the
+script then exits with status 1.  Baselines are only comparable on the
+same machine and Python version.
+
+Eg:
+    benchmark.py --depths 100,1000,10000 --venues 2,4,8 --save base.json
+    benchmark.py --depths 100,1000,10000 --venues 2,4,8 \\
+        --baseline base.json
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from arbitrage_detector import ArbitrageDetector
+from market_watcher import create_exchange_watcher
+from order_book import OrderBook
+from utils import create_price_amount_list, validate_order_book
+
+# The timestamp of the synthetic order books, so they are never stale.
+_NOW = 1368000000.0
+
+# The exchange formats of the payloads, and their fixtures.
+_EXCHANGES = ('bitstamp', 'btce', 'campbx', 'mtgox')
+_FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         'fixtures')
+
+def generate_levels(rng, start, depth, step):
+  """ Generates 'depth' (price, amount) levels from price 'start', each
+      0 to 5 cents apart in the direction of 'step' (1 or -1).
+  """
+  levels = []
+  price = start
+  for _ in range(depth):
+    levels.append((max(price, 1), rng.randint(1, 10**10)))
+    price += step * rng.randint(0, 5)
+  return levels
+
+def generate_order_book(rng, depth, mid):
+  """ Generates the (asks, bids) lists of an order book with 'depth' levels
+      on each side around a price in cents.
+  """
+  return (generate_levels(rng, mid + 5, depth, 1),
+          generate_levels(rng, mid - 5, depth, -1))
+
+def generate_venues(venues, depth, crossing, overlap, seed=0):
+  """ Generates the order books of 'venues' venues, as a list of
+      (market name, asks, bids) tuples.  A venue crosses the others with
+      probability 'crossing', by about 'overlap' of its levels (the levels
+      are 2.5 cents apart on average).
+  """
+  rng = random.Random(seed)
+  result = []
+  for k in range(venues):
+    mid = 1000000 + rng.randint(-2, 2)
+    if rng.random() < crossing:
+      mid += 10 + int(2.5 * depth * overlap)
+    asks, bids = generate_order_book(rng, depth, mid)
+    result.append(('Venue%d' % k, asks, bids))
+  return result
+
+def _decimal(value, unit):
+  return '%d.%0*d' % (value // unit, len(str(unit)) - 1, value % unit)
+
+def to_payload(asks, bids, exchange='bitstamp'):
+  """ Returns the payload of an order book in the format of the depth API
+      of an exchange, with prices in cents.
+  """
+  if exchange == 'bitstamp':
+    # Strings, and a timestamp.
+    def encode(levels):
+      return [[_decimal(price, 100), _decimal(amount, 10**8)]
+              for price, amount in levels]
+    data = {'timestamp': '%d' % _NOW, 'bids': encode(bids),
+            'asks': encode(asks)}
+  elif exchange in ('btce', 'campbx'):
+    # Numbers; CampBX capitalizes the keys.
+    def encode(levels):
+      return [[price / 100, amount / 1e8] for price, amount in levels]
+    ask_key, bid_key = (('asks', 'bids') if exchange == 'btce' else
+                        ('Asks', 'Bids'))
+    data = {ask_key: encode(asks), bid_key: encode(bids)}
+  elif exchange == 'mtgox':
+    # Objects, in ascending order of price on both sides.
+    def encode(levels):
+      return [{'price': price / 100, 'amount': amount / 1e8,
+               'price_int': '%d' % (price * 1000),
+               'amount_int': '%d' % amount,
+               'stamp': '%d' % (_NOW * 1e6)}
+              for price, amount in sorted(levels)]
+    data = {'result': 'success',
+            'data': {'now': '%d' % (_NOW * 1e6), 'currency': 'USD',
+                     'item': 'BTC', 'asks': encode(asks),
+                     'bids': encode(bids)}}
+  else:
+    raise ValueError('Unknown exchange: %s' % exchange)
+  return json.dumps(data).encode('utf8')
+
+def generate_payload(depth, seed=0, exchange='bitstamp'):
+  """ Generates a payload with 'depth' levels on each side around 100.00.
+  """
+  asks, bids = generate_order_book(random.Random(seed), depth, 10000)
+  return to_payload(asks, bids, exchange)
+
+def to_order_book(asks, bids):
+  """ Returns an unvalidated OrderBook of the lists.
+  """
+  order_book = OrderBook.from_lists(asks, bids)
+  order_book.timestamp = _NOW
+  return order_book
+
+def matched_levels(rng, depth):
+  """ Returns 'depth' levels of buys and sells of equal amounts, in the
+      format _process_buys_sells() expects.
+  """
+  buys, sells = [], []
+  buy, sell = 1000000, 1010000
+  for _ in range(depth):
+    amount = rng.randint(1, 10**8)
+    buy += rng.randint(0, 2)
+    sell -= rng.randint(0, 2)
+    buys.append((buy, amount))
+    sells.append((sell, amount))
+  return buys, sells
+
+class Benchmark(object):
+  """ A named operation.  'setup()' returns the callable to time, so the
+      inputs are built outside of the measurements.  'group' and 'x' place
+      the benchmark on a scaling curve (eg, 'process' vs 8 venues).
+  """
+  def __init__(self, group, x, setup):
+    self.group = group
+    self.x = x
+    self.setup = setup
+
+  @property
+  def name(self):
+    return '%s[%s]' % (self.group, self.x)
+
+def _payload_benchmarks(label, body, exchange='bitstamp', budgeted=False):
+  watcher = create_exchange_watcher(exchange)
+  if not budgeted:
+    # The whole payload is parsed, instead of the configured depth budget.
+    watcher.depth_budget = None
+  json_data = json.loads(body.decode('utf8'))
+  columns = watcher.parse_order_book(body)
+
+  def validate_columns():
+    columns.validated = False
+    return validate_order_book(columns)
+
+  benchmarks = [
+      Benchmark('parse_order_book', label,
+                lambda: lambda: watcher.parse_order_book(body)),
+      Benchmark('parse_order_book(json)', label,
+                lambda: lambda: watcher._parse_order_book_from_json(
+                    json_data)),
+      Benchmark('validate_order_book(columns)', label,
+                lambda: validate_columns),
+  ]
+  if exchange == 'mtgox':
+    return benchmarks
+  ask_key, bid_key = ('Asks', 'Bids') if exchange == 'campbx' else ('asks',
+                                                                   'bids')
+  lists = {'asks': create_price_amount_list(json_data, ask_key, True),
+           'bids': create_price_amount_list(json_data, bid_key, False)}
+  return benchmarks + [
+      Benchmark('create_price_amount_list', label,
+                lambda: lambda: create_price_amount_list(json_data, ask_key,
+                                                         True)),
+      Benchmark('validate_order_book(lists)', label,
+                lambda: lambda: validate_order_book(lists)),
+  ]
+
+def depth_benchmarks(depth, overlap, seed):
+  """ Returns the benchmarks of the operations on one or two order books of
+      'depth' levels.
+  """
+  rng = random.Random(seed)
+  asks, bids = generate_order_book(rng, depth, 1000000)
+  # Bids crossing the asks by 'overlap' of the levels, for process_pair().
+  _, crossing_bids = generate_order_book(
+      rng, depth, 1000000 + 10 + int(2.5 * depth * overlap))
+  benchmarks = _payload_benchmarks(depth, to_payload(asks, bids))
+
+  def process_pair():
+    detector = ArbitrageDetector(fixed_marginal_profit_rate=0.0)
+    detector.process([('Venue0', to_order_book(asks, bids)),
+                      ('Venue1', to_order_book(asks, crossing_bids))],
+                     now=_NOW)
+    return lambda: detector.process_pair('Venue0', 'Venue1', asks,
+                                         crossing_bids)
+
+  def process_buys_sells():
+    detector = ArbitrageDetector()
+    buys, sells = matched_levels(random.Random(seed), depth)
+    return lambda: detector._process_buys_sells('Venue0', 'Venue1', buys,
+                                                sells)
+
+  benchmarks.append(Benchmark('process_pair', depth, process_pair))
+  benchmarks.append(Benchmark('_process_buys_sells', depth,
+                              process_buys_sells))
+  return benchmarks
+
+def _process_benchmark(group, x, order_books, cached):
+  def setup():
+    detector = ArbitrageDetector(fixed_marginal_profit_rate=0.0)
+    detector.process(order_books, now=_NOW)
+    if cached:
+      return lambda: detector.process(order_books, now=_NOW)
+
+    def process():
+      # Every pair is detected again, as when all the books change.
+      detector.pair_cache.clear()
+      return detector.process(order_books, now=_NOW)
+    return process
+  return Benchmark(group, x, setup)
+
+def venue_benchmarks(venues, depth, crossing, overlap, seed):
+  """ Returns the benchmarks of process() over a round of 'venues' order
+      books of 'depth' levels.
+  """
+  order_books = [(name, to_order_book(asks, bids)) for name, asks, bids in
+                 generate_venues(venues, depth, crossing, overlap, seed)]
+  for _, order_book in order_books:
+    validate_order_book(order_book)
+  return [_process_benchmark('process', venues, order_books, False),
+          _process_benchmark('process(cached)', venues, order_books, True)]
+
+def payload_benchmarks(payloads):
+  """ Returns the benchmarks of (exchange, path) payloads: each on its own,
+      and all of them as the venues of a round.
+  """
+  benchmarks = []
+  order_books = []
+  for exchange, path in payloads:
+    with open(path, 'rb') as fp:
+      body = fp.read()
+    label = '%s:%s' % (exchange, os.path.basename(path))
+    benchmarks.extend(_payload_benchmarks(label, body, exchange, True))
+    order_book = create_exchange_watcher(exchange).parse_order_book(body)
+    if order_book is None:
+      raise ValueError('Cannot parse %s as a %s payload' % (path, exchange))
+    order_book.timestamp = _NOW
+    order_books.append((label, order_book))
+  benchmarks.append(_process_benchmark('process', 'payloads', order_books,
+                                       False))
+  return benchmarks
+
+def write_fixtures(directory, depth=100):
+  """ Writes a payload of 'depth' levels per exchange format to
+      'directory'.
+  """
+  for exchange in _EXCHANGES:
+    with open(os.path.join(directory, exchange + '.json'), 'wb') as fp:
+      fp.write(generate_payload(depth, exchange=exchange))
+
+def measure(function, repeat):
+  """ Returns the (operations per second, peak bytes allocated) of a
+      callable.  The number of calls per measurement is chosen so that one
+      takes at least 0.2 seconds, and the best of 'repeat' is kept.
+  """
+  timer = timeit.Timer(function)
+  number, _ = timer.autorange()
+  seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+  tracemalloc.start()
+  try:
+    tracemalloc.reset_peak()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+  finally:
+    tracemalloc.stop()
+  return 1.0 / seconds, peak
+
+def run(benchmarks, repeat):
+  """ Runs the benchmarks, prints their results as they complete, and
+      returns a dict mapping a benchmark name to its results.
+  """
+  # The detection logs every round.
+  logging.disable(logging.INFO)
+  results = dict()
+  print('%-48s %14s %12s' % ('benchmark', 'ops/sec', 'peak KiB'))
+  for benchmark in benchmarks:
+    ops, peak = measure(benchmark.setup(), repeat)
+    results[benchmark.name] = {'group': benchmark.group, 'x': benchmark.x,
+                               'ops_per_sec': ops, 'peak_bytes': peak}
+    print('%-48s %14.1f %12.1f' % (benchmark.name, ops, peak / 1024.0))
+  return results
+
+def print_curves(results):
+  """ Prints the scaling curves: for each group with more than one numeric
+      x, the time per operation at each x and the log-log slope from the
+      previous point (1.0 is linear).
+  """
+  groups = dict()
+  for result in results.values():
+    if isinstance(result['x'], int):
+      groups.setdefault(result['group'], []).append(result)
+  for group in sorted(groups):
+    points = sorted(groups[group], key=lambda result: result['x'])
+    if len(points) < 2:
+      continue
+    print('\n%s:' % group)
+    last = None
+    for point in points:
+      seconds = 1.0 / point['ops_per_sec']
+      slope = ''
+      if last is not None:
+        slope = 'slope %.2f' % (
+            math.log(seconds / last[1]) / math.log(point['x'] / last[0]))
+      print('  %8d %12.3f us %12.1f KiB  %s' % (
+          point['x'], seconds * 1e6, point['peak_bytes'] / 1024.0, slope))
+      last = (point['x'], seconds)
+
+def compare(results, baseline, tolerance):
+  """ Prints the changes from a baseline, and returns the names of the
+      regressed benchmarks.
+  """
+  regressions = []
+  print('\n%-48s %10s %10s' % ('vs baseline', 'speed', 'memory'))
+  for name, result in sorted(results.items()):
+    if name not in baseline:
+      continue
+    base = baseline[name]
+    speed = result['ops_per_sec'] / base['ops_per_sec']
+    memory = result['peak_bytes'] / max(base['peak_bytes'], 1)
+    regressed = speed < 1 - tolerance or memory > 1 + tolerance
+    if regressed:
+      regressions.append(name)
+    print('%-48s %9.2fx %9.2fx%s' % (name, speed, memory,
+                                      '  REGRESSION' if regressed else ''))
+  return regressions
+
+def _int_list(value):
+  return [int(x) for x in value.split(',') if x]
+
+def _payload(value):
+  exchange, _, path = value.partition('=')
+  if exchange not in _EXCHANGES or not path:
+    raise argparse.ArgumentTypeError('Expected exchange=path, with one of'
+                                     ' the exchanges %s' % (_EXCHANGES,))
+  return exchange, path
+
+def main():
+  parser = argparse.ArgumentParser()
+  parser.add_argument('--depths', type=_int_list, default=[100, 1000, 10000],
+                      help='The depths of the order books, comma-separated.')
+  parser.add_argument('--venues', type=_int_list, default=[2, 4, 8, 16],
+                      help='The numbers of venues of process(),'
+                           ' comma-separated.')
+  parser.add_argument('--venue_depth', type=int, default=1000,
+                      help='The depth of the order books of process().')
+  parser.add_argument('--crossing', type=float, default=0.5,
+                      help='The probability of a venue to cross the others.')
+  parser.add_argument('--overlap', type=float, default=0.1,
+                      help='The fraction of levels a crossing venue crosses'
+                           ' by.')
+  parser.add_argument('--payload', action='append', type=_payload,
+                      help='A recorded payload of an exchange, as'
+                           ' exchange=path (default: the fixtures).')
+  parser.add_argument('--write_fixtures', action='store_true',
+                      help='Regenerates the fixtures and exits.')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--repeat', type=int, default=3)
+  parser.add_argument('--save', help='Saves the results to a file.')
+  parser.add_argument('--baseline', help='Compares with saved results.')
+  parser.add_argument('--tolerance', type=float, default=0.2,
+                      help='The relative slowdown or growth of memory'
+                           ' flagged as a regression.')
+  args = parser.parse_args()
+  if args.write_fixtures:
+    write_fixtures(_FIXTURES)
+    return
+  benchmarks = []
+  for depth in args.depths:
+    benchmarks.extend(depth_benchmarks(depth, args.overlap, args.seed))
+  for venues in args.venues:
+    benchmarks.extend(venue_benchmarks(venues, args.venue_depth,
+                                       args.crossing, args.overlap,
+                                       args.seed))
+  benchmarks.extend(payload_benchmarks(
+      args.payload or [(exchange, os.path.join(_FIXTURES, exchange + '.json'))
+                       for exchange in _EXCHANGES]))
+  results = run(benchmarks, args.repeat)
+  print_curves(results)
+  if args.save:
+    with open(args.save, 'w') as fp:
+      json.dump({'python': platform.python_version(), 'results': results},
+                fp, indent=2, sort_keys=True)
+  if args.baseline:
+    with open(args.baseline) as fp:
+      baseline = json.load(fp)
+    if baseline.get('python') != platform.python_version():
+      print('Warning: the baseline was run with Python %s' %
+            baseline.get('python'))
+    if compare(results, baseline['results'], args.tolerance):
+      sys.exit(1)
+
+if __name__ == '__main__':
+  main()
@@ -1,101 +1,361 @@
-#!/usr/bin/python2.7
+#!/usr/bin/python3
 
-""" Generates price curves from arbitrageur log.
+""" Generates price curves from arbitrageur logs.
+
+The log is streamed in parallel chunks (split at line boundaries), and the
+opportunities of each pair of markets are downsampled into time buckets of
+'--bucket_sec', keeping the number of opportunities and the min/max/last
+buy price, sell price and profit of each bucket.  The curves are written
+into a compact data file next to the html page, which loads it after the
+page and draws a chart only when it is opened, so months of logs give a
+small page.
+
+The opportunities can also be read from a binary journal (see
+opportunity_sink.py, and 'arbitrageur.py --journal') with '--journal_file',
+which needs no parsing and keeps the exact prices.
+
+With '--checkpoint', the buckets and the offset of the processed log are
+saved, so that a re-run only processes the bytes appended to the log since.
+A log that was rotated or truncated (ie, whose first bytes changed, or which
+got shorter) is processed from the start again.
+
+Eg:
+    gen_curves.py --log_file arbitrageur.log --html_file curves.html \
+        --checkpoint curves.checkpoint
 """
 
 import argparse
+import json
+import os
 import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                '..'))
+
+from instruments import pair_instrument, price_multiplier
+from opportunity_sink import JournalReader
+
+# The time zone of the log timestamps, set by arbitrageur.py.
+_LOG_TZ = 'US/Pacific'
+
+# Eg, [INFO] 2013-05-08 12:03:33,430 Opportunity: buy=109.77 sell=113.06 from=BTC-E to=Bitstamp amount=32.46127753 pay=3563.22 paid=3670.14 profit=106.92 rate=3.00% mrate=2.01% currency=USD
+# Market names may contain spaces, eg, 'MtGox BTC/EUR'.  The prices and the
+# profit are in units of the quote currency (eg, 0.02500000 BTC for LTC/BTC).
+_PATTERN = re.compile(
+    rb'\[INFO\] (\d{4})-(\d{2})-(\d{2}) (\d{2}):(\d{2}):(\d{2}),\d{3}'
+    rb' Opportunity: buy=([\d.]+) sell=([\d.]+) from=(.+?) to=(.+?)'
+    rb' amount=[\d.]+ pay=[\d.]+ paid=[\d.]+ profit=(-?[\d.]+)')
 
-# Eg, [INFO] 2013-05-08 12:03:33,430 Opportunity: buy=109.77 sell=113.06 from=BTC-E to=Bitstamp amount=32.46127753 pay=3563.22 paid=3670.14 profit=106.92 rate=3.00% mrate=2.01%
-time_pattern = '\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2},\d{3}'
-pattern = ('\[INFO\] (?P<time>%s) Opportunity: buy=(?P<buy>[\d.]+)'
-           ' sell=(?P<sell>[\d.]+) from=(?P<from>[\w-]+) to=(?P<to>[\w-]+)'
-           ' amount=(?P<amount>[\d.]+) pay=(?P<pay>[\d.]+)'
-           ' paid=(?P<paid>[\d.]+) profit=(?P<profit>[\d.]+)'
-           ' rate=(?P<rate>[\d.]+)%% mrate=(?P<mrate>[\d.]+)%%') % time_pattern
+# The bytes of the log identifying it, see _log_identity().
+_IDENTITY_BYTES = 4096
 
-def process(log_file, html_file):
-  prog = re.compile(pattern)
+# The fields of a bucket.
+_COUNT = 0
+_BUY_MIN, _BUY_MAX, _BUY_LAST = 1, 2, 3
+_SELL_MIN, _SELL_MAX, _SELL_LAST = 4, 5, 6
+_PROFIT_MIN, _PROFIT_MAX, _PROFIT_LAST = 7, 8, 9
+_COLUMNS = ['count', 'buy_min', 'buy_max', 'buy_last', 'sell_min',
+            'sell_max', 'sell_last', 'profit_min', 'profit_max',
+            'profit_last']
+
+def add(curves, key, bucket, buy, sell, profit):
+  """ Adds an opportunity to the curves, which map a pair key (eg,
+      'BTC-E:Bitstamp') to a dict mapping the start time of a bucket to its
+      fields.  The opportunities should be added in order.
+  """
+  buckets = curves.setdefault(key, dict())
+  fields = buckets.get(bucket, None)
+  if fields is None:
+    buckets[bucket] = [1, buy, buy, buy, sell, sell, sell, profit, profit,
+                       profit]
+    return
+  fields[_COUNT] += 1
+  for value, first in ((buy, _BUY_MIN), (sell, _SELL_MIN),
+                       (profit, _PROFIT_MIN)):
+    if value < fields[first]:
+      fields[first] = value
+    if value > fields[first + 1]:
+      fields[first + 1] = value
+    fields[first + 2] = value
+
+def merge(curves, other):
+  """ Merges the curves of a later part of the log into 'curves'.
+  """
+  for key, other_buckets in other.items():
+    buckets = curves.setdefault(key, dict())
+    for bucket, other_fields in other_buckets.items():
+      fields = buckets.get(bucket, None)
+      if fields is None:
+        buckets[bucket] = other_fields
+        continue
+      fields[_COUNT] += other_fields[_COUNT]
+      for first in (_BUY_MIN, _SELL_MIN, _PROFIT_MIN):
+        fields[first] = min(fields[first], other_fields[first])
+        fields[first + 1] = max(fields[first + 1], other_fields[first + 1])
+        fields[first + 2] = other_fields[first + 2]
+
+def process_chunk(log_file, start, end, bucket_sec):
+  """ Returns the curves of the lines in [start, end) of a log, where both
+      are at the start of a line.
+  """
   curves = dict()
-  with open(log_file, 'r') as fp:
-    while True:
+  with open(log_file, 'rb') as fp:
+    fp.seek(start)
+    remaining = end - start
+    while remaining > 0:
       line = fp.readline()
-      if line == '':
+      if not line:
         break
-      result = prog.match(line[:-1])
+      remaining -= len(line)
+      # Most of the lines are not opportunities.
+      if b'Opportunity:' not in line:
+        continue
+      result = _PATTERN.match(line)
       if result is None:
         continue
-      time = result.group('time')
-      source = result.group('from')
-      destination = result.group('to')
-      buy = float(result.group('buy'))
-      sell = float(result.group('sell'))
-      profit = float(result.group('profit'))
-      key = '%s:%s' % (source, destination)
-      if key not in curves:
-        curves[key] = [[time[5:-7], buy, sell, profit]]
-      else:
-        curves[key].append([time[5:-7], buy, sell, profit])
+      groups = result.groups()
+      # The local time of the log, as an epoch like the journal's.
+      timestamp = int(time.mktime(
+          tuple(int(value) for value in groups[:6]) + (0, 0, -1)))
+      key = '%s:%s' % (groups[8].decode('utf8'), groups[9].decode('utf8'))
+      add(curves, key, timestamp - timestamp % bucket_sec, float(groups[6]),
+          float(groups[7]), float(groups[10]))
+  return curves
+
+def split_chunks(log_file, start, end, num_chunks):
+  """ Splits [start, end) of a log into about 'num_chunks' ranges, moving
+      every boundary to the start of the next line.
+  """
+  size = max(1, (end - start) // num_chunks)
+  boundaries = [start]
+  with open(log_file, 'rb') as fp:
+    for k in range(1, num_chunks):
+      position = start + k * size
+      if position <= boundaries[-1]:
+        continue
+      fp.seek(position - 1)
+      position += len(fp.readline()) - 1
+      if position >= end:
+        break
+      boundaries.append(position)
+  boundaries.append(end)
+  return list(zip(boundaries[:-1], boundaries[1:]))
+
+def _log_identity(log_file):
+  with open(log_file, 'rb') as fp:
+    return fp.read(_IDENTITY_BYTES).hex()
+
+def _complete_end(log_file):
+  """ Returns the offset after the last complete line of a log, so a line
+      being written is left for the next run.
+  """
+  with open(log_file, 'rb') as fp:
+    end = fp.seek(0, os.SEEK_END)
+    while end > 0:
+      fp.seek(max(0, end - 65536))
+      block = fp.read(end - max(0, end - 65536))
+      newline = block.rfind(b'\n')
+      if newline >= 0:
+        return end - len(block) + newline + 1
+      end -= len(block)
+  return 0
+
+def load_checkpoint(path, log_file, bucket_sec):
+  """ Returns the (offset, curves) of a checkpoint, or (0, {}) if there is
+      no usable checkpoint for the log.
+  """
+  if path is None or not os.path.exists(path):
+    return 0, dict()
+  with open(path, 'r') as fp:
+    checkpoint = json.load(fp)
+  identity = _log_identity(log_file)
+  # The buckets of older checkpoints read the log timestamps as UTC.
+  if (checkpoint['bucket_sec'] != bucket_sec or
+      checkpoint.get('time_zone') != _LOG_TZ or
+      checkpoint['offset'] > os.path.getsize(log_file) or
+      not identity.startswith(checkpoint['identity'])):
+    return 0, dict()
+  curves = dict((key, dict((int(bucket), fields)
+                           for bucket, fields in buckets.items()))
+                for key, buckets in checkpoint['curves'].items())
+  return checkpoint['offset'], curves
+
+def save_checkpoint(path, log_file, bucket_sec, offset, curves):
+  """ Saves a checkpoint, atomically replacing the old one.
+  """
+  checkpoint = {'identity': _log_identity(log_file)[:2 * offset],
+                'bucket_sec': bucket_sec, 'time_zone': _LOG_TZ,
+                'offset': offset,
+                'curves': curves}
+  temp_path = path + '.tmp'
+  with open(temp_path, 'w') as fp:
+    json.dump(checkpoint, fp, separators=(',', ':'))
+  os.replace(temp_path, path)
+
+def process(log_file, bucket_sec=3600, checkpoint=None, max_workers=None):
+  """ Returns the curves of a log, processing only the bytes appended since
+      the checkpoint, if any, and updating the checkpoint.
+  """
+  # The workers inherit the time zone of the log timestamps.
+  os.environ['TZ'] = _LOG_TZ
+  time.tzset()
+  start, curves = load_checkpoint(checkpoint, log_file, bucket_sec)
+  end = _complete_end(log_file)
+  if end > start:
+    num_chunks = (max_workers or os.cpu_count() or 1) * 4
+    chunks = split_chunks(log_file, start, end, num_chunks)
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+      futures = [executor.submit(process_chunk, log_file, chunk_start,
+                                 chunk_end, bucket_sec)
+                 for chunk_start, chunk_end in chunks]
+      for future in futures:
+        merge(curves, future.result())
+  if checkpoint is not None:
+    save_checkpoint(checkpoint, log_file, bucket_sec, end, curves)
+  return curves
+
+def process_journal(journal_file, bucket_sec=3600, checkpoint=None):
+  """ Returns the curves of a journal, processing only the records appended
+      since the checkpoint, if any, and updating the checkpoint.
+  """
+  start, curves = load_checkpoint(checkpoint, journal_file, bucket_sec)
+  reader = JournalReader(journal_file)
+  try:
+    # Maps the (buy market, sell market) of a record to its pair key and
+    # the multiplier of its prices (in the smallest unit of the quote
+    # currency, eg, cents).
+    keys = dict()
+    for values in reader.raw_records(start // reader.record_size):
+      names = values[1:3]
+      cached = keys.get(names, None)
+      if cached is None:
+        markets = [name.rstrip(b'\0').decode('utf8') for name in names]
+        cached = keys[names] = ('%s:%s' % tuple(markets), float(
+            price_multiplier(pair_instrument(*markets))))
+      key, multiplier = cached
+      timestamp = int(values[0])
+      add(curves, key, timestamp - timestamp % bucket_sec,
+          values[5] / multiplier, values[8] / multiplier,
+          (values[11] - values[10]) / multiplier)
+    end = len(reader) * reader.record_size
+  finally:
+    reader.close()
+  if checkpoint is not None:
+    save_checkpoint(checkpoint, journal_file, bucket_sec, end, curves)
+  return curves
+
+def write_data(data_file, curves):
+  """ Writes the curves as a script defining 'curves', which maps a pair key
+      to its columns: {'time': [...], 'count': [...], 'buy_min': [...], ...}.
+  """
+  data = dict()
+  for key, buckets in curves.items():
+    times = sorted(buckets.keys())
+    columns = {'time': times}
+    for i, name in enumerate(_COLUMNS):
+      columns[name] = [round(buckets[bucket][i], 2) for bucket in times]
+    data[key] = columns
+  with open(data_file, 'w') as fp:
+    fp.write('var curves = ')
+    json.dump(data, fp, separators=(',', ':'), sort_keys=True)
+    fp.write(';\n')
+
+_HTML = """<html>
+  <head>
+    <script type="text/javascript"
+            src="https://www.gstatic.com/charts/loader.js"></script>
+    <script type="text/javascript">
+      google.charts.load("current", {packages: ["corechart"]});
+
+      function drawChart(key, div) {
+        var columns = curves[key];
+        var pair = key.split(":");
+        var data = new google.visualization.DataTable();
+        data.addColumn("datetime", "time");
+        data.addColumn("number", pair[0] + " (buy)");
+        data.addColumn("number", pair[1] + " (sell)");
+        data.addColumn("number", "max profit");
+        for (var i = 0; i < columns.time.length; i++) {
+          data.addRow([new Date(columns.time[i] * 1000), columns.buy_last[i],
+                       columns.sell_last[i], columns.profit_max[i]]);
+        }
+        new google.visualization.LineChart(div).draw(data, {
+            title: "buy " + pair[0] + ", sell " + pair[1],
+            series: {2: {targetAxisIndex: 1}}});
+      }
+
+      // Loads the data after the page, and draws a chart when it is opened.
+      window.onload = function() {
+        var script = document.createElement("script");
+        script.src = "%(data_file)s";
+        script.onload = function() {
+          google.charts.setOnLoadCallback(function() {
+            var body = document.body;
+            Object.keys(curves).sort().forEach(function(key) {
+              var details = document.createElement("details");
+              var summary = document.createElement("summary");
+              var total = curves[key].count.reduce(function(a, b) {
+                return a + b;
+              }, 0);
+              summary.textContent = key + " - " + total + " opportunities";
+              var div = document.createElement("div");
+              div.style.width = "1600px";
+              div.style.height = "800px";
+              details.appendChild(summary);
+              details.appendChild(div);
+              details.addEventListener("toggle", function() {
+                if (details.open && !div.hasChildNodes()) {
+                  drawChart(key, div);
+                }
+              });
+              body.appendChild(details);
+            });
+          });
+        };
+        document.head.appendChild(script);
+      };
+    </script>
+  </head>
+  <body>
+  </body>
+</html>
+"""
+
+def write_html(html_file, curves):
+  """ Writes the page and its data file (eg, curves.data.js for
+      curves.html).
+  """
+  data_file = os.path.splitext(html_file)[0] + '.data.js'
+  write_data(data_file, curves)
   with open(html_file, 'w') as fp:
-    html_lines = []
-    print >> fp, '<html>'
-    print >> fp, '  <head>'
-    print >> fp, '    <script type="text/javascript"'
-    print >> fp, '            src="https://www.google.com/jsapi">'
-    print >> fp, '    </script>'
-    print >> fp, '    <script type="text/javascript">'
-    print >> fp, '      google.load("visualization", "1",'
-    print >> fp, '                  {packages:["corechart"]});'
-    print >> fp, '      google.setOnLoadCallback(drawChart);'
-    print >> fp, '      function drawChart() {'
-    for key, data in curves.iteritems():
-      source, destination = key.split(':')
-      var_prefix = '%s_%s' % (source.replace('-', '_'),
-                              destination.replace('-', '_'))
-      data_var = '%s_data' % var_prefix
-      options_var = '%s_options' % var_prefix
-      chart_var = '%s_chart' % var_prefix
-      chart_div = '%s_div' % var_prefix
-      # Prints a curve entry to JS code, eg:
-      # var data = google.visualization.arrayToDataTable([
-      #          ['Year', 'Sales', 'Expenses'],
-      #          ['2004',  1000,      400],
-      #          ['2005',  1170,      460],
-      #          ['2006',  660,       1120],
-      #          ['2007',  1030,      540]
-      #        ]);
-      fp.write('var %s = google.visualization.arrayToDataTable([\n'
-               '  ["time", "%s", "%s", "profit"]' %
-               (data_var, source, destination))
-      for row in data:
-        fp.write(',\n    ["%s", %f, %f, %f]' %
-                 (row[0], row[1], row[2], row[3]))
-      fp.write(']);\n')
-      print >> fp, 'var %s = { title: "buy %s, sell %s" }' % (
-          options_var, source, destination)
-      print >> fp, ('var %s = new google.visualization.LineChart('
-             'document.getElementById("%s"));' % (chart_var, chart_div))
-      print >> fp, '%s.draw(%s, %s);' % (chart_var, data_var, options_var)
-      html_lines.append('<div id="%s" style="width: 1600px; height: 800px;">'
-                        '</div>' % chart_div)
-    print >> fp, '      }'
-    print >> fp, '    </script>'
-    print >> fp, '  </head>'
-    print >> fp, '  <body>'
-    for line in html_lines:
-      print >> fp, line
-    print >> fp, '  </body>'
-    print >> fp, '</html>'
-  for key in sorted(curves.keys()):
-    print '%s - %d transactions' % (key, len(curves[key]))
+    fp.write(_HTML % {'data_file': os.path.basename(data_file)})
 
 def main():
   parser = argparse.ArgumentParser()
-  parser.add_argument('--log_file', required=True)
+  source = parser.add_mutually_exclusive_group(required=True)
+  source.add_argument('--log_file')
+  source.add_argument('--journal_file')
   parser.add_argument('--html_file', required=True)
+  parser.add_argument('--bucket_sec', type=int, default=3600,
+                      help='The duration of a point of the curves.')
+  parser.add_argument('--checkpoint',
+                      help='Save the progress to this file, and only process'
+                           ' the newly appended log on the next run.')
+  parser.add_argument('--workers', type=int, default=None)
   args = parser.parse_args()
-  process(args.log_file, args.html_file)
+  if args.journal_file:
+    curves = process_journal(args.journal_file, args.bucket_sec,
+                             args.checkpoint)
+  else:
+    curves = process(args.log_file, args.bucket_sec, args.checkpoint,
+                     args.workers)
+  write_html(args.html_file, curves)
+  for key in sorted(curves.keys()):
+    print('%s - %d transactions' % (
+        key, sum(fields[_COUNT] for fields in curves[key].values())))
 
 if __name__ == '__main__':
   main()
-
@@ -1,35 +1,49 @@
 """ Utility functions for the arbitrageur program.
 """
 
-import config
 import json
 import logging
+import operator
+from http.client import HTTPException
+from http_client import HTTPClient, HTTPError
+from order_book import OrderBook
 from socket import timeout
-from urllib.request import URLError, urlopen
 
-def read_json(url):
-  """ Opens URL and returns the parsed json object, or None if failed.
+# The HTTP client shared by all the exchange watchers, so connections are
+# kept alive across rounds.
+http_client = HTTPClient()
+
+def read_url(url):
+  """ Opens URL and returns the content as bytes, or None if failed.
+
+  If the content has not changed since the last read, the very same bytes
+  object as the last read is returned.
   """
   try:
-    text = urlopen(url, None, config.timeout_sec).read().decode('utf8')
-  except URLError:
-    logging.error('Failed to open url: %s' % url)
-    return None
+    return http_client.get(url)
   except timeout:
     logging.error('Socket timed out: %s' % url)
     return None
-  except Exception as ex:
-    # TODO: This is for ConnectionResetError, and maybe there are others
-    #       buried in the urlopen(), read() and decode() methods.
-    #       Prefer not to use general Exception.
-    logging.error('Failed to load content from url %s: %s' % (url, str(ex)))
+  except (HTTPError, HTTPException, OSError, ValueError) as ex:
+    logging.error('Failed to open url %s: %s' % (url, str(ex)))
     return None
+
+def parse_json(body, url=None):
+  """ Parses a json object from bytes, or returns None if failed.
+  """
   try:
-    data = json.loads(text)
+    return json.loads(body.decode('utf8'))
   except Exception:
-    logging.error('Failed to parse the content of %s: %s' % (url, text))
+    logging.error('Failed to parse the content of %s: %s' % (url, body))
     return None
-  return data
+
+def read_json(url):
+  """ Opens URL and returns the parsed json object, or None if failed.
+  """
+  body = read_url(url)
+  if body is None:
+    return None
+  return parse_json(body, url)
 
 def _convert_value(value, identifier, multiplier):
   try:
@@ -38,14 +52,15 @@ def _convert_value(value, identifier, multiplier):
     logging.error('ValueError in converting %s: %s' % (identifier, value))
     return None
 
-def convert_price(price):
+def convert_price(price, multiplier=100):
   """ Converts a price (eg, 12.34) to cents (int 1234), or None if
-      there was a conversion error.
+      there was a conversion error.  For a quote currency other than cents
+      (eg, satoshis), pass its multiplier.
 
   TODO: MtGox supports a max of five decimal points for prices.
         Figure out whether we should do anything about it.
   """
-  return _convert_value(price, 'price', 100)
+  return _convert_value(price, 'price', multiplier)
 
 def convert_amount(amount):
   """ Converts a bitcoin amount (eg, 0.12345678) to satoshis
@@ -53,13 +68,30 @@ def convert_amount(amount):
   """
   return _convert_value(amount, 'amount', 100000000)
 
-def create_price_amount_list(order_book_data, key, ascending):
+def all_converted(price_amount_list):
+  """ Returns whether all the prices and amounts in a list were converted
+      successfully into positive values (see convert_price() and
+      convert_amount()).
+  """
+  for price, amount in price_amount_list:
+    if price is None or amount is None:
+      return False
+    if price <= 0 or amount <= 0:
+      logging.error('Non-positive price or amount: %s, %s' % (price, amount))
+      return False
+  return True
+
+def create_price_amount_list(order_book_data, key, ascending,
+                             price_multiplier=100):
   """ Creates and returns the price-amount list from order book data,
       or None if the list could not be created.
 
   The order book data should be a dict extracted from the json object.
   The 'key' specifies the entry of interest in the order book (eg, 'asks'),
   and 'ascending' specifies the desired order of price in the output list.
+  Prices are converted by 'price_multiplier' (see convert_price()).  The
+  list is valid (see validate_order_book()), so an OrderBook built from the
+  lists can be marked as validated.
 
   This method can be used to handle several API sources in the format of:
       {'asks': [[p0, a0], [p1, a1], ...],
@@ -71,35 +103,44 @@ def create_price_amount_list(order_book_data, key, ascending):
         (key, order_book_data))
     return None
   try:
-    price_amount_list = [(convert_price(data[0]), convert_amount(data[1]))
+    price_amount_list = [(convert_price(data[0], price_multiplier),
+                          convert_amount(data[1]))
         for data in price_amount_data]
   except ValueError:
     logging.error('ValueError in price-amount list: %s' % price_amount_data)
     return None
+  if not all_converted(price_amount_list):
+    return None
   price_amount_list.sort(key=lambda x: x[0], reverse=not ascending)
   return price_amount_list
 
 def _validate_price_amount_list(pa_list, ascending):
-  if len(pa_list) == 0:
+  # A single pass, stopping at the first invalid level.
+  last_price = None
+  for level in pa_list:
+    if len(level) != 2:
+      return False
+    price, amount = level
+    if not (isinstance(price, int) and isinstance(amount, int) and
+            price > 0 and amount > 0):
+      return False
+    if last_price is not None and (price < last_price if ascending
+                                   else price > last_price):
+      return False
+    last_price = price
+  return True
+
+def _validate_columns(prices, amounts, ascending):
+  if len(prices) != len(amounts):
+    return False
+  if len(prices) == 0:
     return True
-  di, dj = 0, 1
-  if not ascending:
-    di, dj = 1, 0
-  ok = all([len(pa_list[i]) == 2 and
-            isinstance(pa_list[i][0], int) and
-            isinstance(pa_list[i][1], int) and
-            pa_list[i][0] > 0 and
-            pa_list[i][1] > 0 and
-            pa_list[i+di][0] <= pa_list[i+dj][0]
-            for i in range(len(pa_list) - 1)])
-  if not ok:
+  # The columns are int64 arrays, so there is no need to check the types.
+  if min(prices) <= 0 or min(amounts) <= 0:
     return False
-  # Check the last entry.
-  return (len(pa_list[-1]) == 2 and
-          isinstance(pa_list[-1][0], int) and
-          isinstance(pa_list[-1][1], int) and
-          pa_list[-1][0] > 0 and
-          pa_list[-1][1] > 0)
+  if ascending:
+    return all(map(operator.le, prices, prices[1:]))
+  return all(map(operator.ge, prices, prices[1:]))
 
 def validate_order_book(order_book):
   """ Validates an order book, returns True if it is valid, False otherwise.
@@ -110,7 +151,18 @@ def validate_order_book(order_book):
   descending prices.  As an arbitrageur, we are interested in the lowest
   buying prices and highest selling prices, the top entries of both lists.
   Prices and amounts should be sane numbers (positive int after conversion).
+  An OrderBook is validated on its columns directly, unless it is already
+  marked as validated, and is then marked as validated if it is valid.
   """
+  if isinstance(order_book, OrderBook):
+    if order_book.validated:
+      return True
+    order_book.validated = (
+        _validate_columns(order_book.ask_prices, order_book.ask_amounts,
+                          ascending=True) and
+        _validate_columns(order_book.bid_prices, order_book.bid_amounts,
+                          ascending=False))
+    return order_book.validated
   if (len(order_book) != 2 or
       'asks' not in order_book or
       'bids' not in order_book):